@@ -0,0 +1,189 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+
+class CostModel:
+    """Predicts CPU-seconds for an analysis from audio duration, calibrated from recorded stage timings"""
+
+    # CPU-seconds per second of audio for each stage, seeded from benchmark.py runs
+    DEFAULT_RATES = {
+        'decode': 0.004,
+        'voice_activity': 0.0002,
+        'harmonic_separation': 0.014,
+        'noise_gate': 0.002,
+        'instrument_preview': 0.0008,
+        'spectrogram': 0.0008,
+        'onset_envelope': 0.0002,
+        'onset_detect': 0.00001,
+        'pitch_peaks': 0.0015,
+        'semitones': 0.0001,
+        'note_picking': 0.0001,
+        'classify_instrument': 0.003,
+        'key_tempo': 0.001,
+        'fingerprint': 0.0001
+    }
+    # Fixed cost per request regardless of length (figures, synthesis, page render)
+    BASE_SECONDS = 0.5
+
+    def __init__(self, smoothing: float = 0.2):
+        self.rates = dict(self.DEFAULT_RATES)
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def stages(profile: Dict) -> List[str]:
+        """Stages an analysis profile runs"""
+        stages = ['decode', 'instrument_preview', 'spectrogram', 'onset_envelope', 'onset_detect',
+                  'note_picking', 'pitch_peaks', 'classify_instrument', 'key_tempo', 'fingerprint']
+        if profile.get('skip_silence'):
+            stages.append('voice_activity')
+        if profile.get('separate'):
+            stages.append('harmonic_separation')
+        if profile.get('gate'):
+            stages.append('noise_gate')
+        if profile.get('note_engine') == 'semitone':
+            stages.append('semitones')
+        return stages
+
+    def estimate(self, duration: float, profile: Dict) -> float:
+        """Predicted CPU-seconds to analyse duration seconds of audio with the given profile"""
+        with self._lock:
+            rate = sum(self.rates.get(stage, 0.0) for stage in self.stages(profile))
+        # Polyphonic picking scales with the number of voices
+        rate += self.rates['note_picking'] * (max(profile.get('polyphony', 1), 1) - 1)
+        return self.BASE_SECONDS + rate * duration
+
+    def calibrate(self, timings: Dict[str, float], duration: float):
+        """Move each stage's rate towards its observed seconds per second of audio"""
+        if duration <= 0:
+            return
+        with self._lock:
+            for stage, elapsed in timings.items():
+                observed = elapsed / duration
+                previous = self.rates.get(stage, observed)
+                self.rates[stage] = previous + self.smoothing * (observed - previous)
+
+
+class Decision(NamedTuple):
+    status: str  # 'accept', 'queue' or 'reject'
+    estimate: float
+    retry_after: float
+    message: str
+
+
+class AdmissionController:
+    """Bounds the estimated CPU-seconds in flight, queueing or rejecting work beyond it"""
+
+    def __init__(self, workers: Optional[int] = None, max_in_flight: float = 60.0, max_wait: float = 30.0):
+        self.workers = workers or os.cpu_count() or 1
+        # Estimated CPU-seconds allowed to run at once, and the longest a request may queue
+        self.max_in_flight = max_in_flight * self.workers
+        self.max_wait = max_wait
+        self.in_flight = 0.0
+        self.queued = 0.0
+        self._condition = threading.Condition()
+
+    def _wait_estimate(self, cost: float) -> float:
+        """Seconds until cost fits, assuming in-flight and queued work drains at full throughput"""
+        excess = self.in_flight + self.queued + cost - self.max_in_flight
+        return max(excess, 0.0) / self.workers
+
+    def decide(self, cost: float) -> Decision:
+        with self._condition:
+            # An idle server accepts anything, so one long job is never starved
+            if self.in_flight == 0 or self.in_flight + self.queued + cost <= self.max_in_flight:
+                return Decision('accept', cost, 0.0, "Processing now")
+            wait = self._wait_estimate(cost)
+        if wait <= self.max_wait:
+            return Decision('queue', cost, wait, f"Server busy, starting in about {wait:.0f} s")
+        return Decision('reject', cost, wait, f"Server overloaded, please retry in about {wait:.0f} s")
+
+    @contextmanager
+    def slot(self, cost: float, timeout: Optional[float] = None):
+        """Hold cost CPU-seconds of capacity for the duration of the block, waiting for it if needed"""
+        timeout = self.max_wait if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            self.queued += cost
+            try:
+                while self.in_flight and self.in_flight + cost > self.max_in_flight:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f"Queued for more than {timeout:.0f} s")
+                    self._condition.wait(remaining)
+            finally:
+                self.queued -= cost
+            self.in_flight += cost
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.in_flight -= cost
+                self._condition.notify_all()
+
+
+class QuotaLedger:
+    """Daily CPU-second quotas per user, persisted in ComputeQuota rows"""
+
+    def __init__(self, db, quota_model, default_daily: float = 600.0):
+        self.db = db
+        self.quota_model = quota_model
+        self.default_daily = default_daily
+
+    def _quota(self, user_id: int):
+        quota = self.quota_model.query.filter_by(user_id=user_id).first()
+        if quota is None:
+            quota = self.quota_model(user_id=user_id, daily_cpu_seconds=self.default_daily,
+                                     used_cpu_seconds=0.0, period_start=date.today())
+            self.db.session.add(quota)
+        elif quota.period_start != date.today():
+            quota.used_cpu_seconds = 0.0
+            quota.period_start = date.today()
+        return quota
+
+    def remaining(self, user_id: int) -> float:
+        quota = self._quota(user_id)
+        self.db.session.commit()
+        return max(quota.daily_cpu_seconds - quota.used_cpu_seconds, 0.0)
+
+    def charge(self, user_id: int, cpu_seconds: float):
+        quota = self._quota(user_id)
+        quota.used_cpu_seconds += cpu_seconds
+        self.db.session.commit()
+
+
+class AnonymousQuotaLedger:
+    """Daily CPU-second quotas for visitors without an account, keyed by client rather than session
+
+    Kept in process memory for the current day, so opening a new tab does not reset a quota.
+    """
+
+    def __init__(self, daily: float = 120.0):
+        self.daily = daily
+        self._day = date.today()
+        self._used: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _roll_over(self):
+        if self._day != date.today():
+            self._day = date.today()
+            self._used = {}
+
+    def remaining(self, client: str) -> float:
+        with self._lock:
+            self._roll_over()
+            return max(self.daily - self._used.get(client, 0.0), 0.0)
+
+    def charge(self, client: str, cpu_seconds: float):
+        with self._lock:
+            self._roll_over()
+            self._used[client] = self._used.get(client, 0.0) + cpu_seconds
+
+
+def measured_cost(timings: Iterable[float]) -> float:
+    """CPU-seconds actually spent, as charged against quotas"""
+    return float(sum(timings)) + CostModel.BASE_SECONDS
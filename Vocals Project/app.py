@@ -1,8 +1,24 @@
 import streamlit as st
+import contextlib
 import io
+import time
+import uuid
 from audio_processor import AudioProcessor
 from visualizer import AudioVisualizer
-from utils import validate_audio_file
+from utils import probe_audio, validate_audio_file
+from note_result import NoteResult
+from note_store import NoteStore
+from synth import PianoSynth
+from player import audio_player
+from quantizer import GRIDS, quantize_notes
+from midi_export import notes_to_midi, quantized_to_midi
+from note_tables import name_to_midi
+from preprocess import Preprocessor
+from fingerprint import AnalysisLibrary
+from melody_search import MelodyIndex, melody_line
+from admission import AdmissionController, AnonymousQuotaLedger, CostModel, QuotaLedger, measured_cost
+from session_store import SessionStore
+from models import ComputeQuota, User
 from flask import Flask, render_template
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, login_required
@@ -10,6 +26,179 @@ from auth import auth_bp, db
 from config import Config
 
 
+@st.cache_resource
+def get_visualizer() -> AudioVisualizer:
+    # Shared across reruns so memoized figures survive layout-only changes
+    return AudioVisualizer()
+
+
+@st.cache_resource
+def get_preprocessor() -> Preprocessor:
+    # Process-wide so separated and gated audio stays cached while parameters are toggled
+    return Preprocessor()
+
+
+@st.cache_resource
+def get_analysis_library() -> AnalysisLibrary:
+    # Process-wide, so a re-encoded or trimmed re-upload by anyone reuses the earlier analysis
+    return AnalysisLibrary()
+
+
+@st.cache_resource
+def get_cost_model() -> CostModel:
+    # Shared so every finished analysis calibrates the estimates for everyone
+    return CostModel()
+
+
+@st.cache_resource
+def get_admission_controller() -> AdmissionController:
+    return AdmissionController()
+
+
+@st.cache_resource
+def get_session_store() -> SessionStore:
+    # Process-wide, so a busy session can push idle tabs' arrays out to disk
+    return SessionStore(Config.SESSION_MEMORY_MB * 2 ** 20, Config.TOTAL_SESSION_MEMORY_MB * 2 ** 20)
+
+
+# Daily CPU-seconds for visitors without a signed-in user
+ANONYMOUS_DAILY_CPU_SECONDS = 120.0
+
+
+@st.cache_resource
+def get_anonymous_quotas() -> AnonymousQuotaLedger:
+    # Process-wide and keyed by client address, so a new tab does not get a fresh quota
+    return AnonymousQuotaLedger(ANONYMOUS_DAILY_CPU_SECONDS)
+
+
+def anonymous_client() -> str:
+    return st.context.ip_address or 'local'
+
+
+def remaining_quota(app, user_id) -> float:
+    """CPU-seconds left today for the signed-in user, or for this client when anonymous"""
+    if user_id is None:
+        return get_anonymous_quotas().remaining(anonymous_client())
+    with app.app_context():
+        return QuotaLedger(db, ComputeQuota).remaining(user_id)
+
+
+def charge_quota(app, user_id, cpu_seconds: float):
+    if user_id is None:
+        get_anonymous_quotas().charge(anonymous_client(), cpu_seconds)
+        return
+    with app.app_context():
+        QuotaLedger(db, ComputeQuota).charge(user_id, cpu_seconds)
+
+
+def current_user_id(app):
+    """Id of the User matching the signed-in Streamlit account, if any"""
+    user_info = getattr(st, 'user', None)
+    email = user_info.get('email') if user_info is not None else None
+    if not email:
+        return None
+    with app.app_context():
+        user = User.query.filter_by(email=email).first()
+        return user.id if user is not None else None
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def render_converted_audio(result_bytes: bytes) -> bytes:
+    # Keyed on the compact result, so each analysis is synthesized once
+    result = NoteResult.from_bytes(result_bytes)
+    synth = PianoSynth(result.sr)
+    return synth.to_wav_bytes(synth.render(result.midi, result.times))
+
+
+# Most notes drawn in one piano-roll window; the least confident are dropped beyond this
+MAX_WINDOW_NOTES = 2000
+
+
+def hummed_melody(app, user_id, clip):
+    """Melody line of a recorded query, charged like any analysis; None when it was not admitted"""
+    try:
+        duration = probe_audio(clip).duration
+    except ValueError as e:
+        st.error(f"Invalid recording: {e}")
+        return None
+    # Queries go through the same quota and admission control as full analyses
+    estimate = get_cost_model().estimate(duration, {'note_engine': 'semitone'})
+    if estimate > remaining_quota(app, user_id):
+        st.error("Today's compute quota is used up")
+        return None
+    controller = get_admission_controller()
+    decision = controller.decide(estimate)
+    if decision.status == 'reject':
+        st.error(decision.message)
+        return None
+    # A separate processor keeps the analysed take's cached intermediates intact
+    query_processor = st.session_state.setdefault('query_processor', AudioProcessor())
+    query_processor.note_engine = 'semitone'
+    query_processor.stage_cpu = {}
+    try:
+        with controller.slot(estimate):
+            decode_start = time.thread_time()
+            y, sr = query_processor.process_audio(io.BytesIO(clip.getvalue()))
+            decode = time.thread_time() - decode_start
+            query = query_processor.detect_notes(y, sr)
+    except TimeoutError as e:
+        st.error(str(e))
+        return None
+    charge_quota(app, user_id, measured_cost([decode, *query_processor.stage_cpu.values()]))
+    get_session_store().put(st.session_state['session_id'], 'query_processor', query_processor)
+    midi, _ = melody_line(name_to_midi(query['notes']), query['note_frames'])
+    return midi
+
+
+@st.fragment
+def find_phrase(app, user_id, takes: MelodyIndex, take_times: dict):
+    """Match a hummed or sung phrase against the takes analysed in this session"""
+    st.subheader("Find a Phrase")
+    if not len(takes):
+        st.write("Analyse a recording first, then hum or sing a phrase from it to find where it occurs")
+        return
+    clip = st.audio_input("Hum or sing a phrase")
+    if clip is None:
+        return
+    clip_id = getattr(clip, 'file_id', None) or (clip.name, clip.size)
+    cached = st.session_state.get('phrase_query')
+    if cached is not None and cached[0] == clip_id:
+        midi = cached[1]
+    else:
+        midi = hummed_melody(app, user_id, clip)
+        if midi is None:
+            return
+        st.session_state['phrase_query'] = (clip_id, midi)
+    if len(midi) < takes.n + 2:
+        st.warning(f"Only {len(midi)} notes heard; sing a few more")
+        return
+    matches = takes.search(midi)
+    if not matches:
+        st.write("No analysed take contains that phrase")
+        return
+    for match in matches:
+        name, _ = match.key
+        st.write(f"- {name} at {take_times[match.key][match.start]:.1f} s "
+                 f"(off by {match.distance:.2f} semitones per note)")
+
+
+@st.fragment
+def render_note_window(visualizer: AudioVisualizer, store: NoteStore, cache_key):
+    # Runs as a fragment so scrolling and zooming only re-query the note store
+    total = max(store.duration, 1.0)
+    span = st.select_slider(
+        "Window length (s)",
+        options=[5, 10, 30, 60, 120, 300],
+        value=30 if total > 30 else 5
+    )
+    span = min(float(span), total)
+    start = st.slider("Window start (s)", 0.0, max(total - span, 0.0), 0.0, step=max(span / 4, 0.5)) if total > span else 0.0
+    window = store.window(start, start + span, max_notes=MAX_WINDOW_NOTES)
+    fig = visualizer.create_note_window(window, start, start + span, store.pitch_range(), cache_key=cache_key)
+    st.plotly_chart(fig, use_container_width=True)
+    st.caption(f"{len(window['starts'])} of {len(store)} notes in view")
+
+
 def main():
     app = Flask(__name__)
     app.config.from_object(Config)  # Load configuration from Config class
@@ -199,8 +388,51 @@ def main():
     )
 
     # Initialize processors
-    audio_processor = AudioProcessor()
-    visualizer = AudioVisualizer()
+    # Held per session so the onset envelope and pitch track survive reruns; the session store
+    # accounts for their intermediates and the decoded signal, and releases or spills them
+    audio_processor = st.session_state.setdefault('audio_processor', AudioProcessor())
+    visualizer = get_visualizer()
+    session_store = get_session_store()
+    session_id = st.session_state.setdefault('session_id', uuid.uuid4().hex)
+
+    instrument_choice = st.sidebar.selectbox(
+        "Instrument range", ["Auto-detect"] + list(audio_processor.note_range),
+        help="Pitch tracking only searches this instrument's note range"
+    )
+    note_engine = st.sidebar.radio(
+        "Note engine", ["Semitone filterbank", "Pitch peaks"],
+        help="The filterbank only analyses semitones inside the instrument's note range"
+    )
+    audio_processor.note_engine = 'semitone' if note_engine == "Semitone filterbank" else 'piptrack'
+    polyphony = st.sidebar.slider(
+        "Max simultaneous notes", 1, 6, 1,
+        help="Above 1, chords and accompaniment are picked by harmonic summation"
+    )
+
+    with st.sidebar.expander("Note picking", expanded=False):
+        # Only peak picking and filtering re-run when these change
+        delta = st.slider("Onset threshold", 0.0, 1.0, 0.2, 0.05)
+        peak_window = st.slider("Peak window (frames)", 1, 60, 20)
+        average_window = st.slider("Averaging window (frames)", 1, 150, 50)
+        min_confidence = st.slider("Minimum confidence", 0.0, 2.0, 0.1, 0.05)
+    onset_params = {
+        'pre_max': peak_window, 'post_max': peak_window,
+        'pre_avg': average_window, 'post_avg': average_window,
+        'delta': delta
+    }
+
+    with st.sidebar.expander("Pre-processing", expanded=False):
+        trim_silence = st.checkbox("Skip silent regions", value=False)
+        top_db = st.slider("Silence threshold (dB below peak)", 20, 80, 40, 5, disabled=not trim_silence)
+        isolate_vocals = st.checkbox("Isolate harmonic part", value=False)
+        noise_gate = st.checkbox("Spectral noise gate", value=False)
+        gate_db = st.slider("Gate threshold (dB above noise floor)", 0, 24, 6, 1, disabled=not noise_gate)
+
+    # Server-side cap, not a client setting
+    audio_processor.memory_budget = Config.ANALYSIS_MEMORY_MB * 2 ** 20 or None
+
+    melody_takes = st.session_state.setdefault('melody_takes', MelodyIndex())
+    take_times = st.session_state.setdefault('take_times', {})
 
     # File upload
     uploaded_file = st.file_uploader(
@@ -210,57 +442,231 @@ def main():
 
     if uploaded_file is not None:
         # Validate file
-        is_valid, message = validate_audio_file(uploaded_file)
+        is_valid, message, audio_info = validate_audio_file(uploaded_file)
 
         if not is_valid:
             st.error(message)
             return
+        st.caption(
+            f"{audio_info.codec.upper()}, {audio_info.sample_rate} Hz, "
+            f"{'mono' if audio_info.channels == 1 else f'{audio_info.channels} channels'}, "
+            f"{audio_info.duration:.1f} s"
+        )
+
+        # Admission control on the predicted cost of this analysis
+        profile = {
+            'skip_silence': trim_silence,
+            'separate': isolate_vocals,
+            'gate': noise_gate,
+            'note_engine': audio_processor.note_engine,
+            'polyphony': polyphony
+        }
+        cost_model = get_cost_model()
+        controller = get_admission_controller()
+        # Reruns on the same upload reuse the decoded signal and the processor's intermediates
+        upload_id = getattr(uploaded_file, 'file_id', None) or (uploaded_file.name, uploaded_file.size)
+        decoded = st.session_state.get('decoded')
+        y = session_store.get(session_id, 'signal') if decoded is not None and decoded[0] == upload_id else None
+        fresh = y is None
+        # A rerun whose intermediates are still held for the same signal and settings only re-picks
+        # notes and redraws, so it skips admission; any other rerun recomputes all but the decode
+        intermediates_key = (
+            upload_id, instrument_choice, audio_processor.note_engine, polyphony, trim_silence, top_db,
+            isolate_vocals, noise_gate, gate_db, audio_processor.memory_budget
+        )
+        cached = (not fresh and audio_processor.has_intermediates
+                  and st.session_state.get('intermediates_key') == intermediates_key)
+        estimate = 0.0 if cached else cost_model.estimate(audio_info.duration, profile)
+        user_id = current_user_id(app)
+        remaining = remaining_quota(app, user_id)
+        if estimate > remaining:
+            st.error(
+                f"This analysis needs about {estimate:.0f} CPU-seconds but only {remaining:.0f} remain "
+                "in today's quota. Try a shorter file or turn off harmonic isolation."
+            )
+            return
+        if not cached:
+            decision = controller.decide(estimate)
+            if decision.status == 'reject':
+                st.error(decision.message)
+                return
+            if decision.status == 'queue':
+                st.info(decision.message)
 
         try:
             # Process audio
-            with st.spinner('Processing audio file...'):
-                audio_bytes = uploaded_file.read()
-                y, sr = audio_processor.process_audio(io.BytesIO(audio_bytes))
+            # Budgeted analyses report their heaviest stage when no other analysis is tracing
+            trace = audio_processor.memory_trace() if audio_processor.memory_budget else contextlib.nullcontext()
+            slot = contextlib.nullcontext() if cached else controller.slot(estimate)
+            with slot, trace, st.spinner('Processing audio file...'):
+                # The uploader already holds the file, so only its compact decode metadata is kept
+                audio_bytes = uploaded_file.getvalue()
+                if fresh:
+                    decode_start = time.thread_time()
+                    y, sr = audio_processor.process_audio(io.BytesIO(audio_bytes))
+                    timings = {'decode': time.thread_time() - decode_start}
+                    waveform = audio_processor.waveform
+                    st.session_state['decoded'] = (upload_id, sr, waveform)
+                    session_store.put(session_id, 'signal', y)
+                else:
+                    _, sr, waveform = decoded
+                    timings = {}
+                audio_processor.stage_timings = {}
+                audio_processor.stage_cpu = {}
+                audio_processor.stage_memory = {}
+                y_analysis, regions = y, None
+                # Silence skipping alone is handled inside the processor; with separation or gating
+                # the pre-processor trims first so those stages skip the silence as well
+                audio_processor.skip_silence = trim_silence and not (isolate_vocals or noise_gate)
+                audio_processor.silence_db = top_db
+                if isolate_vocals or noise_gate:
+                    y_analysis, regions = get_preprocessor().process(
+                        y, sr, trim=trim_silence, separate=isolate_vocals, gate=noise_gate,
+                        top_db=top_db, gate_db=gate_db, timings=timings
+                    )
+
+                # Audio already analysed with the same settings, possibly re-encoded or trimmed,
+                # is recognised by its spectral-peak fingerprint and its results are reused
+                analysis_profile = (
+                    instrument_choice, audio_processor.note_engine, polyphony, trim_silence, top_db,
+                    isolate_vocals, noise_gate, gate_db, tuple(onset_params.items()), min_confidence
+                )
+                hashes, hash_frames = audio_processor.fingerprint(y_analysis, sr)
+                if regions is not None:
+                    hash_frames = regions.to_original_frames(hash_frames)
+                library = get_analysis_library()
+                n_frames = 1 + len(y) // audio_processor.hop_length
+                reused = library.lookup(analysis_profile, hashes, hash_frames, n_frames)
+
+                if reused is not None:
+                    payload, match = reused
+                    result = NoteResult.from_bytes(payload['result']).shifted(match.shift_frames, n_frames)
+                    notes_data = result.to_notes_data()
+                    pitches = result.pitch_track()
+                    shift_seconds = match.shift_frames * audio_processor.hop_length / sr
+                    key_tempo = dict(payload['key_tempo'], beat_times=[
+                        t - shift_seconds for t in payload['key_tempo']['beat_times']
+                        if 0 <= t - shift_seconds <= len(y) / sr
+                    ])
+                    confidence_scores = payload['confidence_scores']
+                    instrument = payload['instrument']
+                    st.caption(
+                        f"Reused the analysis of a matching upload "
+                        f"({match.score:.0%} of landmarks aligned, offset {shift_seconds:.2f} s)"
+                    )
+                else:
+                    override = None if instrument_choice == "Auto-detect" else instrument_choice
+                    instrument = audio_processor.select_instrument(y_analysis, sr, override)
 
-                # Detect notes and create visualizations
-                notes_data = audio_processor.detect_notes(y, sr)
-                notes_data['sr'] = sr  # Add sample rate to notes data
+                    # Detect notes and create visualizations
+                    notes_data = audio_processor.detect_notes(
+                        y_analysis, sr, polyphony, onset_params=onset_params, min_confidence=min_confidence
+                    )
+                    pitches = audio_processor.detect_pitch_peaks(y_analysis, sr)
+                    key_tempo = audio_processor.estimate_key_and_tempo(y_analysis, sr)
+                    confidence_scores = audio_processor.classify_instrument(y_analysis, sr)
+                    if regions is not None:
+                        # Results of the compacted signal go back onto the original timeline
+                        notes_data = regions.expand_notes(notes_data)
+                        pitches = regions.expand_pitch(pitches)
+                        key_tempo['beat_times'] = regions.to_original_times(key_tempo['beat_times'], sr).tolist()
+                    notes_data['sr'] = sr  # Add sample rate to notes data
+                    result = NoteResult.from_notes_data(notes_data, sr, pitch_track=pitches)
+                    library.store(analysis_profile, upload_id, hashes, hash_frames, n_frames, {
+                        'result': result.to_bytes(),
+                        'key_tempo': key_tempo,
+                        'confidence_scores': confidence_scores,
+                        'instrument': instrument
+                    })
+                # Every analysed take becomes searchable by humming for the rest of the session
+                take_key = (uploaded_file.name, upload_id)
+                if take_key not in melody_takes:
+                    take_midi, take_frames = melody_line(result.midi, result.frames)
+                    take_times[take_key] = take_frames * result.hop_length / sr
+                    melody_takes.add(take_key, take_midi)
+                low, high = audio_processor.note_range[instrument]
+                st.caption(f"Analysing the {instrument} range, {low} to {high}")
+                if audio_processor.stage_memory:
+                    stage, peak = max(audio_processor.stage_memory.items(), key=lambda item: item[1])
+                    st.caption(f"Largest stage allocation: {peak / 2 ** 20:.0f} MB ({stage.replace('_', ' ')})")
+                tempo = key_tempo['tempo'] or 120.0
 
                 # Display audio player with synchronized keyboard
                 st.subheader("Audio Player with Virtual Piano")
-                audio_player_html = visualizer.create_audio_player_with_keyboard(
+                audio_player(
                     audio_bytes,
-                    notes_data
+                    'audio/mpeg' if audio_info.codec == 'mp3' else 'audio/wav',
+                    result,
+                    len(y) / sr,
+                    converted_audio=render_converted_audio(result.to_bytes()),
+                    waveform=waveform
                 )
-                # Ensure HTML is rendered properly with components.html
-                import streamlit.components.v1 as components
-                components.html(audio_player_html, height=350)
 
                 # Create columns for visualizations
                 col1, col2 = st.columns(2)
 
                 with col1:
                     st.subheader("Pitch Analysis")
-                    pitches = audio_processor.detect_pitch(y, sr)
-                    pitch_fig = visualizer.create_pitch_map(pitches, sr)
+                    pitch_view = st.radio("Pitch view", ["Contour", "Semitone map", "Pitch map"], horizontal=True)
+                    if pitch_view == "Contour":
+                        pitch_fig = visualizer.create_pitch_contour(pitches, cache_key=result.digest)
+                    elif pitch_view == "Semitone map":
+                        semitone_midi, semitones = audio_processor.semitone_spectrogram(y_analysis, sr)
+                        if regions is not None:
+                            semitones = regions.expand_columns(semitones)
+                        pitch_fig = visualizer.create_semitone_map(
+                            semitone_midi, semitones, sr, audio_processor.hop_length,
+                            cache_key=(result.digest, audio_processor.instrument)
+                        )
+                    else:
+                        pitch_fig = visualizer.create_pitch_map(
+                            pitches, sr, audio_processor.hop_length, cache_key=result.digest
+                        )
                     st.plotly_chart(pitch_fig, use_container_width=True)
 
                 with col2:
                     st.subheader("Note Detection")
-                    notes_fig = visualizer.create_note_visualization(
-                        notes_data['notes'],
-                        notes_data['onset_frames'],
-                        sr,
-                        notes_data['confidences']
+                    store = NoteStore.from_result(result)
+                    roll_key = result.digest
+                    quantize = st.checkbox("Quantize to tempo grid")
+                    if quantize:
+                        grid = st.selectbox("Grid", list(GRIDS), index=list(GRIDS).index('1/16'))
+                        swing = st.slider("Swing", 0.0, 0.5, 0.0, 0.05) if GRIDS[grid] % 3 else 0.0
+                        beat_times = key_tempo['beat_times']
+                        offset = beat_times[0] % (60.0 / tempo) if beat_times else 0.0
+                        quantized = quantize_notes(store.starts, store.durations, tempo, grid, swing, offset)
+                        midi_file = quantized_to_midi(store.midi, quantized, tempo, store.confidences)
+                        store = NoteStore(quantized['starts'], store.midi, store.confidences, quantized['durations'])
+                        roll_key = (result.digest, grid, swing)
+                    else:
+                        midi_file = notes_to_midi(store.midi, store.starts, store.durations, tempo, store.confidences)
+
+                    windowed = st.checkbox(
+                        "Windowed piano roll",
+                        value=len(notes_data['notes']) > MAX_WINDOW_NOTES
                     )
-                    st.plotly_chart(notes_fig, use_container_width=True)
+                    if windowed:
+                        render_note_window(visualizer, store, roll_key)
+                    else:
+                        notes_fig = visualizer.create_note_visualization(
+                            store.midi, store.starts, store.confidences, cache_key=roll_key
+                        )
+                        st.plotly_chart(notes_fig, use_container_width=True)
+                    st.download_button("Download MIDI", midi_file, file_name="notes.mid", mime="audio/midi")
 
                 # Instrument classification
                 st.subheader("Instrument Classification")
-                confidence_scores = audio_processor.classify_instrument(y, sr)
                 instrument_fig = visualizer.create_instrument_confidence_chart(confidence_scores)
                 st.plotly_chart(instrument_fig, use_container_width=True)
 
+                # Key, scale and tempo from the shared onset envelope and spectrogram
+                st.subheader("Key and Tempo")
+                key_col, tempo_col, beats_col = st.columns(3)
+                key_col.metric("Key", f"{key_tempo['key']} {key_tempo['scale']}",
+                               f"confidence {key_tempo['key_confidence']:.2f}", delta_color="off")
+                tempo_col.metric("Tempo", f"{key_tempo['tempo']:.0f} BPM")
+                beats_col.metric("Beats", len(key_tempo['beat_times']))
+
                 # Display detected notes
                 st.subheader("Detected Musical Notes")
                 if notes_data['notes']:
@@ -274,9 +680,29 @@ def main():
                 else:
                     st.write("No musical notes detected in the audio")
 
+                # Feed the measured stage times back into the estimator and charge the quota
+                timings.update(audio_processor.stage_cpu)
+                if fresh:
+                    cost_model.calibrate(timings, audio_info.duration)
+                # Layout-only reruns ran no stage and are not charged
+                if timings:
+                    charge_quota(app, user_id, measured_cost(timings.values()))
+                session_store.put(session_id, 'processor', audio_processor)
+                st.session_state['intermediates_key'] = intermediates_key
+
         except Exception as e:
             st.error(f"Error processing audio: {str(e)}")
 
+    find_phrase(app, current_user_id(app), melody_takes, take_times)
+
+    memory = session_store.stats()
+    shared = get_preprocessor().nbytes + get_visualizer().nbytes
+    st.sidebar.metric(
+        "Analysis memory, all sessions", f"{(memory.resident_bytes + shared) / 2 ** 20:.0f} MB",
+        f"{shared / 2 ** 20:.0f} MB in shared caches, {memory.spilled_bytes / 2 ** 20:.0f} MB on disk, "
+        f"{memory.sessions} sessions", delta_color="off"
+    )
+
     # Add information section
     with st.expander("ℹ️ About this tool"):
         st.write("""
@@ -288,7 +714,7 @@ def main():
         - Note occurrence statistics
 
         Supported file formats: WAV, MP3
-        Maximum file size: 10MB
+        Maximum length: 15 minutes
 
         The tool analyzes the audio using advanced signal processing techniques to:
         1. Generate a frequency-based pitch map
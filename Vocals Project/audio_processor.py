@@ -1,9 +1,37 @@
+import threading
+import time
+import tracemalloc
 import librosa
 import numpy as np
-from typing import Tuple, Dict, List
+import scipy.sparse
+from contextlib import contextmanager
+from typing import Callable, Tuple, Dict, Iterator, List, Optional
+from pitch_track import SparsePitch
+from note_tables import PITCH_CLASSES, hz_to_midi, hz_to_note, midi_to_hz, name_to_midi
+from preprocess import RegionMap, voice_activity
+from fingerprint import TILE, pair_peaks, tile_peaks
+from waveform import WaveformPyramid
+from session_store import nbytes_of
+
+# tracemalloc and its peak are process-wide, so only one analysis at a time traces its stages
+_TRACE_LOCK = threading.Lock()
+
+# Krumhansl-Kessler key profiles, tonic first
+MAJOR_PROFILE = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+MINOR_PROFILE = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+
+
+def join_columns(parts: List[np.ndarray]) -> np.ndarray:
+    """Concatenate column chunks, without a copy when there is only one"""
+    return parts[0] if len(parts) == 1 else np.concatenate(parts, axis=-1)
+
 
 class AudioProcessor:
-    def __init__(self):
+    # Peak allocation of the heaviest per-chunk stage (librosa's spectral features work
+    # in float64) in float32 spectrogram columns, measured with benchmark.py --memory-budget
+    CHUNK_WORKING_SET = 8
+
+    def __init__(self, skip_silence: bool = False, silence_db: float = 40.0):
         self.supported_formats = ['.wav', '.mp3']
         self.max_file_size = 10 * 1024 * 1024  # 10MB limit
         self.note_range = {
@@ -12,83 +40,562 @@ class AudioProcessor:
             'Violin': ('G3', 'A7'),
             'Bass': ('E1', 'G4')
         }
+        # Instrument whose note_range bounds pitch tracking and the semitone engine;
+        # select_instrument picks it from a short preview unless the user overrides it
+        self.instrument = 'Piano'
+        self.preview_seconds = 10.0
+        self.preview_excerpts = 5
+        # 'piptrack' picks notes from STFT pitch peaks, 'semitone' from the semitone filterbank
+        self.note_engine = 'piptrack'
+        self.n_fft = 2048
+        self.hop_length = 512
+        self.pitch_chunk_frames = 2048
+        # piptrack keeps peaks above this fraction of their frame's loudest bin
+        self.pitch_threshold = 0.1
+        # Bytes one analysis may hold at once. When set, stages keep float32 data and the
+        # spectral stages run on column chunks sized to fit, streaming the STFT when even the
+        # spectrogram alone would not. Inside memory_trace() stages record their peak traced
+        # allocation in stage_memory
+        self.memory_budget: Optional[int] = None
+        self.stage_memory: Dict[str, int] = {}
+        self._tracing = False
+        # Peak-picking parameters for onset_detect (in frames) and the note confidence floor;
+        # changing them only re-runs picking on the memoized onset envelope and pitch track
+        self.onset_params = {'pre_max': 20, 'post_max': 20, 'pre_avg': 50, 'post_avg': 50, 'delta': 0.2}
+        self.min_confidence = 0.1
+        self.pitch_top_k = 3
+        # Run the spectral stages on active regions only, mapping results back to absolute time
+        self.skip_silence = skip_silence
+        self.silence_db = silence_db
+        # Polyphonic note picking: candidates per semitone, harmonics summed per candidate,
+        # frames averaged after each onset, and a multiply-add budget capping the voice count
+        self.poly_steps_per_semitone = 3
+        self.poly_harmonics = 8
+        self.poly_harmonic_decay = 0.8
+        self.poly_frames = 4
+        self.poly_relative_threshold = 0.3
+        self.poly_cost_ceiling = 5e8
+        self._harmonic_combs = {}
+        self._semitone_banks = {}
+        self.stage_timings: Dict[str, float] = {}
+        # CPU time of the analysing thread per stage, which is what quotas and cost estimates count
+        self.stage_cpu: Dict[str, float] = {}
+        self._signal = None
+        # Overview of the last decoded signal for the player's waveform
+        self.waveform: Optional[WaveformPyramid] = None
 
     def process_audio(self, audio_data: bytes) -> Tuple[np.ndarray, float]:
         """Process audio data and return signal and sample rate"""
         try:
             y, sr = librosa.load(audio_data)
+            self.waveform = WaveformPyramid.from_signal(y)
             return y, sr
         except Exception as e:
             raise Exception(f"Error processing audio: {str(e)}")
 
-    def detect_pitch(self, y: np.ndarray, sr: float) -> np.ndarray:
-        """Detect pitch using librosa with improved accuracy"""
-        pitches, magnitudes = librosa.piptrack(
-            y=y, 
-            sr=sr,
-            fmin=librosa.note_to_hz('C1'),
-            fmax=librosa.note_to_hz('C8')
+    @contextmanager
+    def memory_trace(self):
+        """Trace each stage's peak allocation for the block, unless another analysis is already tracing
+
+        Yields whether this block is traced. Allocations of threads running alongside are
+        traced too, so the figures are upper bounds under load.
+        """
+        if not _TRACE_LOCK.acquire(blocking=False):
+            yield False
+            return
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        self._tracing = True
+        try:
+            yield True
+        finally:
+            self._tracing = False
+            if started:
+                tracemalloc.stop()
+            _TRACE_LOCK.release()
+
+    @contextmanager
+    def _stage(self, name: str):
+        """Record the wall and CPU time of an analysis stage, and its peak allocation while tracing"""
+        tracing = self._tracing
+        if tracing:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield
+        finally:
+            self.stage_timings[name] = self.stage_timings.get(name, 0.0) + time.perf_counter() - start
+            self.stage_cpu[name] = self.stage_cpu.get(name, 0.0) + time.thread_time() - cpu_start
+            if tracing:
+                peak = tracemalloc.get_traced_memory()[1] - baseline
+                self.stage_memory[name] = max(self.stage_memory.get(name, 0), peak)
+
+    def _intermediate(self, y: np.ndarray, sr: float, name: str, compute: Callable):
+        """Per-signal memo for intermediates shared between stages"""
+        settings = (self.skip_silence, self.silence_db, self.memory_budget)
+        if (self._signal is None or self._signal[0] is not y or self._signal[1] != sr
+                or self._signal[2] != settings):
+            self._signal = (y, sr, settings, {})
+        store = self._signal[3]
+        if name not in store:
+            store[name] = compute()
+        return store[name]
+
+    @property
+    def has_intermediates(self) -> bool:
+        """Whether intermediates of a signal are held, so reruns on it skip the expensive stages"""
+        return self._signal is not None
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the cached intermediates of the current signal"""
+        return nbytes_of(self._signal[3]) if self._signal is not None else 0
+
+    def release(self):
+        """Drop the cached intermediates and the signal they belong to"""
+        self._signal = None
+
+    def voice_activity(self, y: np.ndarray, sr: float) -> RegionMap:
+        """RMS voice-activity map of the signal, computed once and shared by every stage"""
+        def compute():
+            with self._stage('voice_activity'):
+                if not self.skip_silence:
+                    return RegionMap.full(len(y), self.hop_length)
+                return voice_activity(y, self.silence_db, self.n_fft, self.hop_length)
+        return self._intermediate(y, sr, 'voice_activity', compute)
+
+    def _active_signal(self, y: np.ndarray, sr: float) -> np.ndarray:
+        """The signal the spectral stages run on, with silent regions spliced out when skipping silence"""
+        def compute():
+            active = self.voice_activity(y, sr).compact(y)
+            return active if self.memory_budget is None else active.astype(np.float32, copy=False)
+        return self._intermediate(y, sr, 'active_signal', compute)
+
+    def _n_frames(self, y: np.ndarray, sr: float) -> int:
+        """Column count of the active signal's spectrogram"""
+        return 1 + len(self._active_signal(y, sr)) // self.hop_length
+
+    def _streams_spectrogram(self, y: np.ndarray, sr: float) -> bool:
+        """Whether the spectrogram is computed chunk by chunk instead of held, to stay within memory_budget
+
+        Computing it whole briefly needs the complex STFT as well, about three times its size.
+        """
+        column_bytes = (1 + self.n_fft // 2) * np.dtype(np.float32).itemsize
+        return self.memory_budget is not None and 3 * self._n_frames(y, sr) * column_bytes > self.memory_budget
+
+    def _chunk_frames(self, y: np.ndarray, sr: float) -> int:
+        """Spectrogram columns the spectral stages process at a time"""
+        n_frames = self._n_frames(y, sr)
+        if self.memory_budget is None:
+            return n_frames
+        column_bytes = (1 + self.n_fft // 2) * np.dtype(np.float32).itemsize
+        held = 0 if self._streams_spectrogram(y, sr) else n_frames * column_bytes
+        frames = (self.memory_budget - held) // (self.CHUNK_WORKING_SET * column_bytes)
+        # Whole fingerprint tiles per chunk, so chunked peaks match the unchunked ones
+        return int(max(frames // TILE[1], 1) * TILE[1])
+
+    def _spectrogram_columns(self, y: np.ndarray, sr: float) -> Iterator[Tuple[int, np.ndarray]]:
+        """Magnitude spectrogram of the active signal as (first frame, columns) chunks
+
+        Chunks are slices of the shared spectrogram or, when it would not fit memory_budget,
+        STFTs of just the samples each chunk needs; the columns are the same either way.
+        """
+        n_frames = self._n_frames(y, sr)
+        chunk = self._chunk_frames(y, sr)
+        if not self._streams_spectrogram(y, sr):
+            S = self._magnitude_spectrogram(y, sr)
+            for start in range(0, n_frames, chunk):
+                yield start, S[:, start:start + chunk]
+            return
+        active = self._active_signal(y, sr)
+        for start in range(0, n_frames, chunk):
+            with self._stage('spectrogram'):
+                segment = self._frame_samples(active, start, min(start + chunk, n_frames), 'constant')
+                columns = np.abs(librosa.stft(segment, n_fft=self.n_fft, hop_length=self.hop_length, center=False))
+                del segment
+            yield start, columns
+
+    def _frame_samples(self, y: np.ndarray, start: int, stop: int, pad_mode: str) -> np.ndarray:
+        """Samples under centred frames start to stop, padded past the ends the way librosa pads the whole signal"""
+        half = self.n_fft // 2
+        # Frame t spans n_fft samples centred on sample t * hop_length
+        first, last = start * self.hop_length - half, (stop - 1) * self.hop_length + half
+        segment = y[max(first, 0):max(min(last, len(y)), 0)]
+        if first >= 0 and last <= len(y):
+            return segment
+        return np.pad(segment, (max(-first, 0), max(last - len(y), 0)), mode=pad_mode)
+
+    def _magnitude_spectrogram(self, y: np.ndarray, sr: float) -> np.ndarray:
+        """Magnitude STFT shared by the stages that analyse the same signal"""
+        def compute():
+            active = self._active_signal(y, sr)
+            with self._stage('spectrogram'):
+                return np.abs(librosa.stft(active, n_fft=self.n_fft, hop_length=self.hop_length))
+        return self._intermediate(y, sr, 'spectrogram', compute)
+
+    def _onset_envelope(self, y: np.ndarray, sr: float) -> np.ndarray:
+        """Onset strength from the shared spectrogram, as librosa.onset.onset_strength computes it"""
+        def compute():
+            log_mel = []
+            for _, S in self._spectrogram_columns(y, sr):
+                with self._stage('onset_envelope'):
+                    mel = librosa.feature.melspectrogram(S=S ** 2, sr=sr, n_fft=self.n_fft, hop_length=self.hop_length)
+                    log_mel.append(librosa.power_to_db(mel, top_db=None))
+            with self._stage('onset_envelope'):
+                # power_to_db's floor 80 dB under the loudest cell, then onset_strength's mean
+                # rise over one frame, applied chunk by chunk with the previous frame carried over
+                floor = max(float(chunk.max()) for chunk in log_mel) - 80.0
+                rises = []
+                previous = None
+                for chunk in log_mel:
+                    np.maximum(chunk, floor, out=chunk)
+                    frames = chunk if previous is None else np.hstack((previous, chunk))
+                    rises.append(np.maximum(0.0, np.diff(frames, axis=1)).mean(axis=0))
+                    previous = chunk[:, -1:]
+                # Lag of one frame plus the framing offset, as onset_strength pads with center=True
+                lag = np.zeros(1 + self.n_fft // (2 * self.hop_length), dtype=rises[0].dtype)
+                return np.concatenate([lag] + rises)[:self._n_frames(y, sr)]
+        return self._intermediate(y, sr, 'onset_envelope', compute)
+
+    def semitone_range(self, instrument: str = None) -> Tuple[int, int]:
+        """Lowest and highest MIDI note of an instrument's note_range"""
+        low, high = name_to_midi(self.note_range[instrument or self.instrument])
+        return int(low), int(high)
+
+    def pitch_limits(self, instrument: str = None) -> Tuple[float, float]:
+        """fmin and fmax in Hz, half a semitone outside the instrument's note range"""
+        low, high = self.semitone_range(instrument)
+        return float(librosa.midi_to_hz(low - 0.5)), float(librosa.midi_to_hz(high + 0.5))
+
+    def _preview(self, y: np.ndarray, sr: float) -> np.ndarray:
+        """Evenly spaced excerpts totalling preview_seconds, a cheap stand-in for the whole signal"""
+        active = self._active_signal(y, sr)
+        length = int(self.preview_seconds * sr / self.preview_excerpts)
+        if len(active) <= length * self.preview_excerpts:
+            return active
+        starts = np.linspace(0, len(active) - length, self.preview_excerpts).astype(np.int64)
+        return np.concatenate([active[start:start + length] for start in starts])
+
+    def select_instrument(self, y: np.ndarray, sr: float, override: str = None) -> str:
+        """Set the instrument whose note range bounds pitch tracking, classifying a preview unless overridden"""
+        if override is not None:
+            self.instrument = override
+            return override
+        def compute():
+            preview = self._preview(y, sr)
+            with self._stage('instrument_preview'):
+                S = np.abs(librosa.stft(preview, n_fft=self.n_fft, hop_length=self.hop_length))
+                samples = self._frame_samples(preview, 0, S.shape[1], 'edge')
+                scores = self._classify_instrument(self._spectral_sums(S, samples, sr) / S.shape[1])
+            return max(scores, key=scores.get)
+        self.instrument = self._intermediate(y, sr, 'preview_instrument', compute)
+        return self.instrument
+
+    def _semitone_filterbank(self, sr: float, low: int, high: int) -> scipy.sparse.csr_matrix:
+        """Sparse (semitones x STFT bins) triangular filters, one per note from low to high"""
+        key = (sr, self.n_fft, low, high)
+        if key not in self._semitone_banks:
+            midi = np.arange(low, high + 1)
+            bin_midi = hz_to_midi(np.arange(1 + self.n_fft // 2) * sr / self.n_fft)
+            first = np.searchsorted(bin_midi, low - 1.0)
+            last = np.searchsorted(bin_midi, high + 1.0)
+            bins = np.arange(first, last)
+            weights = np.maximum(0.0, 1 - np.abs(bin_midi[bins][None, :] - midi[:, None]))
+            # Below ~C4 semitones are narrower than a bin; give each such note its nearest bin
+            nearest = np.clip(np.rint(midi_to_hz(midi) * self.n_fft / sr).astype(np.int64), first, last - 1) - first
+            rows = np.arange(len(midi))
+            weights[rows, nearest] = np.maximum(weights[rows, nearest], 1 - np.abs(bin_midi[bins][nearest] - midi) / 12)
+            bank = scipy.sparse.csr_matrix(weights, dtype=np.float32)
+            self._semitone_banks[key] = scipy.sparse.csr_matrix(
+                (bank.data, bank.indices + first, bank.indptr), shape=(len(midi), 1 + self.n_fft // 2)
+            )
+        return self._semitone_banks[key]
+
+    def semitone_spectrogram(self, y: np.ndarray, sr: float, instrument: str = None) -> Tuple[np.ndarray, np.ndarray]:
+        """MIDI numbers and a (notes x frames) semitone-resolution spectrogram over the instrument's range"""
+        instrument = instrument or self.instrument
+        midi, spectrogram = self._active_semitones(y, sr, instrument)
+        if not self.skip_silence:
+            return midi, spectrogram
+        expanded = self._intermediate(
+            y, sr, ('semitones_expanded', instrument),
+            lambda: self.voice_activity(y, sr).expand_columns(spectrogram)
         )
-        return pitches
+        return midi, expanded
 
-    def detect_notes(self, y: np.ndarray, sr: float) -> Dict:
-        """Detect musical notes with improved accuracy and timing"""
-        notes = []
-        confidences = []
-        onset_frames = librosa.onset.onset_detect(
-            y=y, 
-            sr=sr,
-            units='frames',
-            hop_length=512,
-            backtrack=True,
-            pre_max=20,
-            post_max=20,
-            pre_avg=50,
-            post_avg=50,
-            delta=0.2
+    def _active_semitones(self, y: np.ndarray, sr: float, instrument: str) -> Tuple[np.ndarray, np.ndarray]:
+        def compute():
+            low, high = self.semitone_range(instrument)
+            bank = self._semitone_filterbank(sr, low, high)
+            parts = []
+            for _, S in self._spectrogram_columns(y, sr):
+                with self._stage('semitones'):
+                    parts.append(bank @ S)
+            return np.arange(low, high + 1), join_columns(parts)
+        return self._intermediate(y, sr, ('semitones', instrument), compute)
+
+    def fingerprint(self, y: np.ndarray, sr: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Landmark hashes and their frames on the original timeline, from the shared spectrogram"""
+        def compute():
+            peaks = []
+            for start, S in self._spectrogram_columns(y, sr):
+                with self._stage('fingerprint'):
+                    peaks.append(tile_peaks(S, first_frame=start))
+            with self._stage('fingerprint'):
+                hashes, frames = pair_peaks(*(np.concatenate(part) for part in zip(*peaks)))
+            if self.skip_silence:
+                frames = self.voice_activity(y, sr).to_original_frames(frames).astype(np.int32)
+            return hashes, frames
+        return self._intermediate(y, sr, 'fingerprint', compute)
+
+    def detect_pitch_peaks(self, y: np.ndarray, sr: float, top_k: int = None) -> SparsePitch:
+        """Detect pitch keeping only the top_k peaks per frame"""
+        top_k = top_k or self.pitch_top_k
+        track = self._active_pitch_peaks(y, sr, top_k)
+        if not self.skip_silence:
+            return track
+        return self._intermediate(
+            y, sr, ('pitch_peaks_expanded', top_k, self.instrument),
+            lambda: self.voice_activity(y, sr).expand_pitch(track)
         )
 
-        # Get pitch track
+    def _active_pitch_peaks(self, y: np.ndarray, sr: float, top_k: int) -> SparsePitch:
+        """Pitch peaks on the frames of the active signal"""
+        def compute():
+            parts = []
+            for _, S in self._spectrogram_columns(y, sr):
+                with self._stage('pitch_peaks'):
+                    parts.append(self._pitch_peaks(S, sr, top_k))
+            return parts[0] if len(parts) == 1 else SparsePitch.concatenate(parts)
+        return self._intermediate(y, sr, ('pitch_peaks', top_k, self.instrument), compute)
+
+    def _pitch_peaks(self, S: np.ndarray, sr: float, top_k: int) -> SparsePitch:
+        fmin, fmax = self.pitch_limits()
+        # piptrack only needs the bins up to fmax; cropping S and scaling sr to match
+        # keeps every bin's frequency (k * sr / n_fft) while skipping the rest. Its threshold
+        # is relative to each frame's maximum, which is taken over all bins before the crop
+        ref = self.pitch_threshold * S.max(axis=0, keepdims=True, initial=0)
+        n_bins = min(S.shape[0], int(np.ceil(fmax * self.n_fft / sr)) + 2)
+        S = S[:n_bins]
+        n_fft = 2 * (n_bins - 1)
+        scaled_sr = sr * n_fft / self.n_fft
+        # piptrack thresholds each frame independently, so column chunks give identical peaks
+        # while only one chunk of the dense pitch/magnitude matrices is alive at a time
+        parts = []
+        for start in range(0, max(S.shape[1], 1), self.pitch_chunk_frames):
+            pitches, magnitudes = librosa.piptrack(
+                S=S[:, start:start + self.pitch_chunk_frames],
+                sr=scaled_sr,
+                n_fft=n_fft,
+                hop_length=self.hop_length,
+                fmin=fmin,
+                fmax=fmax,
+                ref=ref[:, start:start + self.pitch_chunk_frames]
+            )
+            parts.append(SparsePitch.from_piptrack(
+                pitches, magnitudes, sr, top_k, self.n_fft, self.hop_length
+            ))
+            del pitches, magnitudes
+        return SparsePitch.concatenate(parts)
+
+    def detect_pitch(self, y: np.ndarray, sr: float) -> np.ndarray:
+        """Detect pitch using librosa with improved accuracy"""
         pitches, magnitudes = librosa.piptrack(
-            y=y, 
+            y=self._active_signal(y, sr),
             sr=sr,
-            fmin=librosa.note_to_hz('C1'),
-            fmax=librosa.note_to_hz('C8')
+            fmin=self.pitch_limits()[0],
+            fmax=self.pitch_limits()[1]
         )
+        if self.skip_silence:
+            return self.voice_activity(y, sr).expand_columns(pitches)
+        return pitches
 
-        for frame in onset_frames:
-            if frame < pitches.shape[1]:
-                # Get the highest magnitude pitch at this frame
-                pitch_index = magnitudes[:, frame].argmax()
-                pitch_hz = pitches[pitch_index, frame]
+    def detect_notes(self, y: np.ndarray, sr: float, polyphony: int = 1, onset_params: Dict = None,
+                     min_confidence: float = None) -> Dict:
+        """Detect musical notes with improved accuracy and timing, up to polyphony notes per onset"""
+        onset_params = {**self.onset_params, **(onset_params or {})}
+        min_confidence = self.min_confidence if min_confidence is None else min_confidence
+        onset_envelope = self._onset_envelope(y, sr)
+        with self._stage('onset_detect'):
+            onset_frames = librosa.onset.onset_detect(
+                onset_envelope=onset_envelope,
+                sr=sr,
+                units='frames',
+                hop_length=self.hop_length,
+                backtrack=True,
+                **onset_params
+            )
 
-                if pitch_hz > 0:
-                    note = librosa.hz_to_note(pitch_hz)
-                    confidence = magnitudes[pitch_index, frame]
+        if polyphony > 1:
+            kept_frames, spectra = self._onset_spectra(y, sr, onset_frames)
+            with self._stage('note_picking'):
+                peak_hz, peak_mag, polyphony = self._pick_polyphonic(spectra, sr, polyphony)
+                kept_frames = np.repeat(kept_frames, polyphony)
+        elif self.note_engine == 'semitone':
+            midi, semitones = self._active_semitones(y, sr, self.instrument)
+            with self._stage('note_picking'):
+                kept_frames, peak_hz, peak_mag = self._pick_semitones(midi, semitones, onset_frames)
+        else:
+            # Strongest peak per frame from the sparse pitch track
+            pitch_track = self._active_pitch_peaks(y, sr, self.pitch_top_k)
+            with self._stage('note_picking'):
+                kept_frames = onset_frames[onset_frames < pitch_track.n_frames]
+                peak_hz, peak_mag = pitch_track.peaks_at(kept_frames)
 
-                    if confidence > 0.1:  # Filter out low confidence detections
-                        notes.append(note)
-                        confidences.append(float(confidence))
+        # Filter out unvoiced and low confidence detections
+        keep = (peak_hz > 0) & (peak_mag > min_confidence)
+        notes = hz_to_note(peak_hz[keep]).tolist()
+        note_frames = kept_frames[keep]
+        if self.skip_silence:
+            regions = self.voice_activity(y, sr)
+            onset_frames = regions.to_original_frames(onset_frames)
+            note_frames = regions.to_original_frames(note_frames)
+        note_frames = note_frames.astype(int).tolist()
+        confidences = peak_mag[keep].astype(float).tolist()
 
         return {
             'onset_frames': onset_frames,
+            'note_frames': note_frames,
             'notes': notes,
-            'confidences': confidences
+            'confidences': confidences,
+            'polyphony': polyphony
         }
 
+    def _pick_semitones(self, midi: np.ndarray, semitones: np.ndarray,
+                        onset_frames: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Strongest harmonic sum on the semitone grid at each onset"""
+        onset_frames = onset_frames[onset_frames < semitones.shape[1]]
+        window = np.minimum(onset_frames[:, None] + np.arange(self.poly_frames), semitones.shape[1] - 1)
+        frames = semitones[:, window].mean(axis=2)
+        # Harmonic h of a note sits round(12 log2 h) semitones above it
+        harmonics = np.arange(1, self.poly_harmonics + 1)
+        offsets = np.rint(12 * np.log2(harmonics)).astype(np.int64)
+        padded = np.vstack((frames, np.zeros((offsets[-1], frames.shape[1]), dtype=frames.dtype)))
+        rows = np.arange(len(midi))[None, :] + offsets[:, None]
+        salience = np.tensordot(self.poly_harmonic_decay ** (harmonics - 1), padded[rows], axes=1)
+        best = np.argmax(salience, axis=0) if len(midi) else np.zeros(len(onset_frames), dtype=np.int64)
+        columns = np.arange(len(onset_frames))
+        return onset_frames, midi_to_hz(midi[best]), frames[best, columns]
+
+    def _harmonic_comb(self, sr: float, fmin: float, fmax: float):
+        """Sparse harmonic-summation weights and cancellation masks over sub-semitone candidates"""
+        key = (sr, fmin, fmax, self.n_fft, self.poly_steps_per_semitone, self.poly_harmonics, self.poly_harmonic_decay)
+        if key not in self._harmonic_combs:
+            steps = self.poly_steps_per_semitone
+            candidates = np.arange(np.ceil(hz_to_midi(fmin) * steps), np.floor(hz_to_midi(fmax) * steps) + 1) / steps
+            n_bins = 1 + self.n_fft // 2
+            harmonics = np.arange(1, self.poly_harmonics + 1)
+            # Fractional STFT bin of every harmonic of every candidate, split over the two nearest bins
+            position = np.outer(librosa.midi_to_hz(candidates), harmonics) * self.n_fft / sr
+            lower = np.floor(position).astype(np.int64)
+            frac = position - lower
+            weight = self.poly_harmonic_decay ** (harmonics - 1)
+            rows = np.repeat(np.arange(len(candidates)), 2 * len(harmonics))
+            cols = np.stack((lower, lower + 1), axis=2).reshape(-1)
+            vals = np.stack(((1 - frac) * weight, frac * weight), axis=2).reshape(-1)
+            inside = cols < n_bins
+            shape = (len(candidates), n_bins)
+            weights = scipy.sparse.csr_matrix((vals[inside], (rows[inside], cols[inside])), shape=shape)
+            weights = scipy.sparse.diags(1 / np.asarray(weights.sum(axis=1)).ravel()) @ weights
+            # Cancelling a picked note clears the bins either side of each of its harmonics
+            mask_cols = np.stack((lower - 1, lower, lower + 1, lower + 2), axis=2).reshape(-1)
+            mask_rows = np.repeat(np.arange(len(candidates)), 4 * len(harmonics))
+            inside = (mask_cols >= 0) & (mask_cols < n_bins)
+            masks = scipy.sparse.csr_matrix(
+                (np.ones(inside.sum(), dtype=np.float32), (mask_rows[inside], mask_cols[inside])), shape=shape
+            )
+            masks.sum_duplicates()
+            masks.data[:] = 1.0
+            self._harmonic_combs[key] = (candidates, weights.tocsr(), masks)
+        return self._harmonic_combs[key]
+
+    def _onset_spectra(self, y: np.ndarray, sr: float, onset_frames: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Onsets inside the spectrogram and the mean spectrum of the poly_frames frames after each
+
+        Averaging a few frames after each onset keeps the attack transient from dominating.
+        """
+        n_frames = self._n_frames(y, sr)
+        onset_frames = onset_frames[onset_frames < n_frames]
+        window = np.minimum(onset_frames[:, None] + np.arange(self.poly_frames), n_frames - 1)
+        spectra = np.zeros((1 + self.n_fft // 2, len(onset_frames)), dtype=np.float32)
+        for start, S in self._spectrogram_columns(y, sr):
+            with self._stage('note_picking'):
+                for frames in window.T:
+                    inside = (frames >= start) & (frames < start + S.shape[1])
+                    spectra[:, inside] += S[:, frames[inside] - start]
+        return onset_frames, spectra / self.poly_frames
+
+    def _pick_polyphonic(self, spectra: np.ndarray, sr: float,
+                         polyphony: int) -> Tuple[np.ndarray, np.ndarray, int]:
+        """Iterative harmonic summation and cancellation, vectorized over all onset spectra
+
+        Each round picks the candidate with the highest weighted harmonic sum in every
+        frame and clears its harmonics before the next round. The number of rounds is
+        lowered until the estimated multiply-adds fit poly_cost_ceiling. Returns up to
+        polyphony (hz, strength) picks per onset, onset-major.
+        """
+        candidates, weights, masks = self._harmonic_comb(sr, *self.pitch_limits())
+        n_onsets = spectra.shape[1]
+        cost_per_voice = max(n_onsets, 1) * (weights.nnz + 2 * spectra.shape[0])
+        polyphony = int(np.clip(self.poly_cost_ceiling // cost_per_voice, 1, polyphony))
+        if not n_onsets:
+            empty = np.empty(0)
+            return empty, empty, polyphony
+
+        residual = spectra
+
+        picked = np.empty((polyphony, n_onsets), dtype=np.int64)
+        strength = np.empty((polyphony, n_onsets))
+        columns = np.arange(n_onsets)
+        for voice in range(polyphony):
+            salience = weights @ residual
+            picked[voice] = np.argmax(salience, axis=0)
+            strength[voice] = salience[picked[voice], columns]
+            residual *= 1 - masks[picked[voice]].toarray().T
+
+        # Later voices must be a fair fraction of the strongest one in the same frame
+        strength[strength < self.poly_relative_threshold * strength[0]] = 0.0
+        hz = midi_to_hz(np.rint(candidates[picked]))
+        hz[strength == 0] = 0.0
+        # Drop repeated picks of the same semitone within a frame
+        order = np.argsort(hz, axis=0)
+        sorted_hz = np.take_along_axis(hz, order, axis=0)
+        repeated = np.zeros_like(sorted_hz, dtype=bool)
+        repeated[1:] = sorted_hz[1:] == sorted_hz[:-1]
+        hz[order[repeated], np.nonzero(repeated)[1]] = 0.0
+
+        return hz.T.ravel(), strength.T.ravel(), polyphony
+
     def classify_instrument(self, y: np.ndarray, sr: float) -> Dict[str, float]:
         """Enhanced instrument classification using multiple features"""
-        # Extract features
-        spectral_centroid = librosa.feature.spectral_centroid(y=y, sr=sr)
-        spectral_rolloff = librosa.feature.spectral_rolloff(y=y, sr=sr)
-        spectral_bandwidth = librosa.feature.spectral_bandwidth(y=y, sr=sr)
-        zero_crossing_rate = librosa.feature.zero_crossing_rate(y)
+        active = self._active_signal(y, sr)
+        sums = np.zeros(4)
+        for start, S in self._spectrogram_columns(y, sr):
+            with self._stage('classify_instrument'):
+                sums += self._spectral_sums(S, self._frame_samples(active, start, start + S.shape[1], 'edge'), sr)
+        with self._stage('classify_instrument'):
+            return self._classify_instrument(sums / self._n_frames(y, sr))
 
+    def _spectral_sums(self, S: np.ndarray, samples: np.ndarray, sr: float) -> np.ndarray:
+        """Spectral centroid, rolloff, bandwidth and zero-crossing rate summed over the frames of S
+
+        samples are the (uncentred) samples under those frames, for the zero-crossing rate.
+        """
+        spectral_centroid = librosa.feature.spectral_centroid(S=S, sr=sr, n_fft=self.n_fft, hop_length=self.hop_length)
+        spectral_rolloff = librosa.feature.spectral_rolloff(S=S, sr=sr, n_fft=self.n_fft, hop_length=self.hop_length)
+        spectral_bandwidth = librosa.feature.spectral_bandwidth(S=S, sr=sr, n_fft=self.n_fft, hop_length=self.hop_length)
+        zero_crossing_rate = librosa.feature.zero_crossing_rate(
+            samples, frame_length=self.n_fft, hop_length=self.hop_length, center=False
+        )
+        return np.array([np.sum(spectral_centroid), np.sum(spectral_rolloff),
+                         np.sum(spectral_bandwidth), np.sum(zero_crossing_rate)])
+
+    def _classify_instrument(self, feature_means: np.ndarray) -> Dict[str, float]:
         # Calculate feature statistics
-        avg_centroid = float(np.mean(spectral_centroid))
-        avg_rolloff = float(np.mean(spectral_rolloff))
-        avg_bandwidth = float(np.mean(spectral_bandwidth))
-        avg_zcr = float(np.mean(zero_crossing_rate))
+        avg_centroid, avg_rolloff, avg_bandwidth, avg_zcr = (float(mean) for mean in feature_means)
 
         # Normalized confidence scores for each instrument
         confidence_scores = {}
@@ -130,4 +637,66 @@ class AudioProcessor:
             'Bass': round(bass_score / total, 2)
         }
 
-        return confidence_scores
\ No newline at end of file
+        return confidence_scores
+
+    def estimate_key_and_tempo(self, y: np.ndarray, sr: float) -> Dict:
+        """Estimate tempo, beat grid, key and scale from the shared onset envelope and spectrogram"""
+        onset_envelope = self._onset_envelope(y, sr)
+        pitch_track = self._active_pitch_peaks(y, sr, self.pitch_top_k)
+        with self._stage('key_tempo'):
+            tempo, beat_frames = librosa.beat.beat_track(
+                onset_envelope=onset_envelope,
+                sr=sr,
+                hop_length=self.hop_length,
+                bpm=self._tempo(y, sr, onset_envelope) if onset_envelope.any() else None
+            )
+            # Tuning from the existing pitch peaks; chroma_stft would otherwise run piptrack again
+            tuning = librosa.pitch_tuning(pitch_track.hz) if len(pitch_track.hz) else 0.0
+        chroma_sum = np.zeros(12)
+        for _, S in self._spectrogram_columns(y, sr):
+            with self._stage('key_tempo'):
+                chroma_sum += librosa.feature.chroma_stft(
+                    S=S ** 2, sr=sr, n_fft=self.n_fft, hop_length=self.hop_length, tuning=tuning
+                ).sum(axis=1)
+        with self._stage('key_tempo'):
+            key, scale, key_confidence = self._match_key_profile(chroma_sum / self._n_frames(y, sr))
+        if self.skip_silence:
+            beat_frames = self.voice_activity(y, sr).to_original_frames(beat_frames)
+
+        return {
+            'tempo': float(np.atleast_1d(tempo)[0]),
+            'beat_times': librosa.frames_to_time(beat_frames, sr=sr, hop_length=self.hop_length).tolist(),
+            'key': key,
+            'scale': scale,
+            'key_confidence': key_confidence
+        }
+
+    def _tempo(self, y: np.ndarray, sr: float, onset_envelope: np.ndarray) -> float:
+        """librosa's default tempo estimate, averaging the autocorrelation tempogram a chunk of frames at a time"""
+        win_length = int(librosa.time_to_frames(8.0, sr=sr, hop_length=self.hop_length))
+        n_frames = len(onset_envelope)
+        padded = np.pad(onset_envelope, win_length // 2, mode='linear_ramp', end_values=0)
+        windows = librosa.util.frame(padded, frame_length=win_length, hop_length=1)[:, :n_frames]
+        taper = librosa.filters.get_window('hann', win_length, fftbins=True)[:, None]
+        tempogram = np.zeros(win_length)
+        chunk = self._chunk_frames(y, sr)
+        for start in range(0, n_frames, chunk):
+            autocorrelation = librosa.autocorrelate(windows[:, start:start + chunk] * taper, axis=0)
+            tempogram += librosa.util.normalize(autocorrelation, axis=0).sum(axis=1)
+        return float(librosa.feature.tempo(
+            onset_envelope=onset_envelope, sr=sr, hop_length=self.hop_length, tg=tempogram[:, None] / n_frames
+        )[0])
+
+    @staticmethod
+    def _match_key_profile(pitch_class_profile: np.ndarray) -> Tuple[str, str, float]:
+        """Correlate a 12-bin pitch-class histogram with all 24 rotated key profiles at once"""
+        shifts = (np.arange(12)[None, :] - np.arange(12)[:, None]) % 12
+        profiles = np.vstack((MAJOR_PROFILE[shifts], MINOR_PROFILE[shifts]))
+        profiles = (profiles - profiles.mean(axis=1, keepdims=True)) / profiles.std(axis=1, keepdims=True)
+        centred = pitch_class_profile - pitch_class_profile.mean()
+        spread = centred.std()
+        if spread == 0:
+            return PITCH_CLASSES[0], 'major', 0.0
+        scores = profiles @ (centred / spread) / 12
+        best = int(np.argmax(scores))
+        return PITCH_CLASSES[best % 12], 'major' if best < 12 else 'minor', round(float(scores[best]), 2)
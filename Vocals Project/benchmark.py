@@ -0,0 +1,190 @@
+"""Stage timing benchmark for AudioProcessor on synthesized audio
+
+Usage: python benchmark.py [--seconds 120] [--repeat 3] [--silence 0.4] [--file take.wav]
+                           [--memory-budget 64] [--melody]
+"""
+import argparse
+import time
+import librosa
+import numpy as np
+from typing import Dict
+from audio_processor import AudioProcessor
+from melody_search import MelodyIndex
+from synth import PianoSynth
+
+
+def make_test_signal(seconds: float, sr: int = 22050, seed: int = 0) -> np.ndarray:
+    """Random melody in a vocal range rendered with the piano synth, plus light noise"""
+    rng = np.random.default_rng(seed)
+    n_notes = int(seconds * 3)
+    starts = np.sort(rng.uniform(0, max(seconds - 1.5, 0.1), n_notes))
+    midi = np.clip(60 + np.cumsum(rng.integers(-3, 4, n_notes)), 45, 84)
+    y = PianoSynth(sr).render(midi, starts, total_duration=seconds)
+    return (y + 0.005 * rng.standard_normal(len(y))).astype(np.float32)
+
+
+def add_silence(y: np.ndarray, sr: int, fraction: float, seed: int = 0) -> np.ndarray:
+    """Insert pauses between phrases so that fraction of the result is near-silent, as in a vocal take"""
+    if fraction <= 0:
+        return y
+    rng = np.random.default_rng(seed)
+    phrases = np.array_split(y, max(len(y) // (4 * sr), 1))
+    pause_total = int(len(y) * fraction / (1 - fraction))
+    pauses = rng.multinomial(pause_total, np.full(len(phrases), 1 / len(phrases)))
+    parts = []
+    for phrase, pause in zip(phrases, pauses):
+        parts.extend((phrase, 1e-4 * rng.standard_normal(pause).astype(np.float32)))
+    return np.concatenate(parts)
+
+
+def run_pipeline(processor: AudioProcessor, y: np.ndarray, sr: int, polyphony: int = 1) -> Dict[str, float]:
+    processor.stage_timings = {}
+    processor.detect_notes(y, sr, polyphony)
+    processor.detect_pitch_peaks(y, sr)
+    processor.classify_instrument(y, sr)
+    processor.estimate_key_and_tempo(y, sr)
+    return dict(processor.stage_timings)
+
+
+def report(title: str, timings: Dict[str, float], seconds: float) -> float:
+    total = sum(timings.values())
+    print(f"\n{title}")
+    for stage, elapsed in timings.items():
+        print(f"  {stage:<22} {elapsed * 1000:9.1f} ms  {elapsed / total:6.1%}")
+    print(f"  {'total':<22} {total * 1000:9.1f} ms  {seconds / total:6.1f}x realtime")
+    return total
+
+
+def memory_report(budget_mb: float, y: np.ndarray, sr: int, seconds: float):
+    """Per-stage time and peak traced allocation without and with a memory budget"""
+    runs = []
+    for budget in (None, int(budget_mb * 2 ** 20)):
+        processor = AudioProcessor()
+        processor.memory_budget = budget
+        with processor.memory_trace():
+            timings = run_pipeline(processor, y, sr)
+        runs.append((timings, dict(processor.stage_memory)))
+    (full_times, full_peaks), (budget_times, budget_peaks) = runs
+    print(f"\nMemory budget of {budget_mb:.0f} MB, {seconds:.0f}s take (time, peak allocation)")
+    for stage in full_times:
+        print(f"  {stage:<22} {full_times[stage] * 1000:9.1f} ms {full_peaks.get(stage, 0) / 2 ** 20:7.1f} MB"
+              f"   {budget_times.get(stage, 0) * 1000:9.1f} ms {budget_peaks.get(stage, 0) / 2 ** 20:7.1f} MB")
+    print(f"  {'largest stage peak':<22} {max(full_peaks.values()) / 2 ** 20:20.1f} MB"
+          f"   {max(budget_peaks.values()) / 2 ** 20:20.1f} MB")
+    print(f"  {'total time':<22} {sum(full_times.values()):19.2f} s"
+          f"   {sum(budget_times.values()):19.2f} s")
+
+
+def best_of(repeat: int, run) -> Dict[str, float]:
+    """Per-stage minimum over several runs"""
+    runs = [run() for _ in range(repeat)]
+    return {stage: min(r.get(stage, 0.0) for r in runs) for stage in runs[0]}
+
+
+def random_melody(rng: np.random.Generator, n_notes: int) -> np.ndarray:
+    """Stepwise melody that reflects off the edges of a vocal range instead of sticking to them"""
+    steps = rng.choice([-7, -5, -4, -3, -2, -1, 0, 1, 2, 3, 4, 5, 7], n_notes)
+    midi = np.empty(n_notes, dtype=np.int64)
+    midi[0] = 60
+    for i in range(1, n_notes):
+        note = midi[i - 1] + steps[i]
+        midi[i] = note if 45 <= note <= 84 else midi[i - 1] - steps[i]
+    return midi
+
+
+def hummed(rng: np.random.Generator, phrase: np.ndarray, errors: int) -> np.ndarray:
+    """Phrase sung in another key with a wrong note and a split (repeated) note as errors"""
+    query = phrase + int(rng.integers(-6, 7))
+    if errors >= 1:
+        query[len(query) // 3] += rng.choice([-1, 1])
+    if errors >= 2:
+        split = 2 * len(query) // 3
+        query = np.insert(query, split, query[split])
+    return query
+
+
+def melody_benchmark(sizes=(10_000, 100_000, 1_000_000), take_notes: int = 500, phrase: int = 12,
+                     queries: int = 200, target_ms: float = 50.0):
+    """Query-by-humming latency and recall against indexes of increasing size"""
+    rng = np.random.default_rng(0)
+    print(f"\nMelody search, {phrase}-note hummed phrases, target p95 under {target_ms:.0f} ms")
+    for size in sizes:
+        takes = [random_melody(rng, take_notes) for _ in range(size // take_notes)]
+        index = MelodyIndex()
+        start = time.perf_counter()
+        for key, midi in enumerate(takes):
+            index.add(key, midi)
+        index.search(takes[0][:phrase])
+        build = time.perf_counter() - start
+        print(f"  {len(index):>9,} notes: built in {build:.2f} s, {index.nbytes / 2 ** 20:.1f} MiB")
+        for errors in (0, 1, 2):
+            latencies, found = [], 0
+            for _ in range(queries):
+                key = int(rng.integers(len(takes)))
+                first = int(rng.integers(take_notes - phrase))
+                query = hummed(rng, takes[key][first:first + phrase], errors)
+                start = time.perf_counter()
+                matches = index.search(query, top_k=1)
+                latencies.append(time.perf_counter() - start)
+                found += bool(matches) and matches[0].key == key
+            p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+            print(f"    {errors} errors: recall {found / queries:.3f}, p50 {p50:.2f} ms, p95 {p95:.2f} ms"
+                  f"{'' if p95 <= target_ms else '  over target'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=120.0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--silence', type=float, default=0.4, help="fraction of pauses added to the synthetic take")
+    parser.add_argument('--polyphony', type=int, default=4, help="voices per onset for the polyphonic run")
+    parser.add_argument('--file', help="benchmark a real recording instead of synthesized audio")
+    parser.add_argument('--memory-budget', type=float, default=64.0, help="MB for the memory budget run")
+    parser.add_argument('--melody', action='store_true', help="benchmark query-by-humming search only")
+    args = parser.parse_args()
+    if args.melody:
+        melody_benchmark()
+        return
+
+    sr = 22050
+    if args.file:
+        y, sr = librosa.load(args.file, sr=sr)
+        title = args.file
+    else:
+        y = add_silence(make_test_signal(args.seconds, sr), sr, args.silence)
+        title = f"synthetic take with {args.silence:.0%} pauses"
+    seconds = len(y) / sr
+    # Warm up librosa's numba kernels so the first run is not charged for compilation
+    run_pipeline(AudioProcessor(), y[:sr * 5], sr)
+
+    timings = best_of(args.repeat, lambda: run_pipeline(AudioProcessor(), y, sr))
+    full = report(f"Full pipeline, {seconds:.0f}s {title}", timings, seconds)
+
+    skipping = AudioProcessor(skip_silence=True)
+    timings = best_of(args.repeat, lambda: run_pipeline(AudioProcessor(skip_silence=True), y, sr))
+    active = skipping.voice_activity(y, sr).active_fraction
+    skipped = report(f"Skipping silence, {active:.0%} of the audio active", timings, seconds)
+    print(f"\nSilence skipping throughput: {full / skipped:.2f}x")
+
+    mono = best_of(args.repeat, lambda: run_pipeline(AudioProcessor(), y, sr))
+    poly = best_of(args.repeat, lambda: run_pipeline(AudioProcessor(), y, sr, args.polyphony))
+    poly_total = report(f"Polyphonic notes, up to {args.polyphony} per onset", poly, seconds)
+    print(f"\nNote picking: {mono['note_picking'] * 1000:.2f} ms mono, "
+          f"{poly['note_picking'] * 1000:.2f} ms polyphonic; "
+          f"pipeline {poly_total / sum(mono.values()):.2f}x the monophonic cost")
+
+    def semitone_run():
+        processor = AudioProcessor()
+        processor.note_engine = 'semitone'
+        return run_pipeline(processor, y, sr)
+    semitone = best_of(args.repeat, semitone_run)
+    report("Semitone filterbank note engine", semitone, seconds)
+    print(f"\nSemitone engine: {semitone['semitones'] * 1000:.2f} ms filterbank + "
+          f"{semitone['note_picking'] * 1000:.2f} ms picking vs {mono['pitch_peaks'] * 1000:.1f} ms pitch peaks")
+
+    # Last, since tracing slows every allocation
+    memory_report(args.memory_budget, y, sr, seconds)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,4 +8,9 @@ class Config:
     GOOGLE_OAUTH_CLIENT_SECRET = os.environ.get('GOOGLE_OAUTH_CLIENT_SECRET')
     TWILIO_ACCOUNT_SID = os.environ.get('TWILIO_ACCOUNT_SID')
     TWILIO_AUTH_TOKEN = os.environ.get('TWILIO_AUTH_TOKEN')
-    TWILIO_PHONE_NUMBER = os.environ.get('TWILIO_PHONE_NUMBER')
\ No newline at end of file
+    TWILIO_PHONE_NUMBER = os.environ.get('TWILIO_PHONE_NUMBER')
+    # Memory for large analysis arrays held per browser session and across all of them
+    SESSION_MEMORY_MB = int(os.environ.get('SESSION_MEMORY_MB', 512))
+    TOTAL_SESSION_MEMORY_MB = int(os.environ.get('TOTAL_SESSION_MEMORY_MB', 2048))
+    # Bytes one analysis may hold at once, 0 for no cap; the spectral stages run in chunks that fit
+    ANALYSIS_MEMORY_MB = int(os.environ.get('ANALYSIS_MEMORY_MB', 0))
\ No newline at end of file
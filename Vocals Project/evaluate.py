@@ -0,0 +1,232 @@
+"""Accuracy-versus-cost evaluation of the note engines on synthesized reference melodies
+
+Renders random melodies with known onsets and pitches, runs every note engine under every
+analysis profile (sample rate, hop length) and reports note precision, recall and F1, onset
+and pitch error and CPU-seconds per second of audio, marking the Pareto-optimal profiles.
+
+Usage: python evaluate.py [--clips 6] [--seconds 20] [--snr 30] [--engines piptrack semitone pyin]
+                          [--sample-rates 16000 22050 44100] [--hops 256 512 1024] [--plot evaluation.html]
+"""
+import argparse
+import time
+import warnings
+import librosa
+import numpy as np
+import plotly.graph_objects as go
+from typing import List, NamedTuple, Tuple
+from audio_processor import AudioProcessor
+from note_tables import hz_to_note_number, name_to_midi
+from synth import PianoSynth
+
+# A detected note is correct when its onset is this close to a reference note of the same semitone
+ONSET_TOLERANCE = 0.05
+# Profile the app runs with; onset picking windows were tuned in frames at this rate
+DEFAULT_PROFILE = ('semitone', 22050, 512)
+# Instrument range bounding pitch tracking, which contains every reference note
+INSTRUMENT = 'Guitar'
+
+
+class Reference(NamedTuple):
+    y: np.ndarray
+    sr: int
+    times: np.ndarray
+    midi: np.ndarray
+
+
+class Scores(NamedTuple):
+    engine: str
+    sr: int
+    hop: int
+    precision: float
+    recall: float
+    f1: float
+    onset_error: float  # mean absolute onset error of onset-matched notes, ms
+    pitch_error: float  # mean absolute semitone error of onset-matched notes
+    cost: float  # CPU-seconds per second of audio
+
+
+def make_reference(seconds: float, sr: int, seed: int, snr_db: float = 30.0) -> Reference:
+    """Monophonic random-walk melody with onsets 0.3 to 0.9 s apart, rendered with the piano synth plus noise"""
+    rng = np.random.default_rng(seed)
+    gaps = rng.uniform(0.3, 0.9, int(seconds / 0.3) + 1)
+    times = 0.25 + np.cumsum(gaps) - gaps[0]
+    times = times[times < seconds - 1.0]
+    midi = np.clip(64 + np.cumsum(rng.integers(-4, 5, len(times))), 48, 79)
+    y = PianoSynth(sr).render(midi, times, total_duration=seconds)
+    noise = rng.standard_normal(len(y)) * np.sqrt(np.mean(y.astype(np.float64) ** 2) / 10 ** (snr_db / 10))
+    return Reference((y + noise).astype(np.float32), sr, times, midi)
+
+
+def match_notes(ref_times: np.ndarray, est_times: np.ndarray, ref_midi: np.ndarray = None,
+                est_midi: np.ndarray = None, tolerance: float = ONSET_TOLERANCE) -> Tuple[np.ndarray, np.ndarray]:
+    """One-to-one reference and estimate indices with onsets within tolerance, closest pairs first
+
+    With pitches given, a pair must also be the same semitone.
+    """
+    distance = np.abs(ref_times[:, None] - est_times[None, :])
+    allowed = distance <= tolerance
+    if ref_midi is not None:
+        allowed &= ref_midi[:, None] == est_midi[None, :]
+    ref_index, est_index = np.nonzero(allowed)
+    order = np.argsort(distance[ref_index, est_index], kind='stable')
+    used_ref = np.zeros(len(ref_times), dtype=bool)
+    used_est = np.zeros(len(est_times), dtype=bool)
+    pairs = []
+    for r, e in zip(ref_index[order], est_index[order]):
+        if not used_ref[r] and not used_est[e]:
+            used_ref[r] = used_est[e] = True
+            pairs.append((r, e))
+    pairs = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+    return pairs[:, 0], pairs[:, 1]
+
+
+def make_processor(sr: int, hop: int) -> AudioProcessor:
+    """Processor for a profile, with frame-counted windows rescaled to keep their length in seconds"""
+    processor = AudioProcessor()
+    processor.instrument = INSTRUMENT
+    processor.hop_length = hop
+    _, default_sr, default_hop = DEFAULT_PROFILE
+    scale = (sr / hop) / (default_sr / default_hop)
+    processor.onset_params = {
+        name: value if name == 'delta' else max(1, round(value * scale))
+        for name, value in processor.onset_params.items()
+    }
+    processor.poly_frames = max(1, round(processor.poly_frames * scale))
+    return processor
+
+
+def pyin_notes(processor: AudioProcessor, y: np.ndarray, sr: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Notes from librosa.pyin's f0 just after each onset, as a dedicated f0 tracker baseline"""
+    onset_envelope = librosa.onset.onset_strength(y=y, sr=sr, hop_length=processor.hop_length)
+    frames = librosa.onset.onset_detect(
+        onset_envelope=onset_envelope, sr=sr, units='frames', hop_length=processor.hop_length,
+        backtrack=True, **processor.onset_params
+    )
+    fmin, fmax = processor.pitch_limits()
+    f0, voiced, _ = librosa.pyin(y, fmin=fmin, fmax=fmax, sr=sr, frame_length=processor.n_fft,
+                                 hop_length=processor.hop_length)
+    window = np.minimum(frames[:, None] + np.arange(processor.poly_frames), len(f0) - 1)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # onsets with no voiced frame
+        hz = np.nanmedian(np.where(voiced[window], f0[window], np.nan), axis=1)
+    midi = hz_to_note_number(hz)
+    keep = midi >= 0
+    return frames[keep] * processor.hop_length / sr, midi[keep]
+
+
+def detect(engine: str, processor: AudioProcessor, y: np.ndarray, sr: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Onset times and MIDI numbers of the notes an engine finds"""
+    if engine == 'pyin':
+        return pyin_notes(processor, y, sr)
+    processor.note_engine = engine
+    notes = processor.detect_notes(y, sr)
+    return np.asarray(notes['note_frames']) * processor.hop_length / sr, name_to_midi(notes['notes'])
+
+
+def evaluate(engine: str, sr: int, hop: int, references: List[Reference]) -> Scores:
+    # Warm up numba kernels so the first clip is not charged for compilation
+    detect(engine, make_processor(sr, hop), references[0].y[:3 * sr], sr)
+    runtime = 0.0
+    correct = n_ref = n_est = 0
+    onset_errors, pitch_errors = [], []
+    for reference in references:
+        processor = make_processor(sr, hop)
+        start = time.process_time()
+        times, midi = detect(engine, processor, reference.y, sr)
+        runtime += time.process_time() - start
+
+        ref_index, _ = match_notes(reference.times, times, reference.midi, midi)
+        correct += len(ref_index)
+        n_ref += len(reference.times)
+        n_est += len(times)
+        ref_index, est_index = match_notes(reference.times, times)
+        onset_errors.append(np.abs(reference.times[ref_index] - times[est_index]))
+        pitch_errors.append(np.abs(reference.midi[ref_index] - midi[est_index].astype(np.int64)))
+
+    precision = correct / n_est if n_est else 0.0
+    recall = correct / n_ref if n_ref else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if correct else 0.0
+    onset_errors, pitch_errors = np.concatenate(onset_errors), np.concatenate(pitch_errors)
+    seconds = sum(len(reference.y) for reference in references) / sr
+    return Scores(
+        engine, sr, hop, precision, recall, f1,
+        float(onset_errors.mean() * 1000) if len(onset_errors) else np.nan,
+        float(pitch_errors.mean()) if len(pitch_errors) else np.nan,
+        runtime / seconds
+    )
+
+
+def pareto_front(scores: List[Scores]) -> np.ndarray:
+    """Whether each profile is Pareto-optimal: no other is at least as accurate and as cheap, and better in one"""
+    f1 = np.array([s.f1 for s in scores])
+    cost = np.array([s.cost for s in scores])
+    no_worse = (f1[None, :] >= f1[:, None]) & (cost[None, :] <= cost[:, None])
+    better = (f1[None, :] > f1[:, None]) | (cost[None, :] < cost[:, None])
+    return ~(no_worse & better).any(axis=1)
+
+
+def report(scores: List[Scores], optimal: np.ndarray):
+    print(f"\n  {'engine':<9} {'sr':>6} {'hop':>5} {'P':>6} {'R':>6} {'F1':>6} "
+          f"{'onset ms':>9} {'pitch st':>9} {'cpu s/s':>8}")
+    for s, best in sorted(zip(scores, optimal), key=lambda item: item[0].cost):
+        marks = ('*' if best else ' ') + (' default' if (s.engine, s.sr, s.hop) == DEFAULT_PROFILE else '')
+        print(f"  {s.engine:<9} {s.sr:>6} {s.hop:>5} {s.precision:6.3f} {s.recall:6.3f} {s.f1:6.3f} "
+              f"{s.onset_error:9.1f} {s.pitch_error:9.2f} {s.cost:8.4f} {marks}")
+    print("\n  * Pareto-optimal in F1 against CPU-seconds per second of audio")
+
+
+def plot(scores: List[Scores], optimal: np.ndarray, path: str):
+    """F1 against cost per engine, with the Pareto front, as a standalone HTML page"""
+    fig = go.Figure()
+    for engine in dict.fromkeys(s.engine for s in scores):
+        ours = [s for s in scores if s.engine == engine]
+        fig.add_trace(go.Scatter(
+            x=[s.cost for s in ours], y=[s.f1 for s in ours], mode='markers', name=engine,
+            text=[f"{s.sr} Hz, hop {s.hop}<br>onset {s.onset_error:.1f} ms, pitch {s.pitch_error:.2f} st"
+                  for s in ours],
+            marker=dict(size=10)
+        ))
+    front = sorted((s for s, best in zip(scores, optimal) if best), key=lambda s: s.cost)
+    fig.add_trace(go.Scatter(
+        x=[s.cost for s in front], y=[s.f1 for s in front], mode='lines', name='Pareto front',
+        line=dict(dash='dash', color='gray'), line_shape='hv'
+    ))
+    fig.update_layout(
+        title="Note F1 against analysis cost",
+        xaxis=dict(title="CPU-seconds per second of audio", type='log'),
+        yaxis=dict(title="Note F1", range=[0, 1.02])
+    )
+    fig.write_html(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clips', type=int, default=6)
+    parser.add_argument('--seconds', type=float, default=20.0)
+    parser.add_argument('--snr', type=float, default=30.0, help="signal-to-noise ratio of the references in dB")
+    parser.add_argument('--engines', nargs='+', default=['piptrack', 'semitone', 'pyin'])
+    parser.add_argument('--sample-rates', nargs='+', type=int, default=[16000, 22050, 44100])
+    parser.add_argument('--hops', nargs='+', type=int, default=[256, 512, 1024])
+    parser.add_argument('--plot', help="write the accuracy-versus-cost plot to this HTML file")
+    args = parser.parse_args()
+
+    print(f"{args.clips} reference melodies of {args.seconds:.0f} s at {args.snr:.0f} dB SNR, "
+          f"onsets within {ONSET_TOLERANCE * 1000:.0f} ms")
+    scores = []
+    for sr in args.sample_rates:
+        # The same melodies at every sample rate
+        references = [make_reference(args.seconds, sr, seed, args.snr) for seed in range(args.clips)]
+        for hop in args.hops:
+            for engine in args.engines:
+                scores.append(evaluate(engine, sr, hop, references))
+                print(f"  {engine} at {sr} Hz, hop {hop}: F1 {scores[-1].f1:.3f}", flush=True)
+
+    optimal = pareto_front(scores)
+    report(scores, optimal)
+    if args.plot:
+        plot(scores, optimal, args.plot)
+        print(f"\nPlot written to {args.plot}")
+
+
+if __name__ == '__main__':
+    main()
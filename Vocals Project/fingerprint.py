@@ -0,0 +1,227 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+from typing import Hashable, List, NamedTuple, Optional, Tuple
+
+# Hash layout: anchor bin (10 bits), target bin (10 bits), frame gap (6 bits)
+FREQ_BITS = 10
+DT_BITS = 6
+# Spectrogram tile (bins, frames) holding at most one peak
+TILE = (32, 12)
+
+
+def tile_peaks(S: np.ndarray, tile: Tuple[int, int] = TILE,
+               first_frame: int = 0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Bin, frame and magnitude of the strongest cell in every (bins, frames) tile of a spectrogram
+
+    Tiles never straddle columns, so a spectrogram split into column chunks that are
+    multiples of the tile width gives the same peaks chunk by chunk, offset by first_frame.
+    """
+    tile_bins, tile_frames = tile
+    n_bins = min(S.shape[0], 1 << FREQ_BITS) // tile_bins * tile_bins
+    n_frames = S.shape[1] // tile_frames * tile_frames
+    tiles = S[:n_bins, :n_frames].reshape(n_bins // tile_bins, tile_bins, n_frames // tile_frames, tile_frames)
+    tiles = tiles.transpose(0, 2, 1, 3).reshape(n_bins // tile_bins, n_frames // tile_frames, -1)
+    best = tiles.argmax(axis=2) if tiles.size else np.zeros(tiles.shape[:2], dtype=np.int64)
+    strength = np.take_along_axis(tiles, best[..., None], axis=2)[..., 0]
+    rows, cols = np.indices(best.shape)
+    bins = rows * tile_bins + best // tile_frames
+    frames = first_frame + cols * tile_frames + best % tile_frames
+    return bins.ravel(), frames.ravel(), strength.ravel()
+
+
+def pair_peaks(bins: np.ndarray, frames: np.ndarray, strength: np.ndarray, fan_out: int = 5, max_dt: int = 48,
+               max_df: int = 96, search: int = 16) -> Tuple[np.ndarray, np.ndarray]:
+    """Hashed pairs of tile peaks and their anchor frames
+
+    Peaks must clear the median tile by 10 dB. Each is paired with up to fan_out later
+    peaks within max_dt frames and max_df bins, and every pair is packed into one
+    uint32 of (anchor bin, target bin, frame gap).
+    """
+    if not len(strength):
+        return np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.int32)
+    loud = strength > 10 ** 0.5 * max(float(np.median(strength)), 1e-10)
+    bins, frames = bins[loud], frames[loud]
+    order = np.lexsort((bins, frames))
+    bins, frames = bins[order].astype(np.int64), frames[order].astype(np.int64)
+
+    # Targets are searched among the next `search` peaks in time order, keeping the first fan_out in range
+    n = len(frames)
+    anchor = np.repeat(np.arange(n), search)
+    target = anchor + np.tile(np.arange(1, search + 1), n)
+    valid = target < n
+    anchor, target = anchor[valid], target[valid]
+    dt = frames[target] - frames[anchor]
+    keep = (dt > 0) & (dt < min(max_dt, 1 << DT_BITS)) & (np.abs(bins[target] - bins[anchor]) <= max_df)
+    anchor, target, dt = anchor[keep], target[keep], dt[keep]
+    rank = np.arange(len(anchor)) - np.searchsorted(anchor, anchor, side='left')
+    first = rank < fan_out
+    anchor, target, dt = anchor[first], target[first], dt[first]
+
+    hashes = (bins[anchor] << (FREQ_BITS + DT_BITS)) | (bins[target] << DT_BITS) | dt
+    return hashes.astype(np.uint32), frames[anchor].astype(np.int32)
+
+
+def landmarks(S: np.ndarray, tile: Tuple[int, int] = TILE, fan_out: int = 5, max_dt: int = 48,
+              max_df: int = 96, search: int = 16) -> Tuple[np.ndarray, np.ndarray]:
+    """Hashed spectral-peak pairs and their anchor frames from a magnitude spectrogram
+
+    The spectrogram is cut into tiles of (bins, frames) and the strongest bin of each
+    tile that stands out from the quietest tiles becomes a peak, which costs one
+    reshape and argmax rather than a 2-D maximum filter.
+    """
+    return pair_peaks(*tile_peaks(S, tile), fan_out, max_dt, max_df, search)
+
+
+class FingerprintMatch(NamedTuple):
+    key: Hashable
+    shift_frames: int  # stored frame = query frame + shift_frames
+    matches: int
+    score: float  # aligned matches over query hashes
+
+
+class FingerprintIndex:
+    """Inverted index from landmark hash to (track, frame), held as sorted arrays for vectorized lookup"""
+
+    def __init__(self, max_hash_frequency: int = 200, max_query_hashes: int = 1000):
+        # Hashes stored more often than this carry no information and are skipped at query time
+        self.max_hash_frequency = max_hash_frequency
+        self.max_query_hashes = max_query_hashes
+        # Track ids stay stable; a removed track keeps a None key and its postings are dropped
+        self._keys = []
+        self._key_ids = {}
+        self._lengths = []
+        self._hashes = np.empty(0, dtype=np.uint32)
+        self._tracks = np.empty(0, dtype=np.int32)
+        self._offsets = np.empty(0, dtype=np.int32)
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._hashes) + sum(len(p[0]) for p in self._pending)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._key_ids
+
+    def add(self, key: Hashable, hashes: np.ndarray, offsets: np.ndarray, n_frames: int):
+        """Index a track of n_frames frames"""
+        with self._lock:
+            if key in self._key_ids:
+                return
+            self._key_ids[key] = len(self._keys)
+            self._keys.append(key)
+            self._lengths.append(int(n_frames))
+            track = np.full(len(hashes), self._key_ids[key], dtype=np.int32)
+            self._pending.append((np.asarray(hashes, dtype=np.uint32), track, np.asarray(offsets, dtype=np.int32)))
+
+    def remove(self, key: Hashable):
+        """Drop a track's postings"""
+        with self._lock:
+            track = self._key_ids.pop(key, None)
+            if track is None:
+                return
+            self._keys[track] = None
+            self._merge()
+            keep = self._tracks != track
+            self._hashes, self._tracks, self._offsets = self._hashes[keep], self._tracks[keep], self._offsets[keep]
+
+    def _merge(self):
+        """Fold pending tracks into the sorted arrays; one stable sort per batch of additions"""
+        if not self._pending:
+            return
+        hashes, tracks, offsets = (np.concatenate([a] + [p[i] for p in self._pending])
+                                   for i, a in enumerate((self._hashes, self._tracks, self._offsets)))
+        order = np.argsort(hashes, kind='stable')
+        self._hashes, self._tracks, self._offsets = hashes[order], tracks[order], offsets[order]
+        self._pending = []
+
+    def matches(self, hashes: np.ndarray, offsets: np.ndarray, n_frames: Optional[int] = None,
+                min_matches: int = 20, min_score: float = 0.05, slack: int = 0) -> List[FingerprintMatch]:
+        """Stored tracks whose landmarks line up with the query at a single time shift, most votes first
+
+        With n_frames given, only tracks covering all n_frames query frames at the shift, give or
+        take slack frames at either end, qualify; a query that extends past a stored track or
+        starts before it never matches it.
+        """
+        with self._lock:
+            self._merge()
+            stored_hashes, stored_tracks, stored_offsets = self._hashes, self._tracks, self._offsets
+            keys, lengths = list(self._keys), np.array(self._lengths, dtype=np.int64)
+        if not len(hashes) or not len(stored_hashes):
+            return []
+        if len(hashes) > self.max_query_hashes:
+            pick = np.linspace(0, len(hashes) - 1, self.max_query_hashes).astype(np.int64)
+            hashes, offsets = hashes[pick], offsets[pick]
+
+        lo = np.searchsorted(stored_hashes, hashes, side='left')
+        counts = np.searchsorted(stored_hashes, hashes, side='right') - lo
+        counts[counts > self.max_hash_frequency] = 0
+        total = int(counts.sum())
+        if not total:
+            return []
+        # Expand every [lo, lo + count) range into one flat index array
+        starts = np.repeat(lo - np.cumsum(counts) + counts, counts)
+        hits = starts + np.arange(total)
+        shifts = stored_offsets[hits].astype(np.int64) - np.repeat(offsets, counts)
+        pairs = (stored_tracks[hits].astype(np.int64) << 32) | (shifts + (1 << 31))
+        values, votes = np.unique(pairs, return_counts=True)
+        tracks = values >> 32
+        shifts = (values & 0xFFFFFFFF) - (1 << 31)
+        good = (votes >= max(min_matches, min_score * len(hashes)))
+        if n_frames is not None:
+            good &= (shifts >= -slack) & (shifts + n_frames <= lengths[tracks] + slack)
+        found = np.flatnonzero(good)
+        found = found[np.argsort(-votes[found], kind='stable')]
+        return [
+            FingerprintMatch(keys[tracks[i]], int(shifts[i]), int(votes[i]), float(votes[i] / len(hashes)))
+            for i in found if keys[tracks[i]] is not None
+        ]
+
+    def match(self, hashes: np.ndarray, offsets: np.ndarray, n_frames: Optional[int] = None,
+              min_matches: int = 20, min_score: float = 0.05) -> Optional[FingerprintMatch]:
+        """Best stored track whose landmarks line up with the query at a single time shift"""
+        found = self.matches(hashes, offsets, n_frames, min_matches, min_score)
+        return found[0] if found else None
+
+
+class AnalysisLibrary:
+    """Analysis payloads of earlier uploads, found again by fingerprint under the same analysis profile
+
+    Payloads are kept in an LRU and evicting one removes its track from the index. A payload is
+    only reused when its take covers the whole new upload, since the shifted result is cropped
+    to the stored take and anything beyond it would be left without notes.
+    """
+
+    def __init__(self, max_entries: int = 256, min_score: float = 0.1, slack: int = 2):
+        self.max_entries = max_entries
+        self.min_score = min_score
+        # Frames an upload may overhang the stored take by, for encoder padding
+        self.slack = slack
+        self._indexes = {}
+        self._payloads = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, profile: Hashable, hashes: np.ndarray, offsets: np.ndarray,
+               n_frames: int) -> Optional[Tuple[dict, FingerprintMatch]]:
+        index = self._indexes.get(profile)
+        if index is None:
+            return None
+        for found in index.matches(hashes, offsets, n_frames, min_score=self.min_score, slack=self.slack):
+            with self._lock:
+                payload = self._payloads.get((profile, found.key))
+                if payload is not None:
+                    self._payloads.move_to_end((profile, found.key))
+                    return payload, found
+        return None
+
+    def store(self, profile: Hashable, key: Hashable, hashes: np.ndarray, offsets: np.ndarray,
+              n_frames: int, payload: dict):
+        with self._lock:
+            index = self._indexes.setdefault(profile, FingerprintIndex())
+            self._payloads[(profile, key)] = payload
+            evicted = []
+            while len(self._payloads) > self.max_entries:
+                evicted.append(self._payloads.popitem(last=False)[0])
+        index.add(key, hashes, offsets, n_frames)
+        for evicted_profile, evicted_key in evicted:
+            self._indexes[evicted_profile].remove(evicted_key)
@@ -0,0 +1,178 @@
+import threading
+import numpy as np
+from typing import Hashable, List, NamedTuple, Tuple
+
+# Intervals are clipped to an octave either way, giving 25 symbols per n-gram position
+MAX_INTERVAL = 12
+ALPHABET = 2 * MAX_INTERVAL + 1
+
+
+def interval_ngrams(midi, n: int) -> np.ndarray:
+    """Transposition-invariant codes of every n consecutive pitch intervals, one per starting note"""
+    intervals = np.clip(np.diff(np.asarray(midi, dtype=np.int64)), -MAX_INTERVAL, MAX_INTERVAL) + MAX_INTERVAL
+    if len(intervals) < n:
+        return np.empty(0, dtype=np.int64)
+    windows = np.lib.stride_tricks.sliding_window_view(intervals, n)
+    return windows @ (ALPHABET ** np.arange(n - 1, -1, -1))
+
+
+def melody_line(midi, frames) -> Tuple[np.ndarray, np.ndarray]:
+    """Highest note at each onset and its frame, in time order, so chords index as their top voice"""
+    midi, frames = np.asarray(midi), np.asarray(frames)
+    order = np.lexsort((-midi, frames))
+    midi, frames = midi[order], frames[order]
+    first = np.concatenate(([True], frames[1:] != frames[:-1])) if len(frames) else np.empty(0, dtype=bool)
+    return midi[first], frames[first]
+
+
+def banded_dtw(query: np.ndarray, candidates: np.ndarray, band: int) -> np.ndarray:
+    """Subsequence DTW distance of a query against many equal-length, key-aligned candidates at once
+
+    Each query note may repeat the previous candidate note, advance one, or skip one,
+    which keeps every row a vectorized update over all candidates. Paths stay within
+    band notes of the diagonal; the match may start within the first band candidate
+    notes and end anywhere.
+    """
+    m = len(query)
+    n_candidates, length = candidates.shape
+    columns = np.arange(length)
+    inf = np.inf
+    previous = np.where(columns[None, :] <= band, np.abs(query[0] - candidates), inf)
+    for i in range(1, m):
+        shifted_1 = np.concatenate((np.full((n_candidates, 1), inf), previous[:, :-1]), axis=1)
+        shifted_2 = np.concatenate((np.full((n_candidates, 2), inf), previous[:, :-2]), axis=1)
+        best = np.minimum(np.minimum(previous, shifted_1), shifted_2)
+        outside = (columns < i - band) | (columns > i + 2 * band)
+        previous = np.where(outside[None, :], inf, best + np.abs(query[i] - candidates))
+    return previous.min(axis=1) / m
+
+
+class MelodyMatch(NamedTuple):
+    key: Hashable
+    start: int  # index of the first matched note within the take
+    distance: float  # mean absolute semitone error along the DTW path
+    votes: int
+
+
+class MelodyIndex:
+    """Inverted index of interval n-grams over the note sequences of analysed takes
+
+    All takes share one flat note array; postings are the sorted n-gram codes with the
+    global position of their first note. A query votes for (position - query position)
+    alignments and the best candidates are re-ranked with banded DTW on pitch.
+    """
+
+    def __init__(self, n: int = 3, candidates: int = 50, band: int = 3, max_posting: int = 5000):
+        self.n = n
+        self.candidates = candidates
+        self.band = band
+        # N-grams with more postings than this (scales, repeated notes) are too common to vote
+        self.max_posting = max_posting
+        self._keys = []
+        self._key_ids = {}
+        self._track_starts = np.zeros(1, dtype=np.int64)
+        self._midi = np.empty(0, dtype=np.int16)
+        self._codes = np.empty(0, dtype=np.int64)
+        self._positions = np.empty(0, dtype=np.int64)
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Number of indexed notes"""
+        return int(self._track_starts[-1])
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._key_ids
+
+    @property
+    def nbytes(self) -> int:
+        return self._midi.nbytes + self._codes.nbytes + self._positions.nbytes + self._track_starts.nbytes
+
+    def add(self, key: Hashable, midi):
+        """Index one take's notes in onset order"""
+        midi = np.asarray(midi, dtype=np.int16)
+        with self._lock:
+            if key in self._key_ids:
+                return
+            offset = int(self._track_starts[-1])
+            self._key_ids[key] = len(self._keys)
+            self._keys.append(key)
+            self._track_starts = np.append(self._track_starts, offset + len(midi))
+            self._pending.append((midi, offset))
+
+    def _merge(self):
+        """Fold pending takes into the flat note array and the sorted postings"""
+        if not self._pending:
+            return
+        codes = [self._codes]
+        positions = [self._positions]
+        for midi, offset in self._pending:
+            grams = interval_ngrams(midi, self.n)
+            codes.append(grams)
+            positions.append(offset + np.arange(len(grams), dtype=np.int64))
+        self._midi = np.concatenate([self._midi] + [midi for midi, _ in self._pending])
+        codes, positions = np.concatenate(codes), np.concatenate(positions)
+        order = np.argsort(codes, kind='stable')
+        self._codes, self._positions = codes[order], positions[order]
+        self._pending = []
+
+    def search(self, midi, top_k: int = 5) -> List[MelodyMatch]:
+        """Takes containing the hummed phrase, best first"""
+        query = np.asarray(midi, dtype=np.float64)
+        grams = interval_ngrams(query, self.n)
+        with self._lock:
+            self._merge()
+            codes, positions, notes = self._codes, self._positions, self._midi
+            track_starts, keys = self._track_starts, list(self._keys)
+        if not len(grams) or not len(codes):
+            return []
+
+        lo = np.searchsorted(codes, grams, side='left')
+        counts = np.searchsorted(codes, grams, side='right') - lo
+        counts[counts > self.max_posting] = 0
+        total = int(counts.sum())
+        if not total:
+            return []
+        hits = np.repeat(lo - np.cumsum(counts) + counts, counts) + np.arange(total)
+        # Global position where the query's first note would fall for each hit
+        starts = positions[hits] - np.repeat(np.arange(len(grams)), counts)
+        aligned, votes = np.unique(starts, return_counts=True)
+        # An inserted or dropped note moves later n-grams one position, so neighbours share votes
+        neighbours = np.zeros_like(votes)
+        for step in (-1, 1):
+            at = np.searchsorted(aligned, aligned + step)
+            found = at < len(aligned)
+            found[found] = aligned[at[found]] == aligned[found] + step
+            neighbours[found] += votes[at[found]]
+        votes = votes + neighbours
+        if len(aligned) > self.candidates:
+            best = np.argpartition(votes, len(votes) - self.candidates)[len(votes) - self.candidates:]
+            aligned, votes = aligned[best], votes[best]
+
+        # Candidate windows cover the query plus slack on both sides, clipped to their own take
+        length = len(query) + 3 * self.band
+        tracks = np.searchsorted(track_starts, np.maximum(aligned, 0), side='right') - 1
+        first = np.clip(aligned - self.band, track_starts[tracks], None)
+        window = first[:, None] + np.arange(length)[None, :]
+        last = track_starts[tracks + 1][:, None] - 1
+        window = np.minimum(window, last)
+        # Transpose each candidate to the query's key using the notes the votes aligned
+        aligned_notes = notes[np.minimum(np.maximum(aligned, 0)[:, None] + np.arange(len(query)), last)]
+        transpose = np.median(aligned_notes - query, axis=1, keepdims=True)
+        distances = banded_dtw(query, notes[window] - transpose, self.band)
+
+        order = np.lexsort((-votes, distances))
+        matches = []
+        seen = set()
+        for i in order:
+            track = int(tracks[i])
+            if track in seen:
+                continue
+            seen.add(track)
+            matches.append(MelodyMatch(
+                keys[track], int(max(aligned[i], track_starts[track]) - track_starts[track]),
+                float(distances[i]), int(votes[i])
+            ))
+            if len(matches) == top_k:
+                break
+        return matches
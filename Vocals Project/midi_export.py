@@ -0,0 +1,76 @@
+import struct
+import numpy as np
+from typing import Optional
+
+
+def _variable_length(values: np.ndarray):
+    """MIDI variable-length quantities as a (n, 4) byte matrix and a mask of the bytes in use"""
+    values = np.asarray(values, dtype=np.int64)
+    septets = np.stack([(values >> shift) & 0x7F for shift in (21, 14, 7, 0)], axis=1)
+    n_bytes = 1 + (values >= 1 << 7) + (values >= 1 << 14) + (values >= 1 << 21)
+    used = np.arange(4)[None, :] >= (4 - n_bytes)[:, None]
+    septets[:, :3] |= 0x80  # continuation bit on every byte but the last
+    return septets, used
+
+
+def confidences_to_velocities(confidences) -> np.ndarray:
+    """Map detection confidence onto a 40-120 velocity range"""
+    confidences = np.asarray(confidences, dtype=np.float64)
+    if not len(confidences) or confidences.max() <= 0:
+        return np.full(len(confidences), 96, dtype=np.int64)
+    return np.rint(40 + 80 * confidences / confidences.max()).astype(np.int64)
+
+
+def write_midi(midi, start_ticks, length_ticks, tempo: float, velocities: Optional[np.ndarray] = None,
+               ticks_per_beat: int = 480, channel: int = 0) -> bytes:
+    """Encode notes as a single-track (format 0) Standard MIDI File"""
+    midi = np.clip(np.asarray(midi, dtype=np.int64), 0, 127)
+    start_ticks = np.asarray(start_ticks, dtype=np.int64)
+    end_ticks = start_ticks + np.maximum(np.asarray(length_ticks, dtype=np.int64), 1)
+    if velocities is None:
+        velocities = np.full(len(midi), 96, dtype=np.int64)
+    velocities = np.clip(np.asarray(velocities, dtype=np.int64), 1, 127)
+
+    # Interleave note-on and note-off events; at equal ticks note-offs go first
+    ticks = np.concatenate((end_ticks, start_ticks))
+    status = np.concatenate((np.full(len(midi), 0x80), np.full(len(midi), 0x90))) | channel
+    data = np.column_stack((
+        status,
+        np.concatenate((midi, midi)),
+        np.concatenate((np.zeros(len(midi), dtype=np.int64), velocities))
+    ))
+    order = np.lexsort((status & 0xF0, ticks))
+    ticks, data = ticks[order], data[order]
+    deltas = np.diff(ticks, prepend=0)
+
+    septets, used = _variable_length(deltas)
+    rows = np.concatenate((septets, data), axis=1).astype(np.uint8)
+    mask = np.concatenate((used, np.ones(data.shape, dtype=bool)), axis=1)
+    events = rows[mask].tobytes()
+
+    microseconds_per_beat = int(round(60_000_000 / tempo))
+    track = (
+        b'\x00\xff\x51\x03' + microseconds_per_beat.to_bytes(3, 'big')
+        + events
+        + b'\x00\xff\x2f\x00'
+    )
+    header = b'MThd' + struct.pack('>IHHH', 6, 0, 1, ticks_per_beat)
+    return header + b'MTrk' + struct.pack('>I', len(track)) + track
+
+
+def notes_to_midi(midi, starts, durations, tempo: float, confidences=None,
+                  offset: float = 0.0, ticks_per_beat: int = 480) -> bytes:
+    """Encode notes given in seconds, with offset as the time of tick zero"""
+    ticks_per_second = tempo / 60.0 * ticks_per_beat
+    start_ticks = np.rint((np.asarray(starts, dtype=np.float64) - offset) * ticks_per_second).astype(np.int64)
+    length_ticks = np.rint(np.asarray(durations, dtype=np.float64) * ticks_per_second).astype(np.int64)
+    velocities = None if confidences is None else confidences_to_velocities(confidences)
+    return write_midi(midi, np.maximum(start_ticks, 0), length_ticks, tempo, velocities, ticks_per_beat)
+
+
+def quantized_to_midi(midi, quantized: dict, tempo: float, confidences=None, ticks_per_beat: int = 480) -> bytes:
+    """Encode quantize_notes output, keeping its (possibly swung) grid positions"""
+    return notes_to_midi(
+        midi, quantized['starts'], quantized['durations'], tempo, confidences,
+        quantized['offset'], ticks_per_beat
+    )
@@ -8,4 +8,12 @@ class User(db.Model, UserMixin):
     email = db.Column(db.String(150), unique=True)
     phone = db.Column(db.String(15), unique=True)
     password = db.Column(db.String(150))
-    is_verified = db.Column(db.Boolean, default=False)
\ No newline at end of file
+    is_verified = db.Column(db.Boolean, default=False)
+
+class ComputeQuota(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), unique=True, nullable=False)
+    daily_cpu_seconds = db.Column(db.Float, default=600.0)
+    used_cpu_seconds = db.Column(db.Float, default=0.0)
+    period_start = db.Column(db.Date)
+    user = db.relationship('User', backref=db.backref('compute_quota', uselist=False))
@@ -0,0 +1,154 @@
+import hashlib
+import struct
+import numpy as np
+from typing import Dict, Optional
+from pitch_track import SparsePitch
+from note_tables import midi_to_name, name_to_midi
+
+
+class NoteResult:
+    """Compact columnar container for detected notes and the peak pitch track"""
+
+    MAGIC = b'VNRS'
+    VERSION = 1
+    # magic, version, reserved, sample rate, hop length, total frames, note count, pitch point count
+    HEADER = struct.Struct('<4sHHIIIII')
+    FLOAT16_MAX = float(np.finfo(np.float16).max)
+
+    def __init__(self, midi, frames, confidences, sr: int, hop_length: int = 512,
+                 n_frames: int = 0, pitch_frames=None, pitch_hz=None, pitch_mag=None):
+        self.midi = np.asarray(midi, dtype=np.uint8)
+        self.frames = np.asarray(frames, dtype=np.int32)
+        self.confidences = np.clip(
+            np.asarray(confidences, dtype=np.float32), 0, self.FLOAT16_MAX
+        ).astype(np.float16)
+        if not (len(self.midi) == len(self.frames) == len(self.confidences)):
+            raise ValueError("midi, frames and confidences must have the same length")
+
+        self.pitch_frames = np.asarray(pitch_frames if pitch_frames is not None else [], dtype=np.int32)
+        self.pitch_hz = np.asarray(pitch_hz if pitch_hz is not None else [], dtype=np.float32)
+        self.pitch_mag = np.clip(
+            np.asarray(pitch_mag if pitch_mag is not None else [], dtype=np.float32), 0, self.FLOAT16_MAX
+        ).astype(np.float16)
+        if not (len(self.pitch_frames) == len(self.pitch_hz) == len(self.pitch_mag)):
+            raise ValueError("pitch_frames, pitch_hz and pitch_mag must have the same length")
+
+        self.sr = int(sr)
+        self.hop_length = int(hop_length)
+        self.n_frames = int(max(n_frames, self.frames.max(initial=-1) + 1, self.pitch_frames.max(initial=-1) + 1))
+
+    def __len__(self) -> int:
+        return len(self.midi)
+
+    @property
+    def times(self) -> np.ndarray:
+        """Note onset times in seconds"""
+        return self.frames * (self.hop_length / self.sr)
+
+    def shifted(self, shift_frames: int, n_frames: int) -> 'NoteResult':
+        """The same analysis moved shift_frames earlier and cropped to n_frames, for a trimmed copy of the audio"""
+        notes = (self.frames >= shift_frames) & (self.frames < shift_frames + n_frames)
+        points = (self.pitch_frames >= shift_frames) & (self.pitch_frames < shift_frames + n_frames)
+        return NoteResult(
+            self.midi[notes], self.frames[notes] - shift_frames, self.confidences[notes], self.sr,
+            self.hop_length, n_frames, self.pitch_frames[points] - shift_frames,
+            self.pitch_hz[points], self.pitch_mag[points]
+        )
+
+    def pitch_track(self) -> SparsePitch:
+        """The stored peak track as a one-peak-per-frame SparsePitch"""
+        counts = np.bincount(self.pitch_frames, minlength=self.n_frames)[:self.n_frames]
+        indptr = np.concatenate(([0], np.cumsum(counts)))
+        return SparsePitch(indptr, self.pitch_hz, self.pitch_mag.astype(np.float32), self.sr,
+                           hop_length=self.hop_length)
+
+    @staticmethod
+    def peak_track(pitches: np.ndarray, magnitudes: np.ndarray):
+        """Reduce dense piptrack output to the strongest voiced peak per frame"""
+        peak_bins = magnitudes.argmax(axis=0)
+        columns = np.arange(pitches.shape[1])
+        hz = pitches[peak_bins, columns]
+        voiced = np.flatnonzero(hz > 0)
+        return voiced, hz[voiced], magnitudes[peak_bins[voiced], voiced]
+
+    @classmethod
+    def from_notes_data(cls, notes_data: Dict, sr: int, hop_length: int = 512,
+                        pitches: Optional[np.ndarray] = None,
+                        magnitudes: Optional[np.ndarray] = None,
+                        pitch_track: Optional[SparsePitch] = None) -> 'NoteResult':
+        """Build a result from detect_notes output and, optionally, a pitch track"""
+        midi = name_to_midi(notes_data['notes'])
+        frames = notes_data.get('note_frames', notes_data['onset_frames'][:len(midi)])
+        pitch_frames = pitch_hz = pitch_mag = None
+        n_frames = 0
+        if pitch_track is not None:
+            hz, mag = pitch_track.strongest()
+            pitch_frames = np.flatnonzero(hz > 0)
+            pitch_hz, pitch_mag = hz[pitch_frames], mag[pitch_frames]
+            n_frames = pitch_track.n_frames
+        elif pitches is not None and magnitudes is not None:
+            pitch_frames, pitch_hz, pitch_mag = cls.peak_track(pitches, magnitudes)
+            n_frames = pitches.shape[1]
+        return cls(np.clip(midi, 0, 127), frames, notes_data['confidences'], sr, hop_length,
+                   n_frames, pitch_frames, pitch_hz, pitch_mag)
+
+    def to_notes_data(self) -> Dict:
+        """Expand back into the dict shape returned by detect_notes"""
+        frames = self.frames.astype(np.int64)
+        return {
+            'onset_frames': frames,
+            'note_frames': frames,
+            'notes': midi_to_name(self.midi).tolist(),
+            'confidences': self.confidences.astype(np.float32).tolist(),
+            'sr': self.sr
+        }
+
+    def to_bytes(self) -> bytes:
+        """Serialize to the versioned binary layout"""
+        header = self.HEADER.pack(
+            self.MAGIC, self.VERSION, 0, self.sr, self.hop_length,
+            self.n_frames, len(self.midi), len(self.pitch_frames)
+        )
+        return b''.join((
+            header,
+            self.midi.tobytes(), self.frames.tobytes(), self.confidences.tobytes(),
+            self.pitch_frames.tobytes(), self.pitch_hz.tobytes(), self.pitch_mag.tobytes()
+        ))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'NoteResult':
+        """Deserialize without copying the column buffers"""
+        if len(data) < cls.HEADER.size:
+            raise ValueError("Truncated note result header")
+        magic, version, _, sr, hop_length, n_frames, n_notes, n_pitch = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC:
+            raise ValueError("Not a note result buffer")
+        if version != cls.VERSION:
+            raise ValueError(f"Unsupported note result version: {version}")
+
+        columns = (
+            (np.uint8, n_notes), (np.int32, n_notes), (np.float16, n_notes),
+            (np.int32, n_pitch), (np.float32, n_pitch), (np.float16, n_pitch)
+        )
+        expected = cls.HEADER.size + sum(np.dtype(dt).itemsize * n for dt, n in columns)
+        if len(data) != expected:
+            raise ValueError(f"Note result buffer has {len(data)} bytes, expected {expected}")
+
+        arrays = []
+        offset = cls.HEADER.size
+        for dtype, count in columns:
+            arrays.append(np.frombuffer(data, dtype=dtype, count=count, offset=offset))
+            offset += np.dtype(dtype).itemsize * count
+
+        result = cls.__new__(cls)
+        (result.midi, result.frames, result.confidences,
+         result.pitch_frames, result.pitch_hz, result.pitch_mag) = arrays
+        result.sr = sr
+        result.hop_length = hop_length
+        result.n_frames = n_frames
+        return result
+
+    @property
+    def digest(self) -> str:
+        """Content hash used as a cache key for anything derived from this result"""
+        return hashlib.blake2b(self.to_bytes(), digest_size=16).hexdigest()
@@ -0,0 +1,58 @@
+import numpy as np
+from typing import Dict, Optional, Tuple
+from note_result import NoteResult
+
+
+class NoteStore:
+    """Time-indexed note events answering piano-roll window queries"""
+
+    def __init__(self, starts, midi, confidences, durations=None, max_duration: float = 2.0):
+        order = np.argsort(np.asarray(starts, dtype=np.float64), kind='stable')
+        self.starts = np.asarray(starts, dtype=np.float64)[order]
+        self.midi = np.asarray(midi, dtype=np.int16)[order]
+        self.confidences = np.asarray(confidences, dtype=np.float32)[order]
+        if durations is None:
+            # Without offsets, a note lasts until the next onset; notes of a chord share their end
+            onsets = np.append(np.unique(self.starts), np.inf)
+            durations = onsets[np.searchsorted(onsets, self.starts, side='right')] - self.starts
+        else:
+            durations = np.asarray(durations, dtype=np.float64)[order]
+        self.durations = np.clip(durations, 1e-3, max_duration)
+        # Longest note bounds how far before a window a note can start and still overlap it
+        self.max_duration = float(self.durations.max(initial=0.0))
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    @classmethod
+    def from_result(cls, result: NoteResult, durations=None) -> 'NoteStore':
+        return cls(result.times, result.midi, result.confidences, durations)
+
+    @property
+    def duration(self) -> float:
+        """End time of the last note in seconds"""
+        if not len(self.starts):
+            return 0.0
+        return float((self.starts + self.durations).max())
+
+    def pitch_range(self) -> Tuple[int, int]:
+        """Lowest and highest MIDI number in the whole recording"""
+        if not len(self.midi):
+            return 60, 72
+        return int(self.midi.min()), int(self.midi.max())
+
+    def window(self, t0: float, t1: float, max_notes: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """Notes overlapping [t0, t1), thinned to the most confident max_notes"""
+        lo = np.searchsorted(self.starts, t0 - self.max_duration, side='left')
+        hi = np.searchsorted(self.starts, t1, side='left')
+        idx = np.arange(lo, hi)
+        idx = idx[self.starts[idx] + self.durations[idx] > t0]
+        if max_notes is not None and len(idx) > max_notes:
+            top = np.argpartition(self.confidences[idx], len(idx) - max_notes)[len(idx) - max_notes:]
+            idx = np.sort(idx[top])
+        return {
+            'starts': self.starts[idx],
+            'durations': self.durations[idx],
+            'midi': self.midi[idx],
+            'confidences': self.confidences[idx]
+        }
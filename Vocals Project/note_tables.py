@@ -0,0 +1,74 @@
+import numpy as np
+from types import MappingProxyType
+from typing import Iterable
+
+# MIDI-indexed lookup tables (0-127), built once at import and frozen
+MIDI = np.arange(128)
+PITCH_CLASSES = ('C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B')
+FLAT_CLASSES = ('C', 'Db', 'D', 'Eb', 'E', 'F', 'Gb', 'G', 'Ab', 'A', 'Bb', 'B')
+
+NOTE_FREQS = 440.0 * 2.0 ** ((MIDI - 69) / 12.0)
+IS_BLACK = np.array([len(PITCH_CLASSES[m % 12]) > 1 for m in MIDI])
+OCTAVES = MIDI // 12 - 1
+# ASCII spelling used by the keyboard, e.g. 'C#4'
+KEY_NAMES = np.array([f'{PITCH_CLASSES[m % 12]}{m // 12 - 1}' for m in MIDI])
+# Spelling produced by librosa.hz_to_note, e.g. 'C♯4'
+NOTE_NAMES = np.array([name.replace('#', '♯') for name in KEY_NAMES])
+
+for _table in (MIDI, NOTE_FREQS, IS_BLACK, OCTAVES, KEY_NAMES, NOTE_NAMES):
+    _table.setflags(write=False)
+
+
+def _spellings(m: int):
+    octave = m // 12 - 1
+    sharp, flat = PITCH_CLASSES[m % 12], FLAT_CLASSES[m % 12]
+    yield f'{sharp}{octave}'
+    yield f'{sharp.replace("#", "♯")}{octave}'
+    yield f'{flat}{octave}'
+    yield f'{flat.replace("b", "♭")}{octave}'
+    yield f'{sharp}{octave}/{flat}{octave}'
+
+
+NAME_TO_MIDI = MappingProxyType({name: m for m in range(128) for name in _spellings(m)})
+
+# Piano range (A0-C8) in the 'C#4/Db4' style used by AudioVisualizer.note_freqs
+PIANO_NOTE_FREQS = MappingProxyType({
+    (f'{PITCH_CLASSES[m % 12]}{m // 12 - 1}/{FLAT_CLASSES[m % 12]}{m // 12 - 1}'
+     if IS_BLACK[m] else str(KEY_NAMES[m])): round(float(NOTE_FREQS[m]), 2)
+    for m in range(21, 109)
+})
+
+
+def hz_to_midi(hz) -> np.ndarray:
+    """Fractional MIDI number for each frequency, NaN where hz <= 0"""
+    hz = np.asarray(hz, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(hz > 0, 69.0 + 12.0 * np.log2(hz / 440.0), np.nan)
+
+
+def hz_to_note_number(hz) -> np.ndarray:
+    """Nearest MIDI note for each frequency, -1 where hz <= 0"""
+    midi = hz_to_midi(hz)
+    return np.where(np.isnan(midi), -1, np.clip(np.rint(np.nan_to_num(midi)), 0, 127)).astype(np.int16)
+
+
+def midi_to_hz(midi) -> np.ndarray:
+    """Equal-tempered frequency for each MIDI number"""
+    return NOTE_FREQS[np.asarray(midi, dtype=np.int64)]
+
+
+def midi_to_name(midi, keyboard: bool = False) -> np.ndarray:
+    """Note name for each MIDI number, ASCII keyboard spelling if requested"""
+    table = KEY_NAMES if keyboard else NOTE_NAMES
+    return table[np.asarray(midi, dtype=np.int64)]
+
+
+def name_to_midi(names: Iterable[str]) -> np.ndarray:
+    """MIDI number for each note name in any supported spelling, -1 if unknown"""
+    names = list(names)
+    return np.fromiter((NAME_TO_MIDI.get(n, -1) for n in names), dtype=np.int16, count=len(names))
+
+
+def hz_to_note(hz) -> np.ndarray:
+    """Vectorized equivalent of librosa.hz_to_note"""
+    return midi_to_name(np.maximum(hz_to_note_number(hz), 0))
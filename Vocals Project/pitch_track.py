@@ -0,0 +1,93 @@
+import numpy as np
+from typing import List, Optional, Tuple
+
+
+class SparsePitch:
+    """Top-k piptrack peaks per frame stored as CSR-style (frame, hz, magnitude) triplets"""
+
+    def __init__(self, indptr: np.ndarray, hz: np.ndarray, magnitudes: np.ndarray,
+                 sr: float, n_fft: int = 2048, hop_length: int = 512):
+        self.indptr = np.asarray(indptr, dtype=np.int32)
+        self.hz = np.asarray(hz, dtype=np.float32)
+        self.magnitudes = np.asarray(magnitudes, dtype=np.float32)
+        self.sr = sr
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+
+    @property
+    def n_frames(self) -> int:
+        return len(self.indptr) - 1
+
+    @property
+    def nbytes(self) -> int:
+        return self.indptr.nbytes + self.hz.nbytes + self.magnitudes.nbytes
+
+    @classmethod
+    def from_piptrack(cls, pitches: np.ndarray, magnitudes: np.ndarray, sr: float,
+                      top_k: int = 3, n_fft: int = 2048, hop_length: int = 512) -> 'SparsePitch':
+        """Keep the top_k voiced peaks of each frame, strongest first"""
+        n_bins, n_frames = magnitudes.shape
+        k = max(1, min(top_k, n_bins))
+        if n_frames == 0:
+            return cls(np.zeros(1, dtype=np.int32), [], [], sr, n_fft, hop_length)
+
+        top = np.argpartition(magnitudes, n_bins - k, axis=0)[n_bins - k:]
+        top_mag = np.take_along_axis(magnitudes, top, axis=0)
+        order = np.argsort(-top_mag, axis=0, kind='stable')
+        top = np.take_along_axis(top, order, axis=0)
+        top_mag = np.take_along_axis(top_mag, order, axis=0)
+        top_hz = np.take_along_axis(pitches, top, axis=0)
+
+        # Frame-major so each frame's peaks are contiguous
+        keep = ((top_hz > 0) & (top_mag > 0)).T
+        counts = keep.sum(axis=1)
+        indptr = np.concatenate(([0], np.cumsum(counts)))
+        return cls(indptr, top_hz.T[keep], top_mag.T[keep], sr, n_fft, hop_length)
+
+    @classmethod
+    def concatenate(cls, parts: List['SparsePitch']) -> 'SparsePitch':
+        """Join consecutive chunks into one track"""
+        first = parts[0]
+        offsets = np.cumsum([0] + [len(p.hz) for p in parts[:-1]])
+        indptr = np.concatenate([parts[0].indptr[:1]] + [p.indptr[1:] + off for p, off in zip(parts, offsets)])
+        return cls(
+            indptr,
+            np.concatenate([p.hz for p in parts]),
+            np.concatenate([p.magnitudes for p in parts]),
+            first.sr, first.n_fft, first.hop_length
+        )
+
+    def frames(self) -> np.ndarray:
+        """Frame index of every stored peak"""
+        return np.repeat(np.arange(self.n_frames, dtype=np.int32), np.diff(self.indptr))
+
+    def strongest(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Per-frame hz and magnitude of the strongest peak, zero where unvoiced"""
+        hz = np.zeros(self.n_frames, dtype=np.float32)
+        mag = np.zeros(self.n_frames, dtype=np.float32)
+        voiced = np.flatnonzero(np.diff(self.indptr) > 0)
+        first = self.indptr[voiced]
+        hz[voiced] = self.hz[first]
+        mag[voiced] = self.magnitudes[first]
+        return hz, mag
+
+    def peaks_at(self, frames: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Strongest peak at the given frames, as the note detector needs it"""
+        frames = np.asarray(frames, dtype=np.int64)
+        frames = frames[(frames >= 0) & (frames < self.n_frames)]
+        start, stop = self.indptr[frames], self.indptr[frames + 1]
+        voiced = stop > start
+        hz = np.zeros(len(frames), dtype=np.float32)
+        mag = np.zeros(len(frames), dtype=np.float32)
+        hz[voiced] = self.hz[start[voiced]]
+        mag[voiced] = self.magnitudes[start[voiced]]
+        return hz, mag
+
+    def to_dense(self, n_bins: Optional[int] = None) -> np.ndarray:
+        """Rebuild a piptrack-shaped pitch matrix for the pitch map"""
+        if n_bins is None:
+            n_bins = self.n_fft // 2 + 1
+        dense = np.zeros((n_bins, self.n_frames), dtype=np.float32)
+        bins = np.clip(np.rint(self.hz * self.n_fft / self.sr).astype(np.int64), 0, n_bins - 1)
+        dense[bins, self.frames()] = self.hz
+        return dense
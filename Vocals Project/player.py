@@ -0,0 +1,41 @@
+import os
+from typing import Optional
+import numpy as np
+import streamlit.components.v1 as components
+from streamlit import runtime
+from note_result import NoteResult
+from waveform import WaveformPyramid
+
+# Static frontend in player/: the browser caches its script and styles, and every
+# analysis only sends the note events, the duration and URLs of the audio and its
+# waveform pyramid, whose levels the frontend fetches by byte range as it zooms
+_audio_player = components.declare_component(
+    'audio_player', path=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'player')
+)
+
+
+def media_url(data: bytes, mimetype: str, coordinates: str) -> str:
+    """URL of data on Streamlit's media endpoint, content-addressed so reruns reuse it"""
+    if not runtime.exists():
+        return ''
+    return runtime.get_instance().media_file_mgr.add(data, mimetype, coordinates)
+
+
+def audio_player(audio_data: bytes, mimetype: str, result: NoteResult, duration: float,
+                 converted_audio: Optional[bytes] = None, waveform: Optional[WaveformPyramid] = None,
+                 key: str = 'audio_player'):
+    """Original and converted audio with a keyboard lighting up the detected notes"""
+    order = np.argsort(result.frames, kind='stable')
+    _audio_player(
+        audio_url=media_url(audio_data, mimetype, f'{key}.original'),
+        converted_url=media_url(converted_audio, 'audio/wav', f'{key}.converted') if converted_audio else None,
+        midi=result.midi[order].tolist(),
+        times=np.rint(result.times[order] * 1000).astype(int).tolist(),
+        duration=duration,
+        waveform_url=media_url(waveform.to_bytes(), 'application/octet-stream', f'{key}.waveform') if waveform else None,
+        waveform_levels=waveform.table() if waveform else [],
+        sr=result.sr,
+        digest=result.digest,
+        key=key,
+        default=None
+    )
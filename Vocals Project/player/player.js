@@ -0,0 +1,538 @@
+// Audio player with a synchronized keyboard, served as a static Streamlit component.
+// The page loads once per session; each analysis only sends a render message carrying
+// {audio_url, converted_url, midi, times, duration, digest, waveform_url, waveform_levels, sr},
+// with times in milliseconds.
+
+const piano = document.getElementById('piano');
+const audio = document.getElementById('audio-player');
+const convertedPlayer = document.getElementById('converted-player');
+const convertedControls = document.getElementById('converted-controls');
+const playConvertedBtn = document.getElementById('play-converted-btn');
+const progressBar = document.getElementById('progress-bar');
+const progressFill = document.getElementById('progress-fill');
+const timeDisplay = document.getElementById('time-display');
+const waveformCanvas = document.getElementById('waveform');
+
+// Streamlit component protocol, without the npm helper library
+function sendMessage(type, data) {
+    window.parent.postMessage(Object.assign({ isStreamlitMessage: true, type: type }, data), '*');
+}
+
+function setFrameHeight() {
+    sendMessage('streamlit:setFrameHeight', { height: document.documentElement.scrollHeight });
+}
+
+// Media URLs are server-absolute; keep any base path the app is served under
+function resolveUrl(url) {
+    if (!url || /^(https?:|data:|blob:)/.test(url)) return url;
+    return window.location.pathname.split('/component/')[0] + url;
+}
+
+// Keyboard from C0 to B7 (MIDI 12-107), built once
+const WHITE_KEYS = ['C', 'D', 'E', 'F', 'G', 'A', 'B'];
+const PITCH_CLASSES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B'];
+const WHITE_OFFSETS = { C: 0, D: 2, E: 4, F: 5, G: 7, A: 9, B: 11 };
+const HAS_SHARP = { C: true, D: true, F: true, G: true, A: true };
+const keysByMidi = {};
+
+function noteName(midi) {
+    return PITCH_CLASSES[midi % 12] + (Math.floor(midi / 12) - 1);
+}
+
+function noteFrequency(midi) {
+    return 440 * Math.pow(2, (midi - 69) / 12);
+}
+
+function makeKey(className, midi) {
+    const key = document.createElement('div');
+    key.className = className;
+    key.dataset.midi = midi;
+    const label = document.createElement('span');
+    label.className = 'note-label';
+    label.textContent = noteName(midi);
+    key.appendChild(label);
+    keysByMidi[midi] = key;
+    return key;
+}
+
+function buildKeyboard() {
+    const keys = document.createDocumentFragment();
+    for (let octave = 0; octave < 8; octave++) {
+        WHITE_KEYS.forEach(white => {
+            const midi = 12 * (octave + 1) + WHITE_OFFSETS[white];
+            const key = makeKey('key', midi);
+            if (HAS_SHARP[white]) key.appendChild(makeKey('black-key', midi + 1));
+            keys.appendChild(key);
+        });
+    }
+    piano.appendChild(keys);
+}
+
+// Note events of the current analysis, sorted by onset
+let noteTimes = [];
+let noteMidi = [];
+let convertedAudioDuration = 0;
+
+// Audio context for sound generation
+let audioContext = null;
+let masterGain = null;
+let isPlayingConverted = false;
+let convertedAudioStartTime = 0;
+let animationId = null;
+
+// Look-ahead scheduler: only notes starting inside the next window get oscillators,
+// so live node count follows polyphony rather than song length
+const SCHEDULE_AHEAD = 0.2;      // seconds scheduled ahead of the playhead
+const SCHEDULER_INTERVAL = 25;   // ms between scheduler ticks
+const MAX_VOICES = 16;           // voice pool size, oldest voice is stolen beyond this
+const MAX_PARTIALS = 6;
+const HIGHLIGHT_WINDOW = 80;     // ms either side of an onset that lights its key during playback
+const voicePool = [];
+let nextNoteIndex = 0;
+let schedulerTimer = null;
+
+function initAudioContext() {
+    if (audioContext) return;
+    try {
+        audioContext = new (window.AudioContext || window.webkitAudioContext)();
+        masterGain = audioContext.createGain();
+        masterGain.connect(audioContext.destination);
+        initVoicePool();
+    } catch (e) {
+        console.error("Web Audio API not supported:", e);
+    }
+}
+
+// Each voice owns one persistent gain node per partial; notes only add short-lived oscillators
+function initVoicePool() {
+    for (let v = 0; v < MAX_VOICES; v++) {
+        const gains = [];
+        for (let p = 0; p < MAX_PARTIALS; p++) {
+            const gain = audioContext.createGain();
+            gain.gain.value = 0;
+            gain.connect(masterGain);
+            gains.push(gain);
+        }
+        voicePool.push({ gains: gains, oscillators: [], endTime: 0 });
+    }
+}
+
+function acquireVoice(time) {
+    let oldest = voicePool[0];
+    for (const voice of voicePool) {
+        if (voice.endTime <= time) return voice;
+        if (voice.endTime < oldest.endTime) oldest = voice;
+    }
+    return oldest;
+}
+
+function silenceVoice(voice, time) {
+    voice.oscillators.forEach(osc => {
+        try { osc.stop(time); } catch (e) { /* already stopped */ }
+    });
+    voice.oscillators = [];
+    voice.gains.forEach(gain => {
+        gain.gain.cancelScheduledValues(time);
+        gain.gain.setValueAtTime(0, time);
+    });
+    voice.endTime = time;
+}
+
+// Timbre and envelope per frequency range
+function pianoVoiceParams(frequency) {
+    if (frequency <= 196) { // C0 to G3 - Enhanced bass characteristics
+        return { duration: 1.5, amplitudes: [0.4, 0.25, 0.15, 0.1, 0.06, 0.04], waveType: 'sawtooth',
+                 attackTime: 0.05, decayTime: 0.2, sustainLevel: 0.7 };
+    } else if (frequency <= 523) { // A3 to C5 - Mid range
+        return { duration: 1.2, amplitudes: [0.3, 0.2, 0.12, 0.08], waveType: 'triangle',
+                 attackTime: 0.03, decayTime: 0.15, sustainLevel: 0.6 };
+    } else if (frequency <= 1500) { // Mid-high range
+        return { duration: 1.0, amplitudes: [0.25, 0.15, 0.1], waveType: 'triangle',
+                 attackTime: 0.02, decayTime: 0.1, sustainLevel: 0.5 };
+    }
+    // High treble
+    return { duration: 0.8, amplitudes: [0.2, 0.12], waveType: 'sine',
+             attackTime: 0.02, decayTime: 0.1, sustainLevel: 0.5 };
+}
+
+function playRealisticPianoSound(midi, startTime = null) {
+    initAudioContext();
+    if (!audioContext) return;
+
+    try {
+        const frequency = noteFrequency(midi);
+        const now = startTime === null ? audioContext.currentTime : startTime;
+        const params = pianoVoiceParams(frequency);
+        const voice = acquireVoice(now);
+        silenceVoice(voice, now);
+
+        // Fundamental plus harmonic series, one oscillator per partial
+        params.amplitudes.forEach((amp, index) => {
+            const osc = audioContext.createOscillator();
+            const gain = voice.gains[index];
+            osc.frequency.setValueAtTime(frequency * (index + 1), now);
+            osc.type = index === 0 ? params.waveType : (index <= 2 ? 'sine' : 'triangle');
+            osc.connect(gain);
+
+            // ADSR envelope
+            gain.gain.setValueAtTime(0, now);
+            gain.gain.linearRampToValueAtTime(amp, now + params.attackTime);
+            gain.gain.exponentialRampToValueAtTime(amp * params.sustainLevel, now + params.attackTime + params.decayTime);
+            gain.gain.exponentialRampToValueAtTime(0.001, now + params.duration);
+            gain.gain.setValueAtTime(0, now + params.duration);
+
+            osc.start(now);
+            osc.stop(now + params.duration);
+            osc.onended = () => osc.disconnect();
+            voice.oscillators.push(osc);
+        });
+        voice.endTime = now + params.duration;
+    } catch (e) {
+        console.error("Error playing piano sound:", e);
+    }
+}
+
+// First note at or after a time in ms, by binary search over sorted onsets
+function noteIndexAt(timeMs) {
+    let lo = 0, hi = noteTimes.length;
+    while (lo < hi) {
+        const mid = (lo + hi) >> 1;
+        if (noteTimes[mid] < timeMs) lo = mid + 1; else hi = mid;
+    }
+    return lo;
+}
+
+function schedulerTick() {
+    const now = audioContext.currentTime;
+    const horizon = (now - convertedAudioStartTime + SCHEDULE_AHEAD) * 1000;
+    while (nextNoteIndex < noteTimes.length && noteTimes[nextNoteIndex] < horizon) {
+        const index = nextNoteIndex++;
+        const when = Math.max(convertedAudioStartTime + noteTimes[index] / 1000, now);
+        const midi = noteMidi[index];
+        playRealisticPianoSound(midi, when);
+        setTimeout(() => highlightDetectedKey(midi, 200), (when - now) * 1000);
+    }
+}
+
+function startScheduler(songTime) {
+    convertedAudioStartTime = audioContext.currentTime - songTime;
+    nextNoteIndex = noteIndexAt(songTime * 1000);
+    isPlayingConverted = true;
+    playConvertedBtn.textContent = 'Stop';
+    schedulerTick();
+    schedulerTimer = setInterval(schedulerTick, SCHEDULER_INTERVAL);
+    if (!animationId) updateConvertedProgress();
+}
+
+function stopScheduler() {
+    if (schedulerTimer) {
+        clearInterval(schedulerTimer);
+        schedulerTimer = null;
+    }
+    const now = audioContext ? audioContext.currentTime : 0;
+    voicePool.forEach(voice => silenceVoice(voice, now));
+}
+
+function playConvertedAudio() {
+    if (isPlayingConverted) {
+        stopConvertedAudio();
+        return;
+    }
+    initAudioContext();
+    if (!audioContext) return;
+    startScheduler(0);
+}
+
+function stopConvertedAudio() {
+    stopScheduler();
+    isPlayingConverted = false;
+    playConvertedBtn.textContent = 'Play';
+    if (animationId) {
+        cancelAnimationFrame(animationId);
+        animationId = null;
+    }
+    progressFill.style.width = '0%';
+    updateTimeDisplay(0);
+}
+
+function updateConvertedProgress() {
+    if (!isPlayingConverted) {
+        animationId = null;
+        return;
+    }
+    const currentTime = audioContext.currentTime - convertedAudioStartTime;
+    const progress = convertedAudioDuration > 0 ? Math.min(currentTime / convertedAudioDuration, 1) : 1;
+    progressFill.style.width = (progress * 100) + '%';
+    updateTimeDisplay(currentTime);
+    if (progress >= 1) {
+        stopConvertedAudio();
+    } else {
+        animationId = requestAnimationFrame(updateConvertedProgress);
+    }
+}
+
+function formatTime(time) {
+    const minutes = Math.floor(time / 60);
+    const seconds = Math.floor(time % 60);
+    return minutes + ':' + seconds.toString().padStart(2, '0');
+}
+
+function updateTimeDisplay(currentTime) {
+    timeDisplay.textContent = formatTime(Math.max(0, currentTime)) + ' / ' + formatTime(convertedAudioDuration);
+}
+
+// Seek by silencing live voices and moving the scheduler cursor
+progressBar.addEventListener('click', (e) => {
+    if (!isPlayingConverted) return;
+    const rect = progressBar.getBoundingClientRect();
+    const progress = (e.clientX - rect.left) / rect.width;
+    stopScheduler();
+    startScheduler(progress * convertedAudioDuration);
+});
+
+// Waveform overview of the original audio. The pyramid is one binary file of columns of
+// (min, max, RMS) int8 triples at power-of-two block sizes; the view picks the coarsest
+// level with a column per pixel and fetches just the visible columns by byte range, in
+// fixed chunks so panning and zooming back reuse what was already loaded.
+const WAVEFORM_CHUNK = 2048;     // columns per range request, 6 KB
+const WAVEFORM_CACHE = 64;       // chunks kept, least recently used dropped first
+const ZOOM_SPEED = 0.002;
+let waveform = null;             // {url, levels: [[samples per column, byte offset, columns]], sr}
+let viewStart = 0;               // visible span of the original audio, in seconds
+let viewEnd = 0;
+const waveformChunks = new Map();
+const pendingChunks = new Set();
+
+function waveformLevel(samplesPerPixel) {
+    let best = 0;
+    waveform.levels.forEach((level, index) => { if (level[0] <= samplesPerPixel) best = index; });
+    return best;
+}
+
+function waveformChunk(levelIndex, chunk) {
+    const key = waveform.url + '#' + levelIndex + ':' + chunk;
+    const cached = waveformChunks.get(key);
+    if (cached) {
+        waveformChunks.delete(key);
+        waveformChunks.set(key, cached);
+        return cached;
+    }
+    if (!pendingChunks.has(key)) {
+        pendingChunks.add(key);
+        const [, offset, columns] = waveform.levels[levelIndex];
+        const first = chunk * WAVEFORM_CHUNK;
+        const start = offset + first * 3;
+        const length = Math.min(WAVEFORM_CHUNK, columns - first) * 3;
+        const url = waveform.url;
+        fetch(resolveUrl(url), { headers: { Range: 'bytes=' + start + '-' + (start + length - 1) } })
+            .then(response => {
+                if (!response.ok) throw new Error('HTTP ' + response.status);
+                return response.arrayBuffer().then(buffer => {
+                    // A server ignoring Range sends the whole pyramid
+                    return response.status === 206 ? new Int8Array(buffer) : new Int8Array(buffer, start, length);
+                });
+            })
+            .then(data => {
+                if (!waveform || waveform.url !== url) return;
+                waveformChunks.set(key, data);
+                if (waveformChunks.size > WAVEFORM_CACHE) waveformChunks.delete(waveformChunks.keys().next().value);
+                drawWaveform();
+            })
+            .catch(e => console.error("Error loading waveform:", e))
+            .finally(() => pendingChunks.delete(key));
+    }
+    return null;
+}
+
+function drawWaveform() {
+    if (!waveform || waveformCanvas.hidden || viewEnd <= viewStart) return;
+    const ratio = window.devicePixelRatio || 1;
+    const width = Math.max(1, Math.round(waveformCanvas.clientWidth * ratio));
+    const height = Math.max(1, Math.round(waveformCanvas.clientHeight * ratio));
+    if (waveformCanvas.width !== width) waveformCanvas.width = width;
+    if (waveformCanvas.height !== height) waveformCanvas.height = height;
+    const ctx = waveformCanvas.getContext('2d');
+    ctx.clearRect(0, 0, width, height);
+
+    const samplesPerPixel = (viewEnd - viewStart) * waveform.sr / width;
+    const levelIndex = waveformLevel(samplesPerPixel);
+    const [samplesPerColumn, , columns] = waveform.levels[levelIndex];
+    const columnsPerPixel = samplesPerPixel / samplesPerColumn;
+    const firstColumn = viewStart * waveform.sr / samplesPerColumn;
+    const lastColumn = Math.min(columns, Math.ceil(firstColumn + width * columnsPerPixel));
+    const firstChunk = Math.floor(firstColumn / WAVEFORM_CHUNK);
+    const chunks = [];
+    for (let chunk = firstChunk; chunk * WAVEFORM_CHUNK < lastColumn; chunk++) {
+        chunks.push(waveformChunk(levelIndex, chunk));
+    }
+
+    const middle = height / 2;
+    const scale = middle / 127;
+    for (let x = 0; x < width; x++) {
+        const from = Math.floor(firstColumn + x * columnsPerPixel);
+        const to = Math.min(lastColumn, Math.max(from + 1, Math.floor(firstColumn + (x + 1) * columnsPerPixel)));
+        let low = 127, high = -127, rms = 0;
+        for (let column = from; column < to; column++) {
+            const data = chunks[Math.floor(column / WAVEFORM_CHUNK) - firstChunk];
+            if (!data) continue;
+            const i = (column % WAVEFORM_CHUNK) * 3;
+            low = Math.min(low, data[i]);
+            high = Math.max(high, data[i + 1]);
+            rms = Math.max(rms, data[i + 2]);
+        }
+        if (high < low) continue;
+        ctx.fillStyle = '#3a7cff';
+        ctx.fillRect(x, middle - high * scale, 1, Math.max(1, (high - low) * scale));
+        ctx.fillStyle = '#8fb4ff';
+        ctx.fillRect(x, middle - rms * scale, 1, Math.max(1, 2 * rms * scale));
+    }
+
+    const playhead = (audio.currentTime - viewStart) / (viewEnd - viewStart) * width;
+    if (playhead >= 0 && playhead <= width) {
+        ctx.fillStyle = '#ffffff';
+        ctx.fillRect(Math.round(playhead), 0, Math.max(1, Math.round(ratio)), height);
+    }
+}
+
+function waveformTime(clientX) {
+    const rect = waveformCanvas.getBoundingClientRect();
+    return viewStart + (clientX - rect.left) / rect.width * (viewEnd - viewStart);
+}
+
+// Keep the playhead in view while the original audio plays
+function followPlayhead() {
+    const span = viewEnd - viewStart;
+    if (audio.currentTime < viewStart || audio.currentTime > viewEnd) {
+        viewStart = Math.max(0, Math.min(audio.currentTime, convertedAudioDuration - span));
+        viewEnd = viewStart + span;
+    }
+    drawWaveform();
+}
+
+// Scroll zooms around the pointer down to one finest-level column per pixel; horizontal scroll pans
+waveformCanvas.addEventListener('wheel', e => {
+    if (!waveform || viewEnd <= viewStart) return;
+    e.preventDefault();
+    const span = viewEnd - viewStart;
+    const minSpan = Math.min(convertedAudioDuration,
+        waveformCanvas.clientWidth * waveform.levels[0][0] / waveform.sr);
+    const newSpan = Math.max(minSpan, Math.min(convertedAudioDuration, span * Math.exp(e.deltaY * ZOOM_SPEED)));
+    const anchor = waveformTime(e.clientX);
+    const start = anchor - (anchor - viewStart) * newSpan / span + e.deltaX / waveformCanvas.clientWidth * newSpan;
+    viewStart = Math.max(0, Math.min(start, convertedAudioDuration - newSpan));
+    viewEnd = viewStart + newSpan;
+    drawWaveform();
+}, { passive: false });
+
+waveformCanvas.addEventListener('click', e => {
+    audio.currentTime = Math.max(0, waveformTime(e.clientX));
+    drawWaveform();
+});
+audio.addEventListener('seeked', followPlayhead);
+audio.addEventListener('timeupdate', followPlayhead);
+
+function highlightDetectedKey(midi, duration = 400) {
+    const el = keysByMidi[midi];
+    if (!el || el.classList.contains('detected')) return;
+    el.classList.add('detected');
+    setTimeout(() => el.classList.remove('detected'), duration);
+}
+
+// Key animation for the original and server-rendered players; only onsets near the
+// playhead are visited, found by binary search
+let raf = null;
+function animateKeys(media) {
+    const tNow = media.currentTime * 1000;
+    const last = noteIndexAt(tNow + HIGHLIGHT_WINDOW);
+    for (let i = noteIndexAt(tNow - HIGHLIGHT_WINDOW); i < last; i++) {
+        highlightDetectedKey(noteMidi[i]);
+    }
+    if (media === audio) drawWaveform();
+    if (!media.paused && !media.ended) {
+        raf = requestAnimationFrame(() => animateKeys(media));
+    }
+}
+
+playConvertedBtn.addEventListener('click', playConvertedAudio);
+
+[audio, convertedPlayer].forEach(media => {
+    media.addEventListener('play', () => {
+        if (raf) cancelAnimationFrame(raf);
+        animateKeys(media);
+    });
+    media.addEventListener('pause', () => { if (raf) cancelAnimationFrame(raf); });
+    media.addEventListener('ended', () => { if (raf) cancelAnimationFrame(raf); });
+});
+
+function pressKey(e) {
+    const key = e.target.closest('.key, .black-key');
+    if (!key) return;
+    e.preventDefault();
+    e.stopPropagation();
+    playRealisticPianoSound(Number(key.dataset.midi));
+    key.classList.add('hover');
+    setTimeout(() => key.classList.remove('hover'), 200);
+}
+
+// Delegated handlers on the keyboard instead of listeners on each of the 96 keys
+piano.addEventListener('mousedown', pressKey);
+piano.addEventListener('touchstart', pressKey);
+piano.addEventListener('mouseover', e => {
+    const key = e.target.closest('.key, .black-key');
+    if (key) key.classList.add('hover');
+});
+piano.addEventListener('mouseout', e => {
+    const key = e.target.closest('.key, .black-key');
+    if (key && !key.contains(e.relatedTarget)) key.classList.remove('hover');
+});
+
+// Initialize audio context on first user interaction
+document.addEventListener('click', initAudioContext, { once: true });
+document.addEventListener('touchstart', initAudioContext, { once: true });
+
+function setSource(media, url) {
+    const resolved = resolveUrl(url) || '';
+    if (media.getAttribute('src') === resolved) return;
+    media.pause();
+    if (resolved) media.setAttribute('src', resolved); else media.removeAttribute('src');
+    media.load();
+}
+
+// Reruns send the same arguments again; only a new analysis resets playback
+let currentArgs = null;
+function render(args) {
+    const signature = JSON.stringify([args.audio_url, args.converted_url, args.digest]);
+    if (signature === currentArgs) return;
+    currentArgs = signature;
+
+    if (isPlayingConverted) stopConvertedAudio();
+    noteTimes = args.times;
+    noteMidi = args.midi;
+    convertedAudioDuration = args.duration;
+    waveform = args.waveform_url && args.waveform_levels.length
+        ? { url: args.waveform_url, levels: args.waveform_levels, sr: args.sr } : null;
+    waveformChunks.clear();
+    viewStart = 0;
+    viewEnd = args.duration;
+    waveformCanvas.hidden = !waveform;
+
+    setSource(audio, args.audio_url);
+    setSource(convertedPlayer, args.converted_url);
+    convertedPlayer.hidden = !args.converted_url;
+    convertedControls.hidden = Boolean(args.converted_url);
+    updateTimeDisplay(0);
+    drawWaveform();
+    setFrameHeight();
+}
+
+window.addEventListener('message', event => {
+    if (event.data && event.data.type === 'streamlit:render') render(event.data.args);
+});
+window.addEventListener('resize', () => {
+    setFrameHeight();
+    drawWaveform();
+});
+
+buildKeyboard();
+sendMessage('streamlit:componentReady', { apiVersion: 1 });
+setFrameHeight();
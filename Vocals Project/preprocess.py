@@ -0,0 +1,213 @@
+import hashlib
+import threading
+import time
+import librosa
+import numpy as np
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional, Tuple
+from pitch_track import SparsePitch
+from session_store import nbytes_of
+
+
+def voice_activity(y: np.ndarray, top_db: float = 40.0, frame_length: int = 2048, hop_length: int = 512,
+                   pad_frames: int = 4, min_gap_frames: int = 8) -> 'RegionMap':
+    """RMS voice-activity map with hop-aligned region boundaries
+
+    Frame energy comes from one pass of per-hop sums of squares and a moving sum over
+    frame_length, so it costs a fraction of an STFT. Active frames are widened by
+    pad_frames to keep onsets and release tails, and silent gaps shorter than
+    min_gap_frames are closed so notes are not cut apart.
+    """
+    n_samples = len(y)
+    n_frames = -(-n_samples // hop_length)
+    if not n_frames:
+        return RegionMap(np.empty((0, 2)), n_samples, hop_length)
+    # Sums of squares accumulate in float64 without a float64 copy of the signal
+    full = n_samples // hop_length
+    blocks = y[:full * hop_length].reshape(full, hop_length)
+    block_energy = np.einsum('ij,ij->i', blocks, blocks, dtype=np.float64)
+    if full < n_frames:
+        tail = y[full * hop_length:].astype(np.float64)
+        block_energy = np.append(block_energy, tail @ tail)
+
+    span = max(frame_length // hop_length, 1)
+    cumulative = np.concatenate(([0.0], np.cumsum(block_energy)))
+    first = np.clip(np.arange(n_frames) - span // 2, 0, n_frames)
+    last = np.clip(first + span, 0, n_frames)
+    power = (cumulative[last] - cumulative[first]) / (span * hop_length)
+    level_db = 10 * np.log10(np.maximum(power, 1e-20))
+    active = level_db > level_db.max() - top_db
+
+    if pad_frames:
+        active = np.convolve(active, np.ones(2 * pad_frames + 1), mode='same') > 0
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], active.astype(np.int8), [0]))))
+    starts, ends = edges[::2], edges[1::2]
+    if len(starts) > 1:
+        # Merge runs separated by gaps shorter than min_gap_frames
+        keep = np.concatenate(([True], starts[1:] - ends[:-1] >= min_gap_frames))
+        starts, ends = starts[keep], np.concatenate((ends[:-1][keep[1:]], ends[-1:]))
+    intervals = np.column_stack((starts * hop_length, np.minimum(ends * hop_length, n_samples)))
+    return RegionMap(intervals, n_samples, hop_length)
+
+
+class RegionMap:
+    """Maps frames of a compacted signal (active regions spliced together) back to the original timeline"""
+
+    def __init__(self, intervals: np.ndarray, n_samples: int, hop_length: int = 512):
+        intervals = np.asarray(intervals, dtype=np.int64).reshape(-1, 2)
+        self.intervals = intervals
+        self.n_samples = int(n_samples)
+        self.hop_length = hop_length
+        lengths = intervals[:, 1] - intervals[:, 0]
+        self.compact_starts = np.concatenate(([0], np.cumsum(lengths)[:-1])).astype(np.int64)
+        self.compact_length = int(lengths.sum())
+
+    @classmethod
+    def full(cls, n_samples: int, hop_length: int = 512) -> 'RegionMap':
+        return cls([[0, n_samples]], n_samples, hop_length)
+
+    @property
+    def active_fraction(self) -> float:
+        return self.compact_length / self.n_samples if self.n_samples else 0.0
+
+    @property
+    def nbytes(self) -> int:
+        return self.intervals.nbytes + self.compact_starts.nbytes
+
+    @property
+    def n_frames(self) -> int:
+        """Frame count of the original signal"""
+        return 1 + self.n_samples // self.hop_length
+
+    def compact(self, y: np.ndarray) -> np.ndarray:
+        """Splice the active regions of y together"""
+        if len(self.intervals) == 1 and self.intervals[0, 0] == 0 and self.intervals[0, 1] == len(y):
+            return y
+        return np.concatenate([y[start:end] for start, end in self.intervals]) if len(self.intervals) else y[:0]
+
+    def to_original_frames(self, frames) -> np.ndarray:
+        """Original-timeline frame index for each compact frame"""
+        frames = np.asarray(frames, dtype=np.int64)
+        if not len(self.intervals):
+            return frames
+        samples = frames * self.hop_length
+        region = np.clip(np.searchsorted(self.compact_starts, samples, side='right') - 1, 0, None)
+        original = samples - self.compact_starts[region] + self.intervals[region, 0]
+        return original // self.hop_length
+
+    def to_original_times(self, times, sr: float) -> np.ndarray:
+        """Original-timeline seconds for each compact time"""
+        samples = np.rint(np.asarray(times, dtype=np.float64) * sr).astype(np.int64)
+        region = np.clip(np.searchsorted(self.compact_starts, samples, side='right') - 1, 0, None)
+        return (samples - self.compact_starts[region] + self.intervals[region, 0]) / sr
+
+    def expand_pitch(self, track: SparsePitch) -> SparsePitch:
+        """Place a compact pitch track on the original timeline, leaving skipped frames empty"""
+        counts = np.zeros(self.n_frames, dtype=np.int64)
+        original = np.minimum(self.to_original_frames(np.arange(track.n_frames)), self.n_frames - 1)
+        np.add.at(counts, original, np.diff(track.indptr))
+        indptr = np.concatenate(([0], np.cumsum(counts)))
+        return SparsePitch(indptr, track.hz, track.magnitudes, track.sr, track.n_fft, track.hop_length)
+
+    def expand_columns(self, matrix: np.ndarray) -> np.ndarray:
+        """Place compact frame columns on the original timeline, zero-filling skipped frames"""
+        full = np.zeros(matrix.shape[:-1] + (self.n_frames,), dtype=matrix.dtype)
+        original = np.minimum(self.to_original_frames(np.arange(matrix.shape[-1])), self.n_frames - 1)
+        full[..., original] = matrix
+        return full
+
+    def expand_notes(self, notes_data: dict) -> dict:
+        """Move detect_notes frame indices onto the original timeline"""
+        expanded = dict(notes_data)
+        expanded['onset_frames'] = self.to_original_frames(notes_data['onset_frames'])
+        expanded['note_frames'] = self.to_original_frames(notes_data['note_frames']).tolist()
+        return expanded
+
+
+class Preprocessor:
+    """Optional clean-up before pitch tracking: silence trimming, harmonic isolation and a spectral noise gate"""
+
+    MAX_CACHED = 8
+    # Stage outputs are full-length signals, so the cache is bounded in bytes as well
+    MAX_CACHED_BYTES = 256 * 2 ** 20
+
+    def __init__(self, n_fft: int = 2048, hop_length: int = 512):
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        # key -> (value, bytes)
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def signal_digest(y: np.ndarray, sr: float) -> str:
+        return hashlib.blake2b(np.ascontiguousarray(y).tobytes() + str(sr).encode(), digest_size=16).hexdigest()
+
+    def _cached(self, key: Hashable, compute: Callable, timings: Optional[Dict[str, float]] = None,
+                stage: str = None):
+        """LRU over stage outputs, so changing one parameter only recomputes the stages after it"""
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key][0]
+        start = time.thread_time()
+        value = compute()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + time.thread_time() - start
+        with self._lock:
+            if key not in self._cache:
+                size = nbytes_of(value)
+                self._cache[key] = (value, size)
+                self._cached_bytes += size
+            while len(self._cache) > 1 and (len(self._cache) > self.MAX_CACHED
+                                            or self._cached_bytes > self.MAX_CACHED_BYTES):
+                _, (_, size) = self._cache.popitem(last=False)
+                self._cached_bytes -= size
+        return value
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by cached stage outputs"""
+        return self._cached_bytes
+
+    def active_regions(self, y: np.ndarray, top_db: float = 40.0) -> RegionMap:
+        """Non-silent regions by frame energy, with boundaries on frame edges"""
+        return voice_activity(y, top_db, self.n_fft, self.hop_length)
+
+    def isolate_harmonic(self, y: np.ndarray, margin: float = 2.0) -> np.ndarray:
+        """Harmonic part of a harmonic/percussive separation, dropping drums and consonant noise"""
+        return librosa.effects.harmonic(y, margin=margin, n_fft=self.n_fft, hop_length=self.hop_length)
+
+    def noise_gate(self, y: np.ndarray, threshold_db: float = 6.0, noise_percentile: float = 10.0) -> np.ndarray:
+        """Soft spectral gate against a per-bin noise floor taken from the quietest frames"""
+        if not len(y):
+            return y
+        D = librosa.stft(y, n_fft=self.n_fft, hop_length=self.hop_length)
+        power = np.abs(D) ** 2
+        floor = np.percentile(power, noise_percentile, axis=1, keepdims=True) * 10 ** (threshold_db / 10)
+        mask = power / (power + floor + np.finfo(np.float32).tiny)
+        return librosa.istft(D * mask, hop_length=self.hop_length, length=len(y)).astype(np.float32)
+
+    def process(self, y: np.ndarray, sr: float, trim: bool = True, separate: bool = True,
+                gate: bool = True, top_db: float = 40.0, margin: float = 2.0,
+                gate_db: float = 6.0, timings: Optional[Dict[str, float]] = None) -> Tuple[np.ndarray, RegionMap]:
+        """Run the enabled stages and return the compacted signal with its region map
+
+        CPU times of stages that were not served from the cache are added to timings.
+        """
+        digest = self.signal_digest(y, sr)
+
+        key = (digest, 'trim', trim, top_db)
+        regions = self._cached(
+            key, lambda: self.active_regions(y, top_db) if trim else RegionMap.full(len(y), self.hop_length),
+            timings, 'voice_activity'
+        )
+        compact = regions.compact(y)
+
+        if separate:
+            key = key + ('separate', margin)
+            compact = self._cached(key, lambda c=compact: self.isolate_harmonic(c, margin), timings, 'harmonic_separation')
+        if gate:
+            key = key + ('gate', gate_db)
+            compact = self._cached(key, lambda c=compact: self.noise_gate(c, gate_db), timings, 'noise_gate')
+        return compact, regions
@@ -0,0 +1,59 @@
+import numpy as np
+from typing import Dict
+
+# Grid name -> subdivisions per beat (quarter note)
+GRIDS = {
+    '1/4': 1,
+    '1/8': 2,
+    '1/8T': 3,
+    '1/16': 4,
+    '1/16T': 6,
+    '1/32': 8
+}
+
+
+def _snap(t: np.ndarray, step: float, swing: float) -> np.ndarray:
+    """Nearest grid index for each time, where odd grid points are delayed by swing * step"""
+    if swing <= 0:
+        return np.rint(t / step).astype(np.int64)
+    # Each pair of steps holds the on-beat point, the swung off-beat point and the next on-beat
+    pair = np.floor(t / (2 * step))
+    local = t - pair * 2 * step
+    off_beat = step * (1 + swing)
+    choice = (local > off_beat / 2).astype(np.int64) + (local > (off_beat + 2 * step) / 2)
+    return (2 * pair).astype(np.int64) + choice
+
+
+def quantize_notes(starts, durations, tempo: float, grid: str = '1/16', swing: float = 0.0,
+                   offset: float = 0.0, min_steps: int = 1) -> Dict[str, np.ndarray]:
+    """Snap note starts and ends to a tempo grid in one vectorized pass
+
+    swing delays every second grid step by that fraction of a step (0 is straight,
+    1/3 is triplet feel) and only applies to straight grids. offset is the time of
+    the first grid line, usually the first beat.
+    """
+    if grid not in GRIDS:
+        raise ValueError(f"Unknown grid {grid!r}, expected one of {', '.join(GRIDS)}")
+    if tempo <= 0:
+        raise ValueError("Tempo must be positive")
+    subdivisions = GRIDS[grid]
+    step = 60.0 / tempo / subdivisions
+    swing = swing if subdivisions % 3 else 0.0
+
+    starts = np.asarray(starts, dtype=np.float64) - offset
+    ends = starts + np.asarray(durations, dtype=np.float64)
+    start_steps = _snap(starts, step, swing)
+    end_steps = np.maximum(_snap(ends, step, swing), start_steps + min_steps)
+
+    def to_time(steps):
+        return offset + steps * step + (steps % 2) * swing * step
+
+    return {
+        'start_steps': start_steps,
+        'length_steps': end_steps - start_steps,
+        'starts': to_time(start_steps),
+        'durations': to_time(end_steps) - to_time(start_steps),
+        'step': step,
+        'offset': offset,
+        'steps_per_beat': subdivisions
+    }
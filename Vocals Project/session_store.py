@@ -0,0 +1,182 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, NamedTuple, Optional
+import numpy as np
+
+
+def nbytes_of(value: Any) -> int:
+    """Bytes held by arrays and buffers in a value, following tuples, lists and dicts"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(nbytes_of(item) for item in value.values())
+    if isinstance(value, (tuple, list)):
+        return sum(nbytes_of(item) for item in value)
+    nbytes = getattr(value, 'nbytes', 0)
+    return nbytes if isinstance(nbytes, int) else 0
+
+
+class Spilled(NamedTuple):
+    path: str
+    kind: str  # 'array' or 'bytes'
+    nbytes: int
+
+
+class MemoryStats(NamedTuple):
+    resident_bytes: int
+    spilled_bytes: int
+    sessions: int
+
+
+class SessionStore:
+    """Large per-session values held outside st.session_state, under a per-session and a global budget
+
+    Sessions are kept in least-recently-used order. When a session goes over its budget its
+    own colder entries are reduced; when all sessions together go over the global budget the
+    coldest other sessions are reduced whole. Reducing an entry releases it if it is a cache
+    with a release() method, spills it to disk if it is an array or bytes, and drops it
+    otherwise. Caches go before data, since spilling an array a cache still references
+    frees nothing. The value just stored or read stays resident unless it is a cache.
+    Sessions idle for longer than max_idle are removed with their files, and caches
+    they held are released.
+    """
+
+    def __init__(self, session_budget: int = 512 * 2 ** 20, global_budget: int = 2 * 2 ** 30,
+                 max_idle: float = 3600.0, spill_dir: Optional[str] = None):
+        self.session_budget = session_budget
+        self.global_budget = global_budget
+        self.max_idle = max_idle
+        self.spill_dir = spill_dir or tempfile.mkdtemp(prefix='vocals-sessions-')
+        # session -> OrderedDict(name -> [value, resident bytes]), coldest session first
+        self._sessions = OrderedDict()
+        self._last_used = {}
+        self._resident = 0
+        self._spilled = 0
+        self._files = 0
+        self._lock = threading.Lock()
+
+    def put(self, session: Hashable, name: Hashable, value: Any):
+        """Store or re-measure a value, then bring the session and the process within budget"""
+        with self._lock:
+            entries = self._touch(session)
+            if name in entries:
+                old = entries.pop(name)
+                # Re-measuring the same cache must not release what it just computed
+                self._forget(old, release=old[0] is not value)
+            size = nbytes_of(value)
+            entries[name] = [value, size]
+            self._resident += size
+            self._enforce(session, keep=name)
+
+    def get(self, session: Hashable, name: Hashable, default: Any = None) -> Any:
+        """A stored value, read back from disk if it was spilled"""
+        with self._lock:
+            entries = self._touch(session)
+            if name not in entries:
+                return default
+            entries.move_to_end(name)
+            entry = entries[name]
+            if isinstance(entry[0], Spilled):
+                spilled = entry[0]
+                if spilled.kind == 'array':
+                    value = np.load(spilled.path, allow_pickle=False)
+                else:
+                    with open(spilled.path, 'rb') as f:
+                        value = f.read()
+                os.remove(spilled.path)
+                self._spilled -= spilled.nbytes
+                entry[:] = [value, spilled.nbytes]
+                self._resident += spilled.nbytes
+                self._enforce(session, keep=name)
+            return entry[0]
+
+    def drop(self, session: Hashable):
+        """Forget everything a session holds"""
+        with self._lock:
+            self._remove(session)
+
+    def stats(self) -> MemoryStats:
+        with self._lock:
+            return MemoryStats(self._resident, self._spilled, len(self._sessions))
+
+    def close(self):
+        for session in list(self._sessions):
+            self.drop(session)
+        shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+    def _touch(self, session: Hashable) -> OrderedDict:
+        now = time.monotonic()
+        for idle in [s for s, used in self._last_used.items() if now - used > self.max_idle and s != session]:
+            self._remove(idle)
+        self._last_used[session] = now
+        entries = self._sessions.setdefault(session, OrderedDict())
+        self._sessions.move_to_end(session)
+        return entries
+
+    def _remove(self, session: Hashable):
+        for entry in self._sessions.pop(session, {}).values():
+            self._forget(entry)
+        self._last_used.pop(session, None)
+
+    def _forget(self, entry: list, release: bool = True):
+        value, size = entry
+        if isinstance(value, Spilled):
+            self._spilled -= value.nbytes
+            os.remove(value.path)
+        else:
+            if release and hasattr(value, 'release'):
+                value.release()
+            self._resident -= size
+
+    def _reduce(self, entries: OrderedDict, name: Hashable):
+        """Release, spill or drop one entry"""
+        value, size = entries[name]
+        if isinstance(value, Spilled) or not size:
+            return
+        if hasattr(value, 'release'):
+            value.release()
+            entries[name][1] = nbytes_of(value)
+        elif isinstance(value, (np.ndarray, bytes, bytearray)):
+            self._files += 1
+            path = os.path.join(self.spill_dir, f'{self._files}.spill')
+            if isinstance(value, np.ndarray):
+                with open(path, 'wb') as f:
+                    np.save(f, value, allow_pickle=False)
+                entries[name][0] = Spilled(path, 'array', size)
+            else:
+                with open(path, 'wb') as f:
+                    f.write(value)
+                entries[name][0] = Spilled(path, 'bytes', size)
+            entries[name][1] = 0
+            self._spilled += size
+        else:
+            del entries[name]
+            self._resident -= size
+            return
+        self._resident -= size - entries[name][1]
+
+    def _reduce_order(self, entries: OrderedDict):
+        """Entry names to reduce: caches before data, coldest first within each"""
+        names = list(entries)
+        return [n for n in names if hasattr(entries[n][0], 'release')] + \
+            [n for n in names if not hasattr(entries[n][0], 'release')]
+
+    def _enforce(self, session: Hashable, keep: Hashable = None):
+        entries = self._sessions[session]
+        for name in self._reduce_order(entries):
+            if sum(size for _, size in entries.values()) <= self.session_budget:
+                break
+            if name != keep or hasattr(entries[name][0], 'release'):
+                self._reduce(entries, name)
+        for other in list(self._sessions):
+            if self._resident <= self.global_budget:
+                break
+            if other == session:
+                continue
+            others = self._sessions[other]
+            for name in self._reduce_order(others):
+                self._reduce(others, name)
@@ -0,0 +1,107 @@
+import io
+import wave
+import numpy as np
+from typing import Optional
+from note_tables import midi_to_hz
+
+
+class PianoSynth:
+    """Additive piano synthesizer rendering note events to PCM, mirroring the player's Web Audio voice"""
+
+    # Frequency bands with upper bound (Hz), note length (s), fundamental amplitude,
+    # fundamental waveform, partial count and harmonic amplitudes, as in playRealisticPianoSound
+    BANDS = (
+        (196.0, 1.5, 0.4, 'sawtooth', 6, (0.25, 0.15, 0.1, 0.06, 0.04, 0.03)),
+        (523.0, 1.2, 0.3, 'triangle', 4, (0.2, 0.12, 0.08, 0.05)),
+        (1500.0, 1.0, 0.25, 'triangle', 3, (0.15, 0.1, 0.05)),
+        (np.inf, 0.8, 0.2, 'sine', 2, (0.12, 0.06)),
+    )
+    HARMONIC_RATIOS = (2, 3, 4, 5, 6, 7)
+
+    def __init__(self, sr: int = 22050):
+        self.sr = sr
+
+    @staticmethod
+    def _adsr(frequency_bound: float):
+        """Attack, decay and sustain level for a band"""
+        if frequency_bound <= 196:
+            return 0.05, 0.2, 0.7
+        if frequency_bound <= 523:
+            return 0.03, 0.15, 0.6
+        return 0.02, 0.1, 0.5
+
+    @staticmethod
+    def _waveform(kind: str, phase: np.ndarray) -> np.ndarray:
+        if kind == 'sine':
+            return np.sin(2 * np.pi * phase)
+        frac = phase - np.floor(phase)
+        if kind == 'sawtooth':
+            return 2 * frac - 1
+        return 1 - 4 * np.abs(frac - 0.5)
+
+    def _envelope(self, t: np.ndarray, amp: float, attack: float, decay: float,
+                  sustain: float, duration: float) -> np.ndarray:
+        """Linear attack then exponential decay and release, as the Web Audio ramps"""
+        peak = amp
+        held = amp * sustain
+        release_start = attack + decay
+        env = np.empty_like(t)
+        rising = t < attack
+        env[rising] = peak * t[rising] / attack
+        decaying = (t >= attack) & (t < release_start)
+        env[decaying] = peak * (held / peak) ** ((t[decaying] - attack) / decay)
+        releasing = t >= release_start
+        env[releasing] = held * (0.001 / held) ** ((t[releasing] - release_start) / (duration - release_start))
+        return env
+
+    def render(self, midi, starts, total_duration: Optional[float] = None) -> np.ndarray:
+        """Render notes (MIDI numbers, onset seconds) to a mono float32 signal"""
+        midi = np.asarray(midi, dtype=np.int64)
+        starts = np.asarray(starts, dtype=np.float64)
+        freqs = midi_to_hz(midi)
+        start_samples = np.rint(starts * self.sr).astype(np.int64)
+        longest = max(band[1] for band in self.BANDS)
+        end = (starts.max(initial=0.0) + longest) if total_duration is None else total_duration
+        out = np.zeros(int(np.ceil(end * self.sr)) + 1, dtype=np.float64)
+
+        lower = 0.0
+        for upper, duration, base_amp, waveform, partials, harmonic_amps in self.BANDS:
+            in_band = np.flatnonzero((freqs > lower) & (freqs <= upper))
+            lower = upper
+            if not len(in_band):
+                continue
+            attack, decay, sustain = self._adsr(upper)
+            length = int(duration * self.sr)
+            t = np.arange(length) / self.sr
+            ratios = (1,) + self.HARMONIC_RATIOS[:partials - 1]
+            amps = (base_amp,) + harmonic_amps[:partials - 1]
+            kinds = (waveform,) + tuple('sine' if i < 2 else 'triangle' for i in range(partials - 1))
+            envelopes = [self._envelope(t, amp, attack, decay, sustain, duration) for amp in amps]
+
+            # A note's sound depends only on its pitch, so render one template per distinct
+            # MIDI number as a single (pitches x samples) block and overlap-add copies of it
+            band_midi, which = np.unique(midi[in_band], return_inverse=True)
+            base_phase = np.outer(midi_to_hz(band_midi), t)
+            templates = np.zeros((len(band_midi), length))
+            for ratio, kind, env in zip(ratios, kinds, envelopes):
+                templates += self._waveform(kind, ratio * base_phase) * env
+
+            for note, k in zip(start_samples[in_band], which):
+                span = min(length, len(out) - note)
+                out[note:note + span] += templates[k, :span]
+
+        peak = np.abs(out).max(initial=0.0)
+        if peak > 1.0:
+            out /= peak
+        return out.astype(np.float32)
+
+    def to_wav_bytes(self, signal: np.ndarray) -> bytes:
+        """Encode a float signal as 16-bit mono WAV"""
+        pcm = (np.clip(signal, -1.0, 1.0) * 32767).astype('<i2')
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(self.sr)
+            wav.writeframes(pcm.tobytes())
+        return buffer.getvalue()
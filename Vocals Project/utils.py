@@ -1,18 +1,157 @@
 import os
-from typing import Tuple
+import struct
+from typing import NamedTuple, Optional, Tuple
 
-def validate_audio_file(file) -> Tuple[bool, str]:
+# Longest recording accepted for analysis, in seconds
+MAX_DURATION = 15 * 60
+# Bytes read when looking for the first MP3 frame
+PROBE_BYTES = 64 * 1024
+
+WAV_CODECS = {1: 'pcm', 3: 'float', 6: 'alaw', 7: 'mulaw'}
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# Bitrates (kbit/s) by index for MPEG-1 and MPEG-2/2.5 Layer III
+MP3_BITRATES = {
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160)
+}
+MP3_SAMPLE_RATES = {1: (44100, 48000, 32000), 2: (22050, 24000, 16000), 2.5: (11025, 12000, 8000)}
+
+
+class AudioInfo(NamedTuple):
+    codec: str
+    sample_rate: int
+    channels: int
+    duration: float
+
+
+def _read_at(file, offset: int, size: int) -> bytes:
+    file.seek(offset)
+    return file.read(size)
+
+
+def _file_size(file) -> int:
+    size = getattr(file, 'size', None)
+    if size is None:
+        size = file.seek(0, os.SEEK_END)
+    return size
+
+
+def probe_wav(file, file_size: int) -> AudioInfo:
+    """Read format and duration from the RIFF chunk headers, seeking past everything else"""
+    riff = _read_at(file, 0, 12)
+    if len(riff) < 12 or riff[:4] != b'RIFF' or riff[8:12] != b'WAVE':
+        raise ValueError("Not a RIFF/WAVE file")
+    fmt = None
+    offset = 12
+    while offset + 8 <= file_size:
+        chunk_id, chunk_size = struct.unpack('<4sI', _read_at(file, offset, 8))
+        if chunk_id == b'fmt ':
+            fmt = _read_at(file, offset + 8, min(chunk_size, 40))
+        elif chunk_id == b'data':
+            if fmt is None or len(fmt) < 16:
+                raise ValueError("WAV data chunk before its format chunk")
+            format_tag, channels, sample_rate, byte_rate = struct.unpack('<HHII', fmt[:12])
+            if format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+                format_tag = struct.unpack('<H', fmt[24:26])[0]
+            if format_tag not in WAV_CODECS:
+                raise ValueError(f"Unsupported WAV encoding (format tag {format_tag})")
+            if not channels or not sample_rate or not byte_rate:
+                raise ValueError("WAV format chunk is corrupt")
+            # Streamed or truncated files can declare more data than they hold
+            data_size = min(chunk_size, file_size - offset - 8)
+            return AudioInfo(WAV_CODECS[format_tag], sample_rate, channels, data_size / byte_rate)
+        offset += 8 + chunk_size + (chunk_size & 1)
+    raise ValueError("WAV file has no audio data")
+
+
+def _mp3_frame(header: bytes) -> Optional[Tuple[float, int, int, int, int]]:
+    """Version, bitrate (bit/s), sample rate, channels and frame length of a Layer III frame header"""
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+    version = {3: 1, 2: 2, 0: 2.5}.get((header[1] >> 3) & 0x3)
+    layer = (header[1] >> 1) & 0x3
+    bitrate_index = header[2] >> 4
+    rate_index = (header[2] >> 2) & 0x3
+    if version is None or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    bitrate = MP3_BITRATES[1 if version == 1 else 2][bitrate_index] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version][rate_index]
+    channels = 1 if header[3] >> 6 == 3 else 2
+    padding = (header[2] >> 1) & 0x1
+    frame_length = (144 if version == 1 else 72) * bitrate // sample_rate + padding
+    return version, bitrate, sample_rate, channels, frame_length
+
+
+def probe_mp3(file, file_size: int) -> AudioInfo:
+    """Read format and duration from the first frame header and its Xing/Info or VBRI tag"""
+    head = _read_at(file, 0, 10)
+    start = 0
+    if head[:3] == b'ID3' and len(head) == 10:
+        # Syncsafe tag size, excluding the 10-byte header (and footer, if flagged)
+        size = (head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9]
+        start = 10 + size + (10 if head[5] & 0x10 else 0)
+    data = _read_at(file, start, PROBE_BYTES)
+
+    position = data.find(b'\xff')
+    while 0 <= position < len(data) - 4:
+        frame = _mp3_frame(data[position:position + 4])
+        if frame is not None:
+            # Accept a sync word only when another valid frame follows it
+            following = data[position + frame[4]:position + frame[4] + 4]
+            if len(following) < 4 or _mp3_frame(following) is not None:
+                break
+        position = data.find(b'\xff', position + 1)
+    else:
+        raise ValueError("No MPEG Layer III frames found")
+
+    version, bitrate, sample_rate, channels, frame_length = frame
+    samples_per_frame = 1152 if version == 1 else 576
+    side_info = (32 if channels == 2 else 17) if version == 1 else (17 if channels == 2 else 9)
+    xing = data[position + 4 + side_info:position + 4 + side_info + 12]
+    if xing[:4] in (b'Xing', b'Info') and struct.unpack('>I', xing[4:8])[0] & 0x1:
+        frames = struct.unpack('>I', xing[8:12])[0]
+        return AudioInfo('mp3', sample_rate, channels, frames * samples_per_frame / sample_rate)
+    vbri = data[position + 36:position + 36 + 18]
+    if vbri[:4] == b'VBRI' and len(vbri) == 18:
+        frames = struct.unpack('>I', vbri[14:18])[0]
+        return AudioInfo('mp3', sample_rate, channels, frames * samples_per_frame / sample_rate)
+    # Constant bitrate: audio bytes over byte rate
+    audio_bytes = file_size - start - position
+    return AudioInfo('mp3', sample_rate, channels, audio_bytes * 8 / bitrate)
+
+
+def probe_audio(file) -> AudioInfo:
+    """Identify a WAV or MP3 file from its header bytes alone, without decoding any audio"""
+    file_size = _file_size(file)
+    try:
+        if _read_at(file, 0, 4) == b'RIFF':
+            return probe_wav(file, file_size)
+        return probe_mp3(file, file_size)
+    except struct.error:
+        raise ValueError("Truncated audio header")
+    finally:
+        file.seek(0)
+
+
+def validate_audio_file(file) -> Tuple[bool, str, Optional[AudioInfo]]:
     """Validate uploaded audio file"""
     if file is None:
-        return False, "No file uploaded"
-    
-    # Check file size (10MB limit)
-    if file.size > 10 * 1024 * 1024:
-        return False, "File size too large (max 10MB)"
-    
+        return False, "No file uploaded", None
+
     # Check file extension
     file_ext = os.path.splitext(file.name)[1].lower()
     if file_ext not in ['.wav', '.mp3']:
-        return False, "Unsupported file format. Please upload WAV or MP3"
-    
-    return True, "File is valid"
+        return False, "Unsupported file format. Please upload WAV or MP3", None
+
+    # The container header decides what the file really is and how long it runs
+    try:
+        info = probe_audio(file)
+    except ValueError as e:
+        return False, f"Invalid audio file: {e}", None
+    if info.duration <= 0:
+        return False, "Audio file is empty", None
+    if info.duration > MAX_DURATION:
+        return False, f"Recording too long ({info.duration / 60:.1f} min, max {MAX_DURATION // 60} min)", None
+
+    return True, "File is valid", info
@@ -1,59 +1,127 @@
+import threading
 import plotly.graph_objects as go
 import numpy as np
-from typing import List, Dict
+from collections import OrderedDict
+from typing import Callable, Hashable, List, Dict, Optional, Tuple
 import streamlit as st
-import base64
+from pitch_track import SparsePitch
+from note_tables import IS_BLACK, PIANO_NOTE_FREQS, hz_to_midi, midi_to_name
+
+PITCH_COLORSCALE = [
+    [0, 'rgb(255,255,255)'],
+    [0.2, 'rgb(240,240,255)'],
+    [0.4, 'rgb(200,200,255)'],
+    [0.6, 'rgb(150,150,255)'],
+    [0.8, 'rgb(100,100,255)'],
+    [1, 'rgb(50,50,255)']
+]
+
+def simplify_contour(x: np.ndarray, y: np.ndarray, max_points: int) -> np.ndarray:
+    """Indices of at most max_points points keeping the contour shape (largest triangle per bucket)"""
+    n = len(x)
+    if n <= max_points or max_points < 3:
+        return np.arange(n)
+    # Effective area of the triangle each interior point forms with its neighbours
+    area = np.zeros(n)
+    area[1:-1] = np.abs(
+        (x[:-2] - x[2:]) * (y[1:-1] - y[:-2]) - (x[:-2] - x[1:-1]) * (y[2:] - y[:-2])
+    )
+    # Endpoints always survive; interior points compete within equal-count buckets
+    area[0] = area[-1] = np.inf
+    bucket = np.arange(n) * (max_points - 1) // (n - 1)
+    order = np.lexsort((-area, bucket))
+    _, first = np.unique(bucket[order], return_index=True)
+    keep = np.sort(order[first])
+    return np.union1d(keep, [0, n - 1])
+
+
+def _value_nbytes(value) -> int:
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(_value_nbytes(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_value_nbytes(item) for item in value)
+    if isinstance(value, str):
+        return len(value)
+    return 8
+
+
+def figure_nbytes(fig: go.Figure) -> int:
+    """Approximate bytes of a figure's trace data: arrays by size, other values at 8 bytes per item"""
+    return sum(_value_nbytes(trace.to_plotly_json()) for trace in fig.data)
+
 
 class AudioVisualizer:
+    # Switch scatter traces to WebGL above this many points
+    WEBGL_THRESHOLD = 1000
+    # Widest heatmap sent to the browser; longer pitch maps are max-pooled in time
+    MAX_HEATMAP_COLUMNS = 2000
+    MAX_CACHED_FIGURES = 32
+    MAX_CACHED_FIGURE_BYTES = 64 * 2 ** 20
+
     def __init__(self):
-        self.note_freqs = {
-            'A0': 27.50, 'A#0/Bb0': 29.14, 'B0': 30.87,
-            'C1': 32.70, 'C#1/Db1': 34.65, 'D1': 36.71,
-            'D#1/Eb1': 38.89, 'E1': 41.20, 'F1': 43.65,
-            'F#1/Gb1': 46.25, 'G1': 49.00, 'G#1/Ab1': 51.91,
-            'A1': 55.00, 'A#1/Bb1': 58.27, 'B1': 61.74,
-            'C2': 65.41, 'C#2/Db2': 69.30, 'D2': 73.42,
-            'D#2/Eb2': 77.78, 'E2': 82.41, 'F2': 87.31,
-            'F#2/Gb2': 92.50, 'G2': 98.00, 'G#2/Ab2': 103.83,
-            'A2': 110.00, 'A#2/Bb2': 116.54, 'B2': 123.47,
-            'C3': 130.81, 'C#3/Db3': 138.59, 'D3': 146.83,
-            'D#3/Eb3': 155.56, 'E3': 164.81, 'F3': 174.61,
-            'F#3/Gb3': 185.00, 'G3': 196.00, 'G#3/Ab3': 207.65,
-            'A3': 220.00, 'A#3/Bb3': 233.08, 'B3': 246.94,
-            'C4': 261.63, 'C#4/Db4': 277.18, 'D4': 293.66,
-            'D#4/Eb4': 311.13, 'E4': 329.63, 'F4': 349.23,
-            'F#4/Gb4': 369.99, 'G4': 392.00, 'G#4/Ab4': 415.30,
-            'A4': 440.00, 'A#4/Bb4': 466.16, 'B4': 493.88,
-            'C5': 523.25, 'C#5/Db5': 554.37, 'D5': 587.33,
-            'D#5/Eb5': 622.25, 'E5': 659.25, 'F5': 698.46,
-            'F#5/Gb5': 739.99, 'G5': 783.99, 'G#5/Ab5': 830.61,
-            'A5': 880.00, 'A#5/Bb5': 932.33, 'B5': 987.77,
-            'C6': 1046.50, 'C#6/Db6': 1108.73, 'D6': 1174.66,
-            'D#6/Eb6': 1244.51, 'E6': 1318.51, 'F6': 1396.91,
-            'F#6/Gb6': 1479.98, 'G6': 1567.98, 'G#6/Ab6': 1661.22,
-            'A6': 1760.00, 'A#6/Bb6': 1864.66, 'B6': 1975.53,
-            'C7': 2093.00, 'C#7/Db7': 2217.46, 'D7': 2349.32,
-            'D#7/Eb7': 2489.02, 'E7': 2637.02, 'F7': 2793.83,
-            'F#7/Gb7': 2959.96, 'G7': 3135.96, 'G#7/Ab7': 3322.44,
-            'A7': 3520.00, 'A#7/Bb7': 3729.31, 'B7': 3951.07,
-            'C8': 4186.01
-        }
+        self.note_freqs = PIANO_NOTE_FREQS
+        # Shared by every session thread, so guarded by a lock; callers get their own copy.
+        # key -> (figure, approximate bytes of its trace data)
+        self._figure_cache = OrderedDict()
+        self._figure_bytes = 0
+        self._figure_lock = threading.Lock()
+
+    def _cached_figure(self, kind: str, cache_key: Optional[Hashable], build: Callable[[], go.Figure]) -> go.Figure:
+        """Return a copy of the memoized figure for an analysis result, building it on a miss"""
+        if cache_key is None:
+            return build()
+        key = (kind, cache_key)
+        with self._figure_lock:
+            fig, _ = self._figure_cache.get(key, (None, 0))
+            if fig is not None:
+                self._figure_cache.move_to_end(key)
+        if fig is None:
+            fig = build()
+            size = figure_nbytes(fig)
+            with self._figure_lock:
+                if key not in self._figure_cache:
+                    self._figure_cache[key] = (fig, size)
+                    self._figure_bytes += size
+                while len(self._figure_cache) > 1 and (len(self._figure_cache) > self.MAX_CACHED_FIGURES
+                                                       or self._figure_bytes > self.MAX_CACHED_FIGURE_BYTES):
+                    _, (_, evicted) = self._figure_cache.popitem(last=False)
+                    self._figure_bytes -= evicted
+        return go.Figure(fig)
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate bytes held by memoized figures"""
+        return self._figure_bytes
+
+    def _scatter_trace(self, n_points: int):
+        return go.Scattergl if n_points > self.WEBGL_THRESHOLD else go.Scatter
 
-    def create_pitch_map(self, pitches: np.ndarray, sr: float) -> go.Figure:
+    def create_pitch_map(self, pitches, sr: float, hop_length: int = 512,
+                         cache_key: Optional[Hashable] = None) -> go.Figure:
+        if isinstance(pitches, SparsePitch):
+            return self._cached_figure('pitch_map', cache_key, lambda: self._build_sparse_pitch_map(pitches))
+        return self._cached_figure('pitch_map', cache_key, lambda: self._build_pitch_map(pitches, sr, hop_length))
+
+    def _pool_columns(self, matrix: np.ndarray, times: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Max-pool columns in time down to MAX_HEATMAP_COLUMNS"""
+        step = -(-matrix.shape[1] // self.MAX_HEATMAP_COLUMNS)
+        if step <= 1:
+            return matrix, times
+        n_cols = -(-matrix.shape[1] // step)
+        padded = np.zeros((matrix.shape[0], n_cols * step), dtype=matrix.dtype)
+        padded[:, :matrix.shape[1]] = matrix
+        return padded.reshape(matrix.shape[0], n_cols, step).max(axis=2), times[::step]
+
+    def _build_pitch_map(self, pitches: np.ndarray, sr: float, hop_length: int) -> go.Figure:
         fig = go.Figure()
-        times = np.arange(pitches.shape[1]) * 512 / sr
+        pitches, times = self._pool_columns(pitches, np.arange(pitches.shape[1]) * hop_length / sr)
         fig.add_trace(go.Heatmap(
             x=times,
             y=np.arange(pitches.shape[0]),
             z=pitches,
-            colorscale=[
-                [0, 'rgb(255,255,255)'],
-                [0.2, 'rgb(240,240,255)'],
-                [0.4, 'rgb(200,200,255)'],
-                [0.6, 'rgb(150,150,255)'],
-                [0.8, 'rgb(100,100,255)'],
-                [1, 'rgb(50,50,255)']
-            ],
+            colorscale=PITCH_COLORSCALE,
             showscale=True,
             colorbar=dict(
                 title=dict(
@@ -71,6 +139,142 @@ class AudioVisualizer:
         )
         return fig
 
+    def _build_sparse_pitch_map(self, track: SparsePitch) -> go.Figure:
+        fig = go.Figure()
+        scatter = self._scatter_trace(len(track.hz))
+        fig.add_trace(scatter(
+            x=track.frames() * track.hop_length / track.sr,
+            y=track.hz,
+            mode='markers',
+            marker=dict(
+                size=3,
+                color=track.magnitudes,
+                colorscale=PITCH_COLORSCALE[1:],
+                showscale=True,
+                colorbar=dict(
+                    title=dict(
+                        text='Pitch Intensity',
+                        side='right'
+                    )
+                )
+            ),
+            hovertemplate='%{x:.2f}s<br>%{y:.1f} Hz<extra></extra>',
+            name='Pitch peaks'
+        ))
+        fig.update_layout(
+            title='Pitch Map',
+            xaxis_title='Time (s)',
+            yaxis=dict(title='Frequency (Hz)', type='log'),
+            template='plotly_white',
+            height=400
+        )
+        return fig
+
+    def create_semitone_map(self, midi: np.ndarray, spectrogram: np.ndarray, sr: float, hop_length: int = 512,
+                            cache_key: Optional[Hashable] = None) -> go.Figure:
+        return self._cached_figure(
+            'semitone_map', cache_key, lambda: self._build_semitone_map(midi, spectrogram, sr, hop_length)
+        )
+
+    def _build_semitone_map(self, midi: np.ndarray, spectrogram: np.ndarray, sr: float,
+                            hop_length: int) -> go.Figure:
+        fig = go.Figure()
+        spectrogram, times = self._pool_columns(spectrogram, np.arange(spectrogram.shape[1]) * hop_length / sr)
+        fig.add_trace(go.Heatmap(
+            x=times,
+            y=midi,
+            z=np.log1p(spectrogram),
+            hovertemplate='%{x:.2f}s<br>MIDI %{y}<extra></extra>',
+            colorscale=PITCH_COLORSCALE,
+            showscale=False
+        ))
+        # Label C of every octave on the MIDI axis
+        octaves = midi[midi % 12 == 0]
+        fig.update_layout(
+            title='Semitone Map',
+            xaxis_title='Time (s)',
+            yaxis=dict(title='Note', tickvals=octaves, ticktext=midi_to_name(octaves)),
+            template='plotly_white',
+            height=400
+        )
+        return fig
+
+    def create_pitch_contour(self, track: SparsePitch, max_points: int = 4000,
+                             cache_key: Optional[Hashable] = None) -> go.Figure:
+        return self._cached_figure(
+            'pitch_contour', None if cache_key is None else (cache_key, max_points),
+            lambda: self._build_pitch_contour(track, max_points)
+        )
+
+    def _build_pitch_contour(self, track: SparsePitch, max_points: int) -> go.Figure:
+        fig = go.Figure()
+        hz, _ = track.strongest()
+        voiced = np.flatnonzero(hz > 0)
+        midi = hz_to_midi(hz[voiced])
+        # Voiced runs are numbered before simplifying, since dropped points also leave frame gaps
+        run = np.concatenate(([0], np.cumsum(np.diff(voiced) > 1)))
+        keep = simplify_contour(voiced.astype(np.float64), midi, max_points)
+        frames, midi = voiced[keep], midi[keep]
+
+        # Break the line only between points of different voiced runs
+        gap = np.flatnonzero(np.diff(run[keep]) != 0) + 1
+        times = np.insert(frames * track.hop_length / track.sr, gap, np.nan)
+        midi = np.insert(midi, gap, np.nan)
+        nearest = np.rint(midi)
+        cents = 100 * (midi - nearest)
+
+        scatter = self._scatter_trace(len(times))
+        fig.add_trace(scatter(
+            x=times,
+            y=midi,
+            mode='lines+markers',
+            connectgaps=False,
+            line=dict(color='rgba(90, 90, 90, 0.6)', width=1),
+            marker=dict(
+                size=4,
+                color=cents,
+                cmin=-50,
+                cmax=50,
+                colorscale='RdBu',
+                showscale=True,
+                colorbar=dict(
+                    title=dict(
+                        text='Cents off pitch',
+                        side='right'
+                    )
+                )
+            ),
+            customdata=np.column_stack((
+                midi_to_name(np.clip(np.nan_to_num(nearest), 0, 127).astype(np.int64)),
+                np.round(cents)
+            )),
+            hovertemplate='%{x:.2f}s<br>%{customdata[0]} %{customdata[1]:+} cents<extra></extra>',
+            name='Pitch contour'
+        ))
+
+        low = int(np.floor(np.nanmin(midi))) - 1 if len(voiced) else 59
+        high = int(np.ceil(np.nanmax(midi))) + 1 if len(voiced) else 73
+        labelled = np.arange(low, high + 1)
+        if high - low > 24:
+            # Label only the Cs on wide ranges; every semitone still gets a gridline
+            labelled = labelled[labelled % 12 == 0]
+        fig.update_layout(
+            title='Pitch Contour',
+            xaxis_title='Time (s)',
+            yaxis=dict(
+                title='Note',
+                range=[low, high],
+                tickvals=labelled,
+                ticktext=midi_to_name(labelled).tolist(),
+                gridcolor='rgba(0,0,0,0.15)',
+                minor=dict(dtick=1, showgrid=True, gridcolor='rgba(0,0,0,0.05)')
+            ),
+            showlegend=False,
+            template='plotly_white',
+            height=400
+        )
+        return fig
+
     def create_virtual_keyboard(self, active_notes: List[str] = None) -> str:
         if active_notes is None:
             active_notes = []
@@ -139,42 +343,61 @@ class AudioVisualizer:
         keys_html += '</div></div>'
         return keyboard_css + keys_html
 
-    def create_note_visualization(self, notes: List[str], onset_frames: List[int], sr: float, confidences: List[float] = None) -> go.Figure:
+    def create_note_visualization(self, midi: np.ndarray, times: np.ndarray, confidences: List[float] = None,
+                                  cache_key: Optional[Hashable] = None) -> go.Figure:
+        """Piano roll of notes given as MIDI numbers and onset times in seconds"""
+        return self._cached_figure(
+            'piano_roll', cache_key,
+            lambda: self._build_note_visualization(midi, times, confidences)
+        )
+
+    def _build_note_visualization(self, midi: np.ndarray, times: np.ndarray,
+                                  confidences: List[float] = None) -> go.Figure:
         fig = go.Figure()
-        times = [frame * 512 / sr for frame in onset_frames]
-        if not confidences:
-            confidences = [1.0] * len(notes)
-        note_positions = {note: idx for idx, note in enumerate(sorted(set(notes)))}
-        y_positions = [note_positions[note] for note in notes]
-        for note in sorted(set(notes)):
-            is_black = '#' in note or 'b' in note
-            color = 'rgba(50, 50, 50, 0.1)' if is_black else 'rgba(200, 200, 200, 0.1)'
-            fig.add_shape(
-                type="rect",
-                x0=min(times) if times else 0,
-                x1=max(times) if times else 1,
-                y0=note_positions[note] - 0.4,
-                y1=note_positions[note] + 0.4,
-                fillcolor=color,
-                line=dict(color="rgba(0,0,0,0.2)"),
-                layer="below"
-            )
-        colors = ['rgba(31, 119, 180, {})'.format(conf) for conf in confidences]
-        fig.add_trace(go.Scatter(
+        midi = np.asarray(midi, dtype=np.int64)
+        times = np.asarray(times, dtype=np.float64)[:len(midi)]
+        midi = midi[:len(times)]
+        if confidences is None or len(confidences) == 0:
+            confidences = np.ones(len(midi))
+        confidences = np.asarray(confidences, dtype=np.float64)[:len(midi)]
+
+        # One row per distinct pitch, ordered low to high
+        rows, y_positions = np.unique(midi, return_inverse=True)
+        row_names = midi_to_name(np.maximum(rows, 0)).tolist()
+        x0 = times.min() if len(times) else 0
+        x1 = times.max() if len(times) else 1
+
+        # Row shading for every pitch in a single bar trace
+        fig.add_trace(go.Bar(
+            x=np.full(len(rows), max(x1 - x0, 1e-3)),
+            y=np.arange(len(rows)),
+            base=x0,
+            orientation='h',
+            width=0.8,
+            marker=dict(
+                color=np.where(IS_BLACK[np.maximum(rows, 0)], 'rgba(50, 50, 50, 0.1)', 'rgba(200, 200, 200, 0.1)'),
+                line=dict(color='rgba(0,0,0,0.2)', width=1)
+            ),
+            hoverinfo='skip',
+            name='Rows'
+        ))
+        scatter = self._scatter_trace(len(times))
+        fig.add_trace(scatter(
             x=times,
             y=y_positions,
             mode='markers',
             marker=dict(
                 size=12,
-                color=colors,
+                color='rgb(31, 119, 180)',
+                opacity=np.clip(confidences, 0.05, 1.0),
                 symbol='square',
                 line=dict(
                     color='rgba(0,0,0,0.5)',
                     width=1
                 )
             ),
-            text=[f"{note}<br>Confidence: {conf:.2f}" for note, conf in zip(notes, confidences)],
-            hoverinfo='text',
+            customdata=np.column_stack((midi_to_name(np.maximum(midi, 0)), np.round(confidences, 2))),
+            hovertemplate='%{customdata[0]}<br>Confidence: %{customdata[1]}<extra></extra>',
             name='Notes'
         ))
         fig.update_layout(
@@ -182,620 +405,84 @@ class AudioVisualizer:
             xaxis_title='Time (s)',
             yaxis=dict(
                 title='Notes',
-                ticktext=sorted(set(notes)),
-                tickvals=list(range(len(set(notes)))),
+                ticktext=row_names,
+                tickvals=list(range(len(rows))),
                 gridcolor='rgba(0,0,0,0.1)'
             ),
             showlegend=False,
-            height=max(400, len(set(notes)) * 25),
+            height=max(400, len(rows) * 25),
             template='plotly_white',
             plot_bgcolor='rgba(255,255,255,0.95)'
         )
         return fig
 
-    def create_audio_player_with_keyboard(self, audio_data: bytes, notes_data: Dict) -> str:
-        audio_b64 = base64.b64encode(audio_data).decode()
-
-        # Complete piano frequency mapping from C0 to B7 (96 keys)
-        note_frequencies = {
-            'C0': 16.35, 'C#0': 17.32, 'D0': 18.35, 'D#0': 19.45, 'E0': 20.60, 'F0': 21.83,
-            'F#0': 23.12, 'G0': 24.50, 'G#0': 25.96, 'A0': 27.50, 'A#0': 29.14, 'B0': 30.87,
-            'C1': 32.70, 'C#1': 34.65, 'D1': 36.71, 'D#1': 38.89, 'E1': 41.20, 'F1': 43.65,
-            'F#1': 46.25, 'G1': 49.00, 'G#1': 51.91, 'A1': 55.00, 'A#1': 58.27, 'B1': 61.74,
-            'C2': 65.41, 'C#2': 69.30, 'D2': 73.42, 'D#2': 77.78, 'E2': 82.41, 'F2': 87.31,
-            'F#2': 92.50, 'G2': 98.00, 'G#2': 103.83, 'A2': 110.00, 'A#2': 116.54, 'B2': 123.47,
-            'C3': 130.81, 'C#3': 138.59, 'D3': 146.83, 'D#3': 155.56, 'E3': 164.81, 'F3': 174.61,
-            'F#3': 185.00, 'G3': 196.00, 'G#3': 207.65, 'A3': 220.00, 'A#3': 233.08, 'B3': 246.94,
-            'C4': 261.63, 'C#4': 277.18, 'D4': 293.66, 'D#4': 311.13, 'E4': 329.63, 'F4': 349.23,
-            'F#4': 369.99, 'G4': 392.00, 'G#4': 415.30, 'A4': 440.00, 'A#4': 466.16, 'B4': 493.88,
-            'C5': 523.25, 'C#5': 554.37, 'D5': 587.33, 'D#5': 622.25, 'E5': 659.25, 'F5': 698.46,
-            'F#5': 739.99, 'G5': 783.99, 'G#5': 830.61, 'A5': 880.00, 'A#5': 932.33, 'B5': 987.77,
-            'C6': 1046.50, 'C#6': 1108.73, 'D6': 1174.66, 'D#6': 1244.51, 'E6': 1318.51, 'F6': 1396.91,
-            'F#6': 1479.98, 'G6': 1567.98, 'G#6': 1661.22, 'A6': 1760.00, 'A#6': 1864.66, 'B6': 1975.53,
-            'C7': 2093.00, 'C#7': 2217.46, 'D7': 2349.32, 'D#7': 2489.02, 'E7': 2637.02, 'F7': 2793.83,
-            'F#7': 2959.96, 'G7': 3135.96, 'G#7': 3322.44, 'A7': 3520.00, 'A#7': 3729.31, 'B7': 3951.07
-        }
-
-        # Prepare note timing data for JS animation
-        note_timings = []
-        for i, frame in enumerate(notes_data['onset_frames']):
-            if i < len(notes_data['notes']):
-                timing_ms = frame * 512 / notes_data['sr'] * 1000
-                note_name = notes_data['notes'][i]
-                note_name = note_name.replace('♯', '#').replace('b', '')  # normalize
-                note_timings.append({
-                    'note': note_name,
-                    'time': timing_ms,
-                    'duration': 400  # ms key highlight
-                })
-        
-        import json
-        note_timings_json = json.dumps(note_timings)
-        note_frequencies_json = json.dumps(note_frequencies)
-
-        html = f"""
-        <html>
-        <head>
-        <style>
-            .container {{
-                background: #191b22;
-                padding: 18px;
-                border-radius: 10px;
-                font-family: Arial, sans-serif;
-            }}
-            .audio-player {{
-                width: 100%;
-                margin-bottom: 14px;
-            }}
-            .audio-section {{
-                margin-bottom: 20px;
-            }}
-            .audio-label {{
-                color: #fff;
-                font-size: 14px;
-                font-weight: bold;
-                margin-bottom: 8px;
-                display: block;
-            }}
-            .converted-audio-controls {{
-                display: flex;
-                align-items: center;
-                gap: 10px;
-                margin-bottom: 14px;
-            }}
-            .play-button {{
-                background: #3a7cff;
-                color: white;
-                border: none;
-                padding: 8px 16px;
-                border-radius: 5px;
-                cursor: pointer;
-                font-size: 14px;
-                transition: background 0.2s;
-            }}
-            .play-button:hover {{
-                background: #2a6ce8;
-            }}
-            .play-button:disabled {{
-                background: #555;
-                cursor: not-allowed;
-            }}
-            .progress-bar {{
-                flex: 1;
-                height: 6px;
-                background: #333;
-                border-radius: 3px;
-                overflow: hidden;
-                cursor: pointer;
-            }}
-            .progress-fill {{
-                height: 100%;
-                background: #3a7cff;
-                width: 0%;
-                transition: width 0.1s;
-            }}
-            .time-display {{
-                color: #ccc;
-                font-size: 12px;
-                min-width: 80px;
-            }}
-            .piano-wrapper {{
-                overflow-x: auto;
-                overflow-y: hidden;
-                padding: 10px 0;
-                border-radius: 9px;
-                background: #242835;
-                max-width: 100%;
-            }}
-            .piano {{
-                display: flex;
-                position: relative;
-                justify-content: flex-start;
-                background: #242835;
-                padding: 12px 3px 30px 3px;
-                border-radius: 9px;
-                min-height: 185px;
-                user-select: none;
-                width: max-content;
-            }}
-            .key {{
-                width: 41px;
-                height: 152px;
-                background: #fff;
-                border: 1.2px solid #222;
-                position: relative;
-                margin: 0 2px;
-                border-radius: 0 0 6px 6px;
-                box-sizing: border-box;
-                z-index: 1;
-                cursor: pointer;
-                transition: background 0.18s, box-shadow 0.22s, border-color 0.19s;
-            }}
-            .key.detected {{
-                background: #ffe95e !important;
-                box-shadow: 0 0 20px #ffe95ecc, 0 0 2px #c5a200;
-                border-color: #c5a200;
-                z-index: 2;
-            }}
-            .key.hover {{
-                background: #89f3ec !important;
-                box-shadow: 0 0 10px #3df7e3a0;
-                border-color: #105a52;
-                z-index: 3;
-            }}
-            .black-key {{
-                width: 25px;
-                height: 93px;
-                background: #222;
-                position: absolute;
-                top: 0;
-                left: 29px;
-                margin-left: -13px;
-                z-index: 10;
-                border-radius: 0 0 3px 3px;
-                box-shadow: 1px 2px 10px #111b;
-                transition: background 0.18s, box-shadow 0.22s;
-                cursor: pointer;
-            }}
-            .black-key.detected {{
-                background: #ffc641 !important;
-                box-shadow: 0 0 16px #ffc979;
-            }}
-            .black-key.hover {{
-                background: #56cc9d !important;
-                box-shadow: 0 0 10px #41ffc2b0;
-            }}
-            .note-label {{
-                position: absolute;
-                bottom: 5px;
-                left: 50%;
-                transform: translateX(-50%);
-                font-size: 11px;
-                color: #2b4025;
-                z-index: 30;
-                pointer-events: none;
-            }}
-            .black-key .note-label {{
-                color: #f3ffe0;
-                bottom: 4px;
-            }}
-            /* Custom scrollbar styling */
-            .piano-wrapper::-webkit-scrollbar {{
-                height: 8px;
-            }}
-            .piano-wrapper::-webkit-scrollbar-track {{
-                background: #1a1a1a;
-                border-radius: 4px;
-            }}
-            .piano-wrapper::-webkit-scrollbar-thumb {{
-                background: #555;
-                border-radius: 4px;
-            }}
-            .piano-wrapper::-webkit-scrollbar-thumb:hover {{
-                background: #777;
-            }}
-        </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="audio-section">
-                    <label class="audio-label">Original Audio File</label>
-                    <audio id="audio-player" class="audio-player" controls>
-                        <source src="data:audio/wav;base64,{audio_b64}" type="audio/wav">
-                        Your browser does not support the audio element.
-                    </audio>
-                </div>
-                
-                <div class="audio-section">
-                    <label class="audio-label">Converted Piano Audio</label>
-                    <div class="converted-audio-controls">
-                        <button id="play-converted-btn" class="play-button">Play</button>
-                        <div class="progress-bar" id="progress-bar">
-                            <div class="progress-fill" id="progress-fill"></div>
-                        </div>
-                        <span class="time-display" id="time-display">0:00 / 0:00</span>
-                    </div>
-                </div>
-                
-                <div class="piano-wrapper">
-                    <div class="piano" id="piano">
-        """
-
-        # Generate complete piano keyboard from C0 to B7 (8 octaves, 96 keys total)
-        white_keys = ['C', 'D', 'E', 'F', 'G', 'A', 'B']
-        black_key_positions = {
-            'C': 'C#', 'D': 'D#', 'F': 'F#', 'G': 'G#', 'A': 'A#'
-        }
-        
-        for octave in range(0, 8):  # C0 to B7
-            for white_key in white_keys:
-                note_name = f"{white_key}{octave}"
-                html += f'<div class="key" data-note="{note_name}"><span class="note-label">{note_name}</span>'
-                
-                # Add black key if it exists for this white key
-                if white_key in black_key_positions:
-                    black_note = f"{black_key_positions[white_key]}{octave}"
-                    html += f'<div class="black-key" data-note="{black_note}"><span class="note-label">{black_note}</span></div>'
-                
-                html += '</div>'
-
-        html += """
-                    </div>
-                </div>
-            </div>
-        <script>
-        const piano = document.getElementById('piano');
-        const audio = document.getElementById('audio-player');
-        const playConvertedBtn = document.getElementById('play-converted-btn');
-        const progressBar = document.getElementById('progress-bar');
-        const progressFill = document.getElementById('progress-fill');
-        const timeDisplay = document.getElementById('time-display');
-        const noteData = """ + note_timings_json + """;
-        const noteFrequencies = """ + note_frequencies_json + """;
-        
-        // Audio context for sound generation
-        let audioContext = null;
-        let isPlayingConverted = false;
-        let convertedAudioStartTime = 0;
-        let convertedAudioDuration = 0;
-        let animationId = null;
-        
-        // Calculate total duration from note data
-        if (noteData.length > 0) {
-            convertedAudioDuration = Math.max(...noteData.map(n => n.time)) / 1000 + 2; // Add 2 seconds buffer
-        }
-        
-        // Initialize audio context
-        function initAudioContext() {
-            if (audioContext) return;
-            try {
-                audioContext = new (window.AudioContext || window.webkitAudioContext)();
-            } catch (e) {
-                console.error("Web Audio API not supported:", e);
-            }
-        }
-
-        function normalize(note) {
-            return note.replace("♯", "#").replace("b", "");
-        }
-
-        // Enhanced grand piano sound synthesis with authentic low-end timbre
-        function playRealisticPianoSound(noteName, startTime = null) {
-            initAudioContext();
-            
-            if (!audioContext) {
-                console.error("Audio context not available");
-                return;
-            }
-
-            try {
-                const frequency = noteFrequencies[noteName];
-                if (!frequency) {
-                    console.warn("Frequency not found for note:", noteName);
-                    return;
-                }
-
-                const now = startTime || audioContext.currentTime;
-                
-                // Enhanced duration and characteristics for different frequency ranges
-                let duration, baseAmplitude, waveType, harmonicCount;
-                
-                if (frequency <= 196) { // C0 to G3 - Enhanced bass characteristics
-                    duration = 1.5; // Shorter for converted audio
-                    baseAmplitude = 0.4; // Reduced amplitude for mixing
-                    waveType = 'sawtooth';
-                    harmonicCount = 6;
-                } else if (frequency <= 523) { // A3 to C5 - Mid range
-                    duration = 1.2;
-                    baseAmplitude = 0.3;
-                    waveType = 'triangle';
-                    harmonicCount = 4;
-                } else if (frequency <= 1500) { // Mid-high range
-                    duration = 1.0;
-                    baseAmplitude = 0.25;
-                    waveType = 'triangle';
-                    harmonicCount = 3;
-                } else { // High treble
-                    duration = 0.8;
-                    baseAmplitude = 0.2;
-                    waveType = 'sine';
-                    harmonicCount = 2;
-                }
-
-                const oscillators = [];
-                const gainNodes = [];
-
-                // Fundamental frequency
-                const osc1 = audioContext.createOscillator();
-                const gain1 = audioContext.createGain();
-                osc1.connect(gain1);
-                gain1.connect(audioContext.destination);
-                osc1.frequency.setValueAtTime(frequency, now);
-                osc1.type = waveType;
-                oscillators.push(osc1);
-                gainNodes.push(gain1);
-
-                // Enhanced harmonic series
-                const harmonicRatios = [2, 3, 4, 5, 6, 7];
-                const harmonicAmplitudes = frequency <= 196 ? 
-                    [0.25, 0.15, 0.1, 0.06, 0.04, 0.03] : 
-                    frequency <= 523 ? 
-                    [0.2, 0.12, 0.08, 0.05] : 
-                    frequency <= 1500 ? 
-                    [0.15, 0.1, 0.05] : 
-                    [0.12, 0.06];
-
-                for (let i = 0; i < Math.min(harmonicCount - 1, harmonicRatios.length); i++) {
-                    const harmonic = audioContext.createOscillator();
-                    const harmonicGain = audioContext.createGain();
-                    harmonic.connect(harmonicGain);
-                    harmonicGain.connect(audioContext.destination);
-                    
-                    harmonic.frequency.setValueAtTime(frequency * harmonicRatios[i], now);
-                    harmonic.type = i < 2 ? 'sine' : 'triangle';
-                    
-                    oscillators.push(harmonic);
-                    gainNodes.push(harmonicGain);
-                }
-
-                // ADSR envelope
-                const amplitudes = [baseAmplitude, ...harmonicAmplitudes.slice(0, harmonicCount - 1)];
-                
-                gainNodes.forEach((gain, index) => {
-                    if (index < amplitudes.length) {
-                        const amp = amplitudes[index];
-                        
-                        let attackTime, decayTime, sustainLevel;
-                        
-                        if (frequency <= 196) {
-                            attackTime = 0.05;
-                            decayTime = 0.2;
-                            sustainLevel = 0.7;
-                        } else if (frequency <= 523) {
-                            attackTime = 0.03;
-                            decayTime = 0.15;
-                            sustainLevel = 0.6;
-                        } else {
-                            attackTime = 0.02;
-                            decayTime = 0.1;
-                            sustainLevel = 0.5;
-                        }
-                        
-                        gain.gain.setValueAtTime(0, now);
-                        gain.gain.linearRampToValueAtTime(amp, now + attackTime);
-                        gain.gain.exponentialRampToValueAtTime(amp * sustainLevel, now + attackTime + decayTime);
-                        gain.gain.exponentialRampToValueAtTime(0.001, now + duration);
-                    }
-                });
-
-                // Start all oscillators
-                oscillators.forEach(osc => {
-                    osc.start(now);
-                    osc.stop(now + duration);
-                });
-
-            } catch (e) {
-                console.error("Error playing piano sound:", e);
-            }
-        }
-
-        // Play converted audio sequence
-        function playConvertedAudio() {
-            if (isPlayingConverted) {
-                stopConvertedAudio();
-                return;
-            }
-            
-            initAudioContext();
-            if (!audioContext) return;
-            
-            isPlayingConverted = true;
-            convertedAudioStartTime = audioContext.currentTime;
-            playConvertedBtn.textContent = 'Stop';
-            
-            // Schedule all notes
-            noteData.forEach(noteInfo => {
-                const noteTime = convertedAudioStartTime + (noteInfo.time / 1000);
-                playRealisticPianoSound(normalize(noteInfo.note), noteTime);
-            });
-            
-            // Start progress animation
-            updateConvertedProgress();
-        }
-        
-        function stopConvertedAudio() {
-            isPlayingConverted = false;
-            playConvertedBtn.textContent = 'Play';
-            if (animationId) {
-                cancelAnimationFrame(animationId);
-                animationId = null;
-            }
-            progressFill.style.width = '0%';
-            updateTimeDisplay(0);
-        }
-        
-        function updateConvertedProgress() {
-            if (!isPlayingConverted) return;
-            
-            const currentTime = audioContext.currentTime - convertedAudioStartTime;
-            const progress = Math.min(currentTime / convertedAudioDuration, 1);
-            
-            progressFill.style.width = (progress * 100) + '%';
-            updateTimeDisplay(currentTime);
-            
-            // Highlight keys during playback
-            noteData.forEach(noteInfo => {
-                const noteTime = noteInfo.time / 1000;
-                if (Math.abs(currentTime - noteTime) < 0.1) {
-                    highlightDetectedKey(normalize(noteInfo.note), 200);
-                }
-            });
-            
-            if (progress >= 1) {
-                stopConvertedAudio();
-            } else {
-                animationId = requestAnimationFrame(updateConvertedProgress);
-            }
-        }
-        
-        function updateTimeDisplay(currentTime) {
-            const current = Math.max(0, currentTime);
-            const total = convertedAudioDuration;
-            
-            const formatTime = (time) => {
-                const minutes = Math.floor(time / 60);
-                const seconds = Math.floor(time % 60);
-                return minutes + ':' + seconds.toString().padStart(2, '0');
-            };
-            
-            timeDisplay.textContent = formatTime(current) + ' / ' + formatTime(total);
-        }
-        
-        // Progress bar click handler
-        progressBar.addEventListener('click', (e) => {
-            if (!isPlayingConverted) return;
-            
-            const rect = progressBar.getBoundingClientRect();
-            const clickX = e.clientX - rect.left;
-            const progress = clickX / rect.width;
-            const newTime = progress * convertedAudioDuration;
-            
-            // Restart from new position
-            stopConvertedAudio();
-            setTimeout(() => {
-                convertedAudioStartTime = audioContext.currentTime - newTime;
-                isPlayingConverted = true;
-                playConvertedBtn.textContent = 'Stop';
-                
-                // Schedule remaining notes
-                noteData.forEach(noteInfo => {
-                    const noteTime = noteInfo.time / 1000;
-                    if (noteTime >= newTime) {
-                        const scheduleTime = convertedAudioStartTime + noteTime;
-                        playRealisticPianoSound(normalize(noteInfo.note), scheduleTime);
-                    }
-                });
-                
-                updateConvertedProgress();
-            }, 100);
-        });
-
-        // Highlight for detected notes
-        function highlightDetectedKey(noteName, duration = 400) {
-            const el = piano.querySelector('[data-note="' + noteName + '"]');
-            if (!el) return;
-            if (!el.classList.contains('detected')) {
-                el.classList.add("detected");
-                setTimeout(() => el.classList.remove("detected"), duration);
-            }
-        }
+    def create_note_window(self, window: Dict[str, np.ndarray], t0: float, t1: float,
+                           midi_range: Tuple[int, int], cache_key: Optional[Hashable] = None) -> go.Figure:
+        return self._cached_figure(
+            'piano_roll_window', None if cache_key is None else (cache_key, t0, t1),
+            lambda: self._build_note_window(window, t0, t1, midi_range)
+        )
 
-        // Original audio animation
-        let raf = null;
-        function animateKeys() {
-            const tNow = audio.currentTime * 1000;
-            for (let nd of noteData) {
-                if (Math.abs(tNow - nd.time) < 80) {
-                    highlightDetectedKey(normalize(nd.note), nd.duration || 400);
-                }
-            }
-            if (!audio.paused && !audio.ended) {
-                raf = requestAnimationFrame(animateKeys);
-            }
-        }
-        
-        // Event listeners
-        playConvertedBtn.addEventListener('click', playConvertedAudio);
-        
-        audio.addEventListener('play', () => {
-            if (raf) cancelAnimationFrame(raf);
-            animateKeys();
-        });
-        audio.addEventListener('pause', () => { 
-            if (raf) cancelAnimationFrame(raf); 
-        });
-        audio.addEventListener('ended', () => { 
-            if (raf) cancelAnimationFrame(raf); 
-        });
-
-        // Attach event listeners to all keys
-        function attachKeyEvents() {
-            const allKeys = piano.querySelectorAll('.key, .black-key');
-            
-            allKeys.forEach(function(key) {
-                // Hover effects
-                key.addEventListener('mouseenter', function() {
-                    this.classList.add('hover');
-                });
-                key.addEventListener('mouseleave', function() {
-                    this.classList.remove('hover');
-                });
-                
-                // Click events
-                key.addEventListener('mousedown', function(e) {
-                    e.preventDefault();
-                    e.stopPropagation();
-                    const noteName = this.getAttribute('data-note');
-                    playRealisticPianoSound(noteName);
-                    this.classList.add('hover');
-                    setTimeout(() => this.classList.remove('hover'), 200);
-                });
-                
-                // Touch events for mobile
-                key.addEventListener('touchstart', function(e) {
-                    e.preventDefault();
-                    e.stopPropagation();
-                    const noteName = this.getAttribute('data-note');
-                    playRealisticPianoSound(noteName);
-                    this.classList.add('hover');
-                    setTimeout(() => this.classList.remove('hover'), 200);
-                });
-            });
-        }
-        
-        // Initialize audio context on first user interaction
-        document.addEventListener('click', initAudioContext, {once: true});
-        document.addEventListener('touchstart', initAudioContext, {once: true});
-        
-        // Attach events when DOM is ready
-        if (document.readyState === 'loading') {
-            document.addEventListener('DOMContentLoaded', attachKeyEvents);
-        } else {
-            attachKeyEvents();
-        }
-        
-        // Initialize time display
-        updateTimeDisplay(0);
-        
-        // Fallback to ensure events are attached
-        setTimeout(attachKeyEvents, 100);
-        </script>
-        </body>
-        </html>
-        """
-        return html
+    def _build_note_window(self, window: Dict[str, np.ndarray], t0: float, t1: float,
+                           midi_range: Tuple[int, int]) -> go.Figure:
+        fig = go.Figure()
+        low, high = midi_range
+        rows = np.arange(low, high + 1)
+        # Row shading spans the whole window so the grid stays put while scrolling
+        fig.add_trace(go.Bar(
+            x=np.full(len(rows), t1 - t0),
+            y=rows,
+            base=t0,
+            orientation='h',
+            width=0.8,
+            marker=dict(
+                color=np.where(IS_BLACK[rows], 'rgba(50, 50, 50, 0.1)', 'rgba(200, 200, 200, 0.1)'),
+                line=dict(width=0)
+            ),
+            hoverinfo='skip',
+            name='Rows'
+        ))
+        midi = window['midi'].astype(np.int64)
+        fig.add_trace(go.Bar(
+            x=window['durations'],
+            y=midi,
+            base=window['starts'],
+            orientation='h',
+            width=0.8,
+            marker=dict(
+                color='rgb(31, 119, 180)',
+                opacity=np.clip(window['confidences'], 0.05, 1.0) if len(midi) else 1.0,
+                line=dict(color='rgba(0,0,0,0.5)', width=1)
+            ),
+            customdata=np.column_stack((midi_to_name(midi), np.round(window['confidences'], 2))),
+            hovertemplate='%{customdata[0]}<br>Confidence: %{customdata[1]}<extra></extra>',
+            name='Notes'
+        ))
+        fig.update_layout(
+            title='Piano Roll View',
+            xaxis=dict(title='Time (s)', range=[t0, t1]),
+            yaxis=dict(
+                title='Notes',
+                range=[low - 0.5, high + 0.5],
+                tickvals=rows,
+                ticktext=midi_to_name(rows).tolist(),
+                gridcolor='rgba(0,0,0,0.1)'
+            ),
+            barmode='overlay',
+            showlegend=False,
+            height=max(400, len(rows) * 18),
+            template='plotly_white',
+            plot_bgcolor='rgba(255,255,255,0.95)'
+        )
+        return fig
 
     def create_instrument_confidence_chart(self, confidence_scores: Dict[str, float]) -> go.Figure:
+        return self._cached_figure(
+            'instrument_confidence', tuple(confidence_scores.items()),
+            lambda: self._build_instrument_confidence_chart(confidence_scores)
+        )
+
+    def _build_instrument_confidence_chart(self, confidence_scores: Dict[str, float]) -> go.Figure:
         fig = go.Figure()
         instruments = list(confidence_scores.keys())
         scores = list(confidence_scores.values())
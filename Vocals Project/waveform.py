@@ -0,0 +1,61 @@
+import numpy as np
+from typing import List, Tuple
+
+
+class WaveformPyramid:
+    """Min, max and RMS of a signal over power-of-two blocks, quantized for drawing
+
+    Level 0 summarises base_block samples per column and every further level merges pairs
+    of columns of the one below, until a level has at most min_columns. A column is three
+    int8 values (min, max, RMS) scaled to the signal's peak, and columns are interleaved so
+    any span of one level is a single contiguous byte range of to_bytes().
+    """
+
+    def __init__(self, levels: List[np.ndarray], base_block: int, n_samples: int, peak: float):
+        self.levels = levels
+        self.base_block = base_block
+        self.n_samples = n_samples
+        self.peak = peak
+
+    @classmethod
+    def from_signal(cls, y: np.ndarray, base_block: int = 256, min_columns: int = 512) -> 'WaveformPyramid':
+        full = len(y) // base_block
+        blocks = y[:full * base_block].reshape(full, base_block)
+        lows, highs = blocks.min(axis=1, initial=np.inf), blocks.max(axis=1, initial=-np.inf)
+        energy = np.einsum('ij,ij->i', blocks, blocks, dtype=np.float64)
+        counts = np.full(full, base_block, dtype=np.int64)
+        if full * base_block < len(y):
+            tail = y[full * base_block:]
+            lows, highs = np.append(lows, tail.min()), np.append(highs, tail.max())
+            energy = np.append(energy, tail.astype(np.float64) @ tail)
+            counts = np.append(counts, len(tail))
+
+        peak = float(max(highs.max(initial=0), -lows.min(initial=0)))
+        scale = 127 / peak if peak > 0 else 0.0
+        levels = []
+        while True:
+            levels.append(np.stack((
+                np.floor(lows * scale), np.ceil(highs * scale), np.round(np.sqrt(energy / counts) * scale)
+            ), axis=1).clip(-127, 127).astype(np.int8))
+            if len(lows) <= min_columns:
+                break
+            pairs = np.arange(0, len(lows), 2)
+            lows, highs = np.minimum.reduceat(lows, pairs), np.maximum.reduceat(highs, pairs)
+            energy, counts = np.add.reduceat(energy, pairs), np.add.reduceat(counts, pairs)
+        return cls(levels, base_block, len(y), peak)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(level.nbytes for level in self.levels)
+
+    def table(self) -> List[Tuple[int, int, int]]:
+        """Samples per column, byte offset and column count of every level, finest first"""
+        table = []
+        offset = 0
+        for i, level in enumerate(self.levels):
+            table.append((self.base_block << i, offset, len(level)))
+            offset += level.nbytes
+        return table
+
+    def to_bytes(self) -> bytes:
+        return b''.join(level.tobytes() for level in self.levels)